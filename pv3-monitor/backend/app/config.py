@@ -14,6 +14,33 @@ class Settings(BaseSettings):
     # P3 Device
     p3_device_id: str = "PV001001DEV"
 
+    # Subscribe to pv/PV3/+/# and handle every device on the broker, each under the
+    # device ID in its topics, instead of only p3_device_id
+    mqtt_all_devices: bool = False
+
+    # Messages handed from the MQTT network thread to the event loop: queue bound
+    # (further messages are dropped and counted) and messages handled per batch
+    mqtt_queue_capacity: int = 10000
+    mqtt_queue_batch: int = 500
+
+    # Store what MQTTService receives directly instead of relying on the standalone
+    # collector posting it back over HTTP. Off by default: with both writing the same
+    # device, every sample would be stored twice.
+    mqtt_ingest_enabled: bool = False
+
+    # JSON file overriding the per-metric outlier filter rules (pv3common.outlier)
+    outlier_config: str = ""
+
+    # Bulk measurement writes use binary COPY on PostgreSQL/asyncpg (else multi-row INSERTs)
+    bulk_write_copy: bool = True
+
+    # Group-commit ingest queue (app.services.ingest_queue), shared by the batch endpoint
+    # and streaming ingest (WebSocket /api/ws/ingest)
+    ingest_commit_max_rows: int = 5000
+    ingest_commit_max_delay_ms: int = 50
+    ingest_queue_max_pending: int = 1000
+    ingest_max_pending_frames: int = 64
+
     # API
     api_host: str = "0.0.0.0"
     api_port: int = 8000
@@ -1,8 +1,14 @@
+import logging
+
+from sqlalchemy import inspect, text
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
 
 from app.config import settings
 
+logger = logging.getLogger(__name__)
+
 
 class Base(DeclarativeBase):
     """Base class for all database models."""
@@ -22,13 +28,48 @@ async_session_maker = async_sessionmaker(
 )
 
 
+# INSERT constructs with ON CONFLICT support, per dialect
+_UPSERT_INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+def upsert_insert(session: AsyncSession):
+    """The session's dialect-specific ``insert`` with ON CONFLICT support, or None."""
+    return _UPSERT_INSERTS.get(session.get_bind().dialect.name)
+
+
 async def get_db() -> AsyncSession:
     """Dependency to get database session."""
     async with async_session_maker() as session:
         yield session
 
 
+# Nullable columns added to tables after their first release. create_all never alters a
+# table that already exists, so init_db adds any of these an older database lacks.
+ADDED_COLUMNS = {
+    "measurements": ("value_min", "value_max", "value_last", "sample_count"),
+    "devices": ("mqtt_host", "mqtt_port"),
+}
+
+
+def _add_missing_columns(connection) -> None:
+    inspector = inspect(connection)
+    quote = connection.dialect.identifier_preparer.quote
+    for table_name, column_names in ADDED_COLUMNS.items():
+        existing = {column["name"] for column in inspector.get_columns(table_name)}
+        table = Base.metadata.tables[table_name]
+        for name in column_names:
+            if name in existing:
+                continue
+            column_type = table.c[name].type.compile(dialect=connection.dialect)
+            connection.execute(text(f"ALTER TABLE {quote(table_name)} ADD COLUMN {quote(name)} {column_type}"))
+            logger.info(f"Added column {table_name}.{name}")
+
+
 async def init_db() -> None:
-    """Initialize database tables."""
+    """Initialize database tables and add columns missing from older databases."""
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
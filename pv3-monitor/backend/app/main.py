@@ -11,9 +11,14 @@ from app.routers import (
     measurements_router,
     alarms_router,
     websocket_router,
+    ingest_router,
+    frequency_events_router,
 )
 from app.routers import settings as settings_router
 from app.routers import history as history_router
+from app.services.alarm_state import alarm_state
+from app.services.device_registry import device_registry
+from app.services.ingest_queue import ingest_queue
 from app.services.mqtt_client import mqtt_service, setup_mqtt_handlers
 
 # Configure logging
@@ -33,6 +38,9 @@ async def lifespan(app: FastAPI):
     # Initialize database
     await init_db()
     logger.info("Database initialized")
+    await device_registry.load()
+    await alarm_state.load()
+    ingest_queue.start()
 
     # Setup MQTT handlers and connect
     setup_mqtt_handlers()
@@ -45,6 +53,9 @@ async def lifespan(app: FastAPI):
     # Shutdown
     logger.info("Shutting down PV3 Monitor API")
     mqtt_service.disconnect()
+    await mqtt_service.close()
+    # Commit measurements still waiting in the ingest queue
+    await ingest_queue.stop()
 
 
 app = FastAPI(
@@ -68,6 +79,8 @@ app.include_router(devices_router)
 app.include_router(measurements_router)
 app.include_router(alarms_router)
 app.include_router(websocket_router)
+app.include_router(ingest_router)
+app.include_router(frequency_events_router)
 app.include_router(settings_router.router)
 app.include_router(history_router.router)
 
@@ -89,4 +102,5 @@ async def health():
     return {
         "status": "healthy",
         "mqtt_connected": mqtt_service.connected,
+        "mqtt_queue": mqtt_service.stats(),
     }
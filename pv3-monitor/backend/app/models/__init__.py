@@ -1,5 +1,6 @@
 from app.models.device import Device
 from app.models.measurement import Measurement
 from app.models.alarm import Alarm, AlarmEvent
+from app.models.frequency_event import FrequencyEvent
 
-__all__ = ["Device", "Measurement", "Alarm", "AlarmEvent"]
+__all__ = ["Device", "Measurement", "Alarm", "AlarmEvent", "FrequencyEvent"]
@@ -15,6 +15,9 @@ class Device(Base):
     device_id: Mapped[str] = mapped_column(String(50), unique=True, index=True)
     name: Mapped[str] = mapped_column(String(100), nullable=True)
     capacity_kwh: Mapped[float] = mapped_column(nullable=True)
+    # Broker the fleet collector connects to for this device
+    mqtt_host: Mapped[str] = mapped_column(String(255), nullable=True)
+    mqtt_port: Mapped[int] = mapped_column(nullable=True)
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True),
         server_default=func.now(),
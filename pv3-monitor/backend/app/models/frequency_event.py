@@ -0,0 +1,39 @@
+from datetime import datetime
+
+from sqlalchemy import JSON, String, DateTime, Float, Integer, ForeignKey, Index, func
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.database import Base
+
+
+class FrequencyEvent(Base):
+    """Full-rate samples captured around a grid frequency excursion.
+
+    The collector's burst capture sends one record per event; ``series`` holds a
+    ``{"t": [ms offsets from start_time], "v": [values]}`` pair of arrays per metric.
+    """
+
+    __tablename__ = "frequency_events"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    device_id: Mapped[str] = mapped_column(
+        String(50),
+        ForeignKey("devices.device_id"),
+        index=True,
+    )
+    trigger_time: Mapped[datetime] = mapped_column(DateTime(timezone=True), index=True)
+    trigger_frequency: Mapped[float] = mapped_column(Float)
+    min_frequency: Mapped[float] = mapped_column(Float)
+    max_frequency: Mapped[float] = mapped_column(Float)
+    start_time: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    end_time: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    sample_count: Mapped[int] = mapped_column(Integer)
+    series: Mapped[dict] = mapped_column(JSON)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+    )
+
+    __table_args__ = (
+        Index("ix_frequency_events_device_time", "device_id", "trigger_time"),
+    )
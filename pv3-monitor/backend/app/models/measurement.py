@@ -31,6 +31,13 @@ class Measurement(Base):
     unit: Mapped[str] = mapped_column(String(20), nullable=True)
     source_topic: Mapped[str] = mapped_column(String(100), nullable=True)
 
+    # Set on pre-aggregated rows only: metric_value is then the window mean and
+    # timestamp the window start
+    value_min: Mapped[float] = mapped_column(Float, nullable=True)
+    value_max: Mapped[float] = mapped_column(Float, nullable=True)
+    value_last: Mapped[float] = mapped_column(Float, nullable=True)
+    sample_count: Mapped[int] = mapped_column(nullable=True)
+
     __table_args__ = (
         Index("ix_measurements_device_time", "device_id", "timestamp"),
         Index("ix_measurements_device_metric", "device_id", "metric_name"),
@@ -2,10 +2,14 @@ from app.routers.devices import router as devices_router
 from app.routers.measurements import router as measurements_router
 from app.routers.alarms import router as alarms_router
 from app.routers.websocket import router as websocket_router
+from app.routers.ingest import router as ingest_router
+from app.routers.frequency_events import router as frequency_events_router
 
 __all__ = [
     "devices_router",
     "measurements_router",
     "alarms_router",
     "websocket_router",
+    "ingest_router",
+    "frequency_events_router",
 ]
@@ -6,30 +6,24 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.database import get_db
 from app.models.alarm import Alarm, AlarmEvent
-from app.models.device import Device
 from app.schemas.alarm import AlarmResponse, AlarmEventResponse, AlarmStatus
-from app.routers.websocket import broadcast_alarm_update
+from app.routers.websocket import broadcast_alarms_update
+from app.services.alarm_state import alarm_state
+from app.services.device_registry import device_registry
 
 router = APIRouter(prefix="/api/devices/{device_id}/alarms", tags=["alarms"])
 
 
 @router.get("", response_model=AlarmStatus)
-async def get_alarm_status(
-    device_id: str,
-    db: AsyncSession = Depends(get_db),
-) -> AlarmStatus:
-    """Get current alarm status for a device."""
-    result = await db.execute(
-        select(Alarm).where(Alarm.device_id == device_id)
-    )
-    alarms = result.scalars().all()
-
+async def get_alarm_status(device_id: str) -> AlarmStatus:
+    """Get current alarm status for a device, from the in-memory alarm state."""
+    alarms = alarm_state.get(device_id)
     if not alarms:
         raise HTTPException(status_code=404, detail="No alarm data found")
 
-    active_alarms = [a.alarm_name for a in alarms if a.is_active]
-    all_alarms = {a.alarm_name: a.is_active for a in alarms}
-    latest_update = max(a.updated_at for a in alarms)
+    active_alarms = [name for name, (is_active, _) in alarms.items() if is_active]
+    all_alarms = {name: is_active for name, (is_active, _) in alarms.items()}
+    latest_update = max(updated_at for _, updated_at in alarms.values())
 
     return AlarmStatus(
         device_id=device_id,
@@ -86,76 +80,21 @@ async def get_alarm(
 async def update_alarms(
     device_id: str,
     alarm_states: dict[str, bool],
-    db: AsyncSession = Depends(get_db),
 ) -> dict:
-    """Update alarm states for a device."""
+    """Update alarm states for a device.
+
+    Only flags whose state changed are written; see app.services.alarm_state.
+    """
     # Ensure device exists or create it
-    result = await db.execute(
-        select(Device).where(Device.device_id == device_id)
-    )
-    device = result.scalar_one_or_none()
-    if not device:
-        device = Device(device_id=device_id)
-        db.add(device)
-        await db.commit()
-
-    updated_count = 0
-    events_created = 0
-
-    for alarm_name, is_active in alarm_states.items():
-        # Get existing alarm state
-        result = await db.execute(
-            select(Alarm)
-            .where(Alarm.device_id == device_id)
-            .where(Alarm.alarm_name == alarm_name)
-        )
-        alarm = result.scalar_one_or_none()
-
-        if alarm:
-            # Check if state changed
-            if alarm.is_active != is_active:
-                alarm.is_active = is_active
-                updated_count += 1
-
-                # Create alarm event
-                event = AlarmEvent(
-                    device_id=device_id,
-                    alarm_name=alarm_name,
-                    event_type="triggered" if is_active else "cleared",
-                )
-                db.add(event)
-                events_created += 1
-
-                # Broadcast to WebSocket clients
-                await broadcast_alarm_update(device_id, alarm_name, is_active)
-        else:
-            # Create new alarm
-            alarm = Alarm(
-                device_id=device_id,
-                alarm_name=alarm_name,
-                is_active=is_active,
-            )
-            db.add(alarm)
-            updated_count += 1
-
-            # Create initial event if active
-            if is_active:
-                event = AlarmEvent(
-                    device_id=device_id,
-                    alarm_name=alarm_name,
-                    event_type="triggered",
-                )
-                db.add(event)
-                events_created += 1
-
-                # Broadcast to WebSocket clients
-                await broadcast_alarm_update(device_id, alarm_name, is_active)
-
-    await db.commit()
+    await device_registry.ensure(device_id)
+
+    changed, events_created = await alarm_state.apply(device_id, alarm_states)
+    if changed:
+        # One message for all flags that changed
+        await broadcast_alarms_update(device_id, changed)
 
     return {
         "device_id": device_id,
-        "alarms_updated": updated_count,
+        "alarms_updated": len(changed),
         "events_created": events_created,
     }
-
@@ -5,6 +5,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import get_db
 from app.models.device import Device
 from app.schemas.device import DeviceCreate, DeviceResponse, DeviceUpdate
+from app.services.device_registry import device_registry
 
 router = APIRouter(prefix="/api/devices", tags=["devices"])
 
@@ -70,6 +71,7 @@ async def update_device(
         setattr(device, key, value)
 
     await db.commit()
+    device_registry.invalidate(device_id)
     await db.refresh(device)
     return device
 
@@ -89,3 +91,4 @@ async def delete_device(
 
     await db.delete(device)
     await db.commit()
+    device_registry.invalidate(device_id)
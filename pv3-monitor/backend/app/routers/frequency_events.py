@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta, timezone
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import get_db
+from app.models.frequency_event import FrequencyEvent
+from app.schemas.frequency_event import (
+    FrequencyEventCreate,
+    FrequencyEventSummary,
+    FrequencyEventResponse,
+)
+from app.services.device_registry import device_registry
+
+router = APIRouter(prefix="/api/devices/{device_id}/frequency-events", tags=["frequency-events"])
+
+
+@router.post("", status_code=201)
+async def create_frequency_event(
+    device_id: str,
+    event_data: FrequencyEventCreate,
+    db: AsyncSession = Depends(get_db),
+) -> dict:
+    """Store a frequency event captured by the collector."""
+    # Ensure device exists or create it
+    await device_registry.ensure(device_id)
+
+    event = FrequencyEvent(
+        device_id=device_id,
+        **event_data.model_dump(),
+    )
+    db.add(event)
+    await db.commit()
+
+    return {"id": event.id, "device_id": device_id}
+
+
+@router.get("", response_model=list[FrequencyEventSummary])
+async def list_frequency_events(
+    device_id: str,
+    start: datetime = Query(
+        default_factory=lambda: datetime.now(timezone.utc) - timedelta(days=7),
+        description="Start time",
+    ),
+    end: datetime = Query(
+        default_factory=lambda: datetime.now(timezone.utc),
+        description="End time",
+    ),
+    limit: int = Query(default=100, le=1000, description="Max events"),
+    db: AsyncSession = Depends(get_db),
+) -> list[FrequencyEventSummary]:
+    """List frequency events for a device, newest first, without their samples."""
+    columns = [getattr(FrequencyEvent, field) for field in FrequencyEventSummary.model_fields]
+    result = await db.execute(
+        select(*columns)
+        .where(FrequencyEvent.device_id == device_id)
+        .where(FrequencyEvent.trigger_time >= start)
+        .where(FrequencyEvent.trigger_time <= end)
+        .order_by(FrequencyEvent.trigger_time.desc())
+        .limit(limit)
+    )
+    return [FrequencyEventSummary(**row._mapping) for row in result]
+
+
+@router.get("/{event_id}", response_model=FrequencyEventResponse)
+async def get_frequency_event(
+    device_id: str,
+    event_id: int,
+    db: AsyncSession = Depends(get_db),
+) -> FrequencyEvent:
+    """Get one frequency event with its full-rate samples."""
+    result = await db.execute(
+        select(FrequencyEvent)
+        .where(FrequencyEvent.device_id == device_id)
+        .where(FrequencyEvent.id == event_id)
+    )
+    event = result.scalar_one_or_none()
+    if not event:
+        raise HTTPException(status_code=404, detail="Frequency event not found")
+    return event
@@ -0,0 +1,136 @@
+import asyncio
+import json
+import logging
+from datetime import datetime, timezone
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from pydantic import ValidationError
+
+from app.config import settings
+from app.routers.websocket import broadcast_measurement_update
+from app.schemas.ingest import IngestFrame
+from app.services.bulk_write import measurement_rows
+from app.services.device_registry import device_registry
+from app.services.ingest_queue import ingest_queue
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(tags=["ingest"])
+
+
+@router.websocket("/api/ws/ingest")
+async def ingest_endpoint(websocket: WebSocket) -> None:
+    """Streaming measurement ingest for collectors.
+
+    Clients send IngestFrame JSON messages with increasing ``seq``. Frames are
+    written in group commits: each commit takes every frame that arrived while the
+    previous one was running, and is acknowledged with ``{"ack": seq}`` for the
+    highest frame it contains (acks are cumulative). Commits go through the shared
+    ingest queue, so frames from all connections share transactions. A frame that fails validation
+    is answered with ``{"nack": seq, "error": ...}`` and skipped. At most
+    ``ingest_max_pending_frames`` frames are buffered per connection; beyond that
+    the server stops reading, which pushes back on the client.
+    """
+    await websocket.accept()
+    client = f"{websocket.client.host}:{websocket.client.port}" if websocket.client else "unknown"
+    logger.info(f"Ingest stream opened from {client}")
+
+    frames: asyncio.Queue[IngestFrame] = asyncio.Queue(maxsize=settings.ingest_max_pending_frames)
+    stats = {"frames": 0, "rows": 0, "commits": 0}
+    writer = asyncio.create_task(_write_frames(websocket, frames, stats))
+    try:
+        while not writer.done():
+            text = await websocket.receive_text()
+            try:
+                frame = IngestFrame.model_validate_json(text)
+            except ValidationError as e:
+                await websocket.send_json({"nack": _frame_seq(text), "error": str(e)})
+                continue
+            if not await _put_frame(frames, frame, writer):
+                break
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # Frames not committed yet were not acknowledged; the client sends them again
+        writer.cancel()
+        try:
+            await writer
+        except (asyncio.CancelledError, Exception):
+            pass
+        logger.info(
+            f"Ingest stream from {client} closed: {stats['frames']} frames, "
+            f"{stats['rows']} measurements in {stats['commits']} commits"
+        )
+
+
+@router.get("/api/ingest/stats")
+async def get_ingest_stats() -> dict:
+    """Group-commit queue depth, batch sizes and commit latency for this process."""
+    return ingest_queue.stats()
+
+
+async def _put_frame(frames: asyncio.Queue, frame: IngestFrame, writer: asyncio.Task) -> bool:
+    """Queue a frame, waiting for room; False if the writer ends first (e.g. a failed commit
+    closed the connection), since nothing would then drain the full queue."""
+    if not frames.full():
+        frames.put_nowait(frame)
+        return True
+    put = asyncio.ensure_future(frames.put(frame))
+    await asyncio.wait({put, writer}, return_when=asyncio.FIRST_COMPLETED)
+    if put.done():
+        return True
+    put.cancel()
+    return False
+
+
+def _frame_seq(text: str) -> int | None:
+    try:
+        return json.loads(text).get("seq")
+    except (ValueError, AttributeError):
+        return None
+
+
+async def _write_frames(websocket: WebSocket, frames: asyncio.Queue, stats: dict) -> None:
+    """Group-commit queued frames and acknowledge them."""
+    while True:
+        batch = [await frames.get()]
+        rows = len(batch[0].measurements)
+        while rows < settings.ingest_commit_max_rows and not frames.empty():
+            frame = frames.get_nowait()
+            batch.append(frame)
+            rows += len(frame.measurements)
+
+        try:
+            await _commit(batch)
+        except Exception as e:
+            logger.error(f"Ingest commit of {rows} measurements failed: {e}")
+            await websocket.close(code=1011)
+            return
+
+        stats["frames"] += len(batch)
+        stats["rows"] += rows
+        stats["commits"] += 1
+        await websocket.send_json({"ack": batch[-1].seq})
+        await _broadcast(batch)
+
+
+async def _commit(batch: list[IngestFrame]) -> None:
+    """Write a batch through the shared ingest queue, returning once it is committed."""
+    await device_registry.ensure_many(frame.device_id for frame in batch)
+    now = datetime.now(timezone.utc)
+    rows = []
+    for frame in batch:
+        rows += measurement_rows(frame.device_id, frame.measurements, now)
+    await ingest_queue.submit(rows, wait=True)
+
+
+async def _broadcast(batch: list[IngestFrame]) -> None:
+    """One update per device with the latest value of each metric in the commit."""
+    timestamp = datetime.now(timezone.utc).isoformat()
+    updates: dict[str, dict] = {}
+    for frame in batch:
+        data = updates.setdefault(frame.device_id, {"timestamp": timestamp})
+        for m in frame.measurements:
+            data[m.metric_name] = m.latest_value
+    for device_id, data in updates.items():
+        await broadcast_measurement_update(device_id, data)
@@ -1,14 +1,16 @@
 from datetime import datetime, timedelta, timezone
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy import select, desc, func
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.database import get_db
 from app.models.measurement import Measurement
-from app.models.device import Device
 from app.schemas.measurement import MeasurementResponse, CurrentMeasurements, MeasurementCreate
 from app.routers.websocket import broadcast_measurement_update
+from app.services.bulk_write import measurement_rows
+from app.services.device_registry import device_registry
+from app.services.ingest_queue import ingest_queue
 
 router = APIRouter(prefix="/api/devices/{device_id}", tags=["measurements"])
 
@@ -55,7 +57,7 @@ async def get_current_measurements(
     # Map metric names to response fields (direct mapping)
     for m in measurements:
         if hasattr(current, m.metric_name):
-            setattr(current, m.metric_name, m.metric_value)
+            setattr(current, m.metric_name, m.value_last if m.value_last is not None else m.metric_value)
 
     # Include Enphase solar breakdown (Garden Room + Loft) when requesting the main PV device.
     if device_id == "PV001001DEV":
@@ -153,14 +155,7 @@ async def create_measurement(
 ) -> Measurement:
     """Store a single measurement."""
     # Ensure device exists or create it
-    result = await db.execute(
-        select(Device).where(Device.device_id == device_id)
-    )
-    device = result.scalar_one_or_none()
-    if not device:
-        device = Device(device_id=device_id)
-        db.add(device)
-        await db.commit()
+    await device_registry.ensure(device_id)
 
     # Create measurement
     measurement = Measurement(
@@ -170,6 +165,10 @@ async def create_measurement(
         metric_value=measurement_data.metric_value,
         unit=measurement_data.unit,
         source_topic=measurement_data.source_topic,
+        value_min=measurement_data.value_min,
+        value_max=measurement_data.value_max,
+        value_last=measurement_data.value_last,
+        sample_count=measurement_data.sample_count,
     )
     db.add(measurement)
     await db.commit()
@@ -179,7 +178,7 @@ async def create_measurement(
     await broadcast_measurement_update(
         device_id,
         {
-            measurement_data.metric_name: measurement_data.metric_value,
+            measurement_data.metric_name: measurement_data.latest_value,
             "timestamp": measurement.timestamp.isoformat(),
         },
     )
@@ -191,40 +190,27 @@ async def create_measurement(
 async def create_measurements_batch(
     device_id: str,
     measurements_data: list[MeasurementCreate],
-    db: AsyncSession = Depends(get_db),
+    response: Response,
+    wait: bool = Query(default=True, description="Return only once the batch is committed"),
 ) -> dict:
-    """Store multiple measurements in a batch."""
-    # Ensure device exists or create it
-    result = await db.execute(
-        select(Device).where(Device.device_id == device_id)
-    )
-    device = result.scalar_one_or_none()
-    if not device:
-        device = Device(device_id=device_id)
-        db.add(device)
-        await db.commit()
-
-    # Create measurements
-    measurements = []
-    broadcast_data = {"timestamp": datetime.now(timezone.utc).isoformat()}
-    
-    for measurement_data in measurements_data:
-        measurement = Measurement(
-            device_id=device_id,
-            timestamp=measurement_data.timestamp or datetime.now(timezone.utc),
-            metric_name=measurement_data.metric_name,
-            metric_value=measurement_data.metric_value,
-            unit=measurement_data.unit,
-            source_topic=measurement_data.source_topic,
-        )
-        measurements.append(measurement)
-        broadcast_data[measurement_data.metric_name] = measurement_data.metric_value
-
-    db.add_all(measurements)
-    await db.commit()
+    """Store multiple measurements in a batch.
+
+    Rows go on the group-commit ingest queue and are bulk-written with other
+    submissions. The response is 201 once they are committed, and an error if the
+    commit fails. With ``wait=false`` it is 202 as soon as they are queued, and a
+    failed commit is only logged.
+    """
+    await device_registry.ensure(device_id)
+    now = datetime.now(timezone.utc)
+    created = await ingest_queue.submit(measurement_rows(device_id, measurements_data, now), wait=wait)
+    if not wait:
+        response.status_code = 202
 
     # Broadcast to WebSocket clients
+    broadcast_data = {"timestamp": now.isoformat()}
+    for measurement_data in measurements_data:
+        broadcast_data[measurement_data.metric_name] = measurement_data.latest_value
     await broadcast_measurement_update(device_id, broadcast_data)
 
-    return {"created": len(measurements), "device_id": device_id}
+    return {"created": created, "device_id": device_id, "committed": wait}
 
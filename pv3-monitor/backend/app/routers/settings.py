@@ -6,10 +6,12 @@ import logging
 import json
 from pathlib import Path
 
+from app.schemas.sampling import DEFAULT_SAMPLING_POLICIES, SamplingPolicy
 from app.services.server_collector import (
     start_server_collector,
     stop_server_collector,
     get_collector_status,
+    update_sampling_policies,
 )
 
 logger = logging.getLogger(__name__)
@@ -23,6 +25,10 @@ class CollectionSettings(BaseModel):
     mqtt_host: str = "192.168.1.215"
     mqtt_port: int = 1883
     device_id: str = "PV001001DEV"
+    # Per-metric sampling intervals and aggregations for the server collector
+    sampling_policies: list[SamplingPolicy] = Field(
+        default_factory=lambda: [policy.model_copy() for policy in DEFAULT_SAMPLING_POLICIES]
+    )
 
 
 class AllSettings(BaseModel):
@@ -69,6 +75,10 @@ async def update_collection_settings(settings: CollectionSettings):
     
     old_mode = _current_settings.collection_mode
     old_interval = _current_settings.collection_interval_seconds
+    old_policies = _current_settings.sampling_policies
+    if "sampling_policies" not in settings.model_fields_set:
+        # Clients that only edit the basic settings keep the current policies
+        settings.sampling_policies = old_policies
     _current_settings = settings
     _settings_file.write_text(json.dumps(_current_settings.model_dump()), encoding="utf-8")
     
@@ -80,7 +90,8 @@ async def update_collection_settings(settings: CollectionSettings):
             settings.mqtt_host, 
             settings.device_id, 
             settings.mqtt_port,
-            settings.collection_interval_seconds
+            settings.collection_interval_seconds,
+            settings.sampling_policies,
         )
     elif settings.collection_mode == "browser" and old_mode == "server":
         # Stop server collector
@@ -94,12 +105,30 @@ async def update_collection_settings(settings: CollectionSettings):
             settings.mqtt_host,
             settings.device_id,
             settings.mqtt_port,
-            settings.collection_interval_seconds
+            settings.collection_interval_seconds,
+            settings.sampling_policies,
         )
+    elif settings.collection_mode == "server" and old_policies != settings.sampling_policies:
+        # Policies apply to the running collector without reconnecting
+        update_sampling_policies(settings.sampling_policies)
     
     return _current_settings
 
 
+@router.get("/sampling", response_model=list[SamplingPolicy])
+async def get_sampling_policies():
+    """Get the server collector's per-metric sampling policies."""
+    return _current_settings.sampling_policies
+
+
+@router.put("/sampling", response_model=list[SamplingPolicy])
+async def update_sampling_policy_table(policies: list[SamplingPolicy]):
+    """Replace the sampling policies; a running server collector applies them without reconnecting."""
+    settings = _current_settings.model_copy(update={"sampling_policies": policies})
+    await update_collection_settings(settings)
+    return _current_settings.sampling_policies
+
+
 @router.get("/status")
 async def get_collection_status():
     """Get current collection status."""
@@ -91,19 +91,17 @@ async def broadcast_measurement_update(
     )
 
 
-async def broadcast_alarm_update(
+async def broadcast_alarms_update(
     device_id: str,
-    alarm_name: str,
-    is_active: bool,
+    alarms: dict[str, bool],
 ) -> None:
-    """Broadcast an alarm update to connected clients."""
+    """Broadcast the alarm flags that changed in one update to connected clients."""
     await manager.broadcast(
         device_id,
         {
-            "type": "ALARM_UPDATE",
+            "type": "ALARMS_UPDATE",
             "device_id": device_id,
-            "alarm_name": alarm_name,
-            "is_active": is_active,
+            "alarms": alarms,
         },
     )
 
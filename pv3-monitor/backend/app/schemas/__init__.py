@@ -6,6 +6,13 @@ from app.schemas.measurement import (
     CurrentMeasurements,
 )
 from app.schemas.alarm import AlarmResponse, AlarmEventResponse, AlarmStatus
+from app.schemas.ingest import IngestFrame
+from app.schemas.frequency_event import (
+    FrequencyEventCreate,
+    FrequencyEventSummary,
+    FrequencyEventResponse,
+)
+from app.schemas.sampling import SamplingPolicy, DEFAULT_SAMPLING_POLICIES
 
 __all__ = [
     "DeviceCreate",
@@ -18,4 +25,10 @@ __all__ = [
     "AlarmResponse",
     "AlarmEventResponse",
     "AlarmStatus",
+    "IngestFrame",
+    "FrequencyEventCreate",
+    "FrequencyEventSummary",
+    "FrequencyEventResponse",
+    "SamplingPolicy",
+    "DEFAULT_SAMPLING_POLICIES",
 ]
@@ -9,6 +9,8 @@ class DeviceCreate(BaseModel):
     device_id: str
     name: str | None = None
     capacity_kwh: float | None = None
+    mqtt_host: str | None = None
+    mqtt_port: int | None = None
 
 
 class DeviceUpdate(BaseModel):
@@ -16,6 +18,8 @@ class DeviceUpdate(BaseModel):
 
     name: str | None = None
     capacity_kwh: float | None = None
+    mqtt_host: str | None = None
+    mqtt_port: int | None = None
 
 
 class DeviceResponse(BaseModel):
@@ -25,6 +29,8 @@ class DeviceResponse(BaseModel):
     device_id: str
     name: str | None
     capacity_kwh: float | None
+    mqtt_host: str | None = None
+    mqtt_port: int | None = None
     created_at: datetime
     last_seen_at: datetime
 
@@ -0,0 +1,46 @@
+from datetime import datetime
+
+from pydantic import BaseModel
+
+
+class FrequencySeries(BaseModel):
+    """Samples of one metric: offsets in ms from the event start and their values."""
+
+    t: list[int]
+    v: list[float]
+
+
+class FrequencyEventCreate(BaseModel):
+    """Schema for a frequency event captured by the collector."""
+
+    trigger_time: datetime
+    trigger_frequency: float
+    min_frequency: float
+    max_frequency: float
+    start_time: datetime
+    end_time: datetime
+    sample_count: int
+    series: dict[str, FrequencySeries]
+
+
+class FrequencyEventSummary(BaseModel):
+    """Schema for a frequency event in a listing, without its samples."""
+
+    id: int
+    device_id: str
+    trigger_time: datetime
+    trigger_frequency: float
+    min_frequency: float
+    max_frequency: float
+    start_time: datetime
+    end_time: datetime
+    sample_count: int
+
+    class Config:
+        from_attributes = True
+
+
+class FrequencyEventResponse(FrequencyEventSummary):
+    """Schema for a frequency event with its samples."""
+
+    series: dict[str, FrequencySeries]
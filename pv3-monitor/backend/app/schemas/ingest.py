@@ -0,0 +1,11 @@
+from pydantic import BaseModel
+
+from app.schemas.measurement import MeasurementCreate
+
+
+class IngestFrame(BaseModel):
+    """One framed measurement batch on the streaming ingest channel."""
+
+    seq: int
+    device_id: str
+    measurements: list[MeasurementCreate]
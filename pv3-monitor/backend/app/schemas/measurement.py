@@ -13,6 +13,17 @@ class MeasurementCreate(BaseModel):
     unit: str | None = None
     source_topic: str | None = None
 
+    # Window aggregates from collectors running with pre-aggregation
+    value_min: float | None = None
+    value_max: float | None = None
+    value_last: float | None = None
+    sample_count: int | None = None
+
+    @property
+    def latest_value(self) -> float:
+        """The most recent sample: the window's last value for aggregates."""
+        return self.value_last if self.value_last is not None else self.metric_value
+
 
 class MeasurementResponse(BaseModel):
     """Schema for measurement response."""
@@ -24,6 +35,10 @@ class MeasurementResponse(BaseModel):
     metric_value: float
     unit: str | None
     source_topic: str | None
+    value_min: float | None = None
+    value_max: float | None = None
+    value_last: float | None = None
+    sample_count: int | None = None
 
     class Config:
         from_attributes = True
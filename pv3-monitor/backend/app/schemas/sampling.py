@@ -0,0 +1,43 @@
+from typing import Literal
+
+from pydantic import BaseModel, Field
+
+
+class SamplingPolicy(BaseModel):
+    """Sampling interval and stored aggregate for a group of metrics.
+
+    ``metrics`` are metric names or shell-style patterns (``cycle_count_*``). The
+    first policy matching a metric applies; metrics no policy matches are sampled
+    at the collection interval with ``mean``. Each stored sample keeps min, max,
+    last and count alongside the value ``aggregation`` selects.
+    """
+
+    metrics: list[str] = Field(min_length=1)
+    interval_seconds: int = Field(ge=1, le=3600)
+    aggregation: Literal["mean", "last", "min", "max"] = "mean"
+
+
+# Health and limit metrics change slowly; power flow stays at the collection interval
+DEFAULT_SAMPLING_POLICIES = [
+    SamplingPolicy(
+        metrics=[
+            "soh",
+            "soh_min",
+            "cycle_count_*",
+            "battery_capacity",
+            "charge_current_limit",
+            "charge_voltage_limit",
+            "discharge_current_limit",
+            "discharge_voltage_limit",
+            "max_charge_power",
+            "max_discharge_power",
+        ],
+        interval_seconds=300,
+        aggregation="last",
+    ),
+    SamplingPolicy(
+        metrics=["*_temp_*", "*_temperature"],
+        interval_seconds=60,
+        aggregation="mean",
+    ),
+]
@@ -0,0 +1,122 @@
+"""
+In-memory alarm state per device.
+
+The current state of every alarm flag is loaded from the ``alarms`` table at startup
+and kept in memory. Each update is diffed against it in O(flags); only flags that
+changed are written, as one upsert into ``alarms`` plus one bulk insert into
+``alarm_events``. Callers broadcast the returned changes as one ALARMS_UPDATE, so
+an update that changes nothing touches neither the database nor the WebSockets.
+
+Updates for one device are serialised so concurrent requests diff against a
+consistent state. The state is per process, like the device registry.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+from sqlalchemy import insert, select
+
+from app.database import async_session_maker, upsert_insert
+from app.models.alarm import Alarm, AlarmEvent
+
+logger = logging.getLogger(__name__)
+
+
+class AlarmStateEngine:
+    """Current alarm flags per device, written through to the database on change."""
+
+    def __init__(self):
+        # device_id -> alarm_name -> (is_active, updated_at)
+        self._states: dict[str, dict[str, tuple[bool, datetime]]] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+
+    async def load(self) -> int:
+        """Replace the in-memory state with the ``alarms`` table."""
+        states: dict[str, dict[str, tuple[bool, datetime]]] = {}
+        async with async_session_maker() as session:
+            result = await session.execute(
+                select(Alarm.device_id, Alarm.alarm_name, Alarm.is_active, Alarm.updated_at)
+            )
+            for device_id, alarm_name, is_active, updated_at in result:
+                states.setdefault(device_id, {})[alarm_name] = (is_active, updated_at)
+        self._states = states
+        logger.info(f"Alarm state loaded for {len(states)} devices")
+        return len(states)
+
+    def get(self, device_id: str) -> dict[str, tuple[bool, datetime]] | None:
+        """(is_active, updated_at) per alarm for a device, or None if it has reported none."""
+        return self._states.get(device_id)
+
+    async def apply(self, device_id: str, alarm_states: dict[str, bool]) -> tuple[dict[str, bool], int]:
+        """Diff and persist one alarm payload. Returns the changed flags and the events created.
+
+        The device must exist (see device_registry.ensure).
+        """
+        lock = self._locks.get(device_id)
+        if lock is None:
+            lock = self._locks[device_id] = asyncio.Lock()
+
+        async with lock:
+            current = self._states.get(device_id, {})
+            changed = {}
+            events = []
+            for alarm_name, is_active in alarm_states.items():
+                previous = current.get(alarm_name)
+                if previous is not None and previous[0] == is_active:
+                    continue
+                changed[alarm_name] = is_active
+                # New flags only get an event when they arrive active
+                if previous is not None or is_active:
+                    events.append({
+                        "device_id": device_id,
+                        "alarm_name": alarm_name,
+                        "event_type": "triggered" if is_active else "cleared",
+                    })
+            if not changed:
+                return changed, 0
+
+            now = datetime.now(timezone.utc)
+            await self._write(device_id, changed, events, now)
+
+            states = self._states.setdefault(device_id, {})
+            for alarm_name, is_active in changed.items():
+                states[alarm_name] = (is_active, now)
+
+        return changed, len(events)
+
+    async def _write(self, device_id: str, changed: dict[str, bool], events: list[dict], now: datetime) -> None:
+        rows = [
+            {"device_id": device_id, "alarm_name": name, "is_active": active, "updated_at": now}
+            for name, active in changed.items()
+        ]
+        async with async_session_maker() as session:
+            upsert = upsert_insert(session)
+            if upsert is not None:
+                statement = upsert(Alarm).values(rows)
+                await session.execute(
+                    statement.on_conflict_do_update(
+                        index_elements=["device_id", "alarm_name"],
+                        set_={"is_active": statement.excluded.is_active, "updated_at": statement.excluded.updated_at},
+                    )
+                )
+            else:
+                result = await session.execute(
+                    select(Alarm)
+                    .where(Alarm.device_id == device_id)
+                    .where(Alarm.alarm_name.in_(changed))
+                )
+                existing = {alarm.alarm_name: alarm for alarm in result.scalars()}
+                for row in rows:
+                    alarm = existing.get(row["alarm_name"])
+                    if alarm is None:
+                        session.add(Alarm(**row))
+                    else:
+                        alarm.is_active = row["is_active"]
+                        alarm.updated_at = now
+            if events:
+                await session.execute(insert(AlarmEvent), [{**event, "timestamp": now} for event in events])
+            await session.commit()
+
+
+alarm_state = AlarmStateEngine()
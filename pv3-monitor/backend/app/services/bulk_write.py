@@ -0,0 +1,117 @@
+"""
+Bulk measurement writes without the ORM.
+
+Batches are written with asyncpg's binary COPY when the database is PostgreSQL on
+asyncpg, and as multi-row INSERT statements otherwise. Only row counts come back;
+no Measurement objects are built or refreshed. Single measurements still go through
+the ORM in the measurements router.
+"""
+
+import logging
+from collections.abc import Iterable
+from datetime import datetime, timezone
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.models.measurement import Measurement
+
+logger = logging.getLogger(__name__)
+
+# Column order of the row tuples built by measurement_rows
+MEASUREMENT_COLUMNS = (
+    "device_id",
+    "timestamp",
+    "metric_name",
+    "metric_value",
+    "unit",
+    "source_topic",
+    "value_min",
+    "value_max",
+    "value_last",
+    "sample_count",
+)
+
+# Rows per multi-row INSERT; keeps the bind parameter count under driver limits
+INSERT_CHUNK_ROWS = 1000
+
+
+def measurement_rows(device_id: str, measurements: Iterable, now: datetime | None = None) -> list[tuple]:
+    """Row tuples in MEASUREMENT_COLUMNS order from MeasurementCreate-like objects."""
+    now = now or datetime.now(timezone.utc)
+    return [
+        (
+            device_id,
+            m.timestamp or now,
+            m.metric_name,
+            m.metric_value,
+            m.unit,
+            m.source_topic,
+            m.value_min,
+            m.value_max,
+            m.value_last,
+            m.sample_count,
+        )
+        for m in measurements
+    ]
+
+
+def decoded_rows(
+    device_id: str,
+    measurements: Iterable[tuple[str, float, str]],
+    source_topic: str,
+    now: datetime,
+) -> list[tuple]:
+    """Row tuples in MEASUREMENT_COLUMNS order from decoded (metric, value, unit) tuples."""
+    return [
+        (device_id, now, metric, value, unit, source_topic, None, None, None, None)
+        for metric, value, unit in measurements
+    ]
+
+
+def record_rows(records: Iterable[tuple[str, dict]]) -> list[tuple]:
+    """Row tuples in MEASUREMENT_COLUMNS order from (device_id, measurement dict) records,
+    the shape pv3common.aggregate.WindowAggregator emits."""
+    return [
+        (
+            device_id,
+            datetime.fromisoformat(m["timestamp"]),
+            m["metric_name"],
+            m["metric_value"],
+            m.get("unit"),
+            m.get("source_topic"),
+            m.get("value_min"),
+            m.get("value_max"),
+            m.get("value_last"),
+            m.get("sample_count"),
+        )
+        for device_id, m in records
+    ]
+
+
+async def write_measurements(session: AsyncSession, rows: list[tuple]) -> int:
+    """Write measurement rows in the session's transaction and return how many were written.
+
+    The caller commits. Devices referenced by the rows must already exist (see
+    device_registry.ensure).
+    """
+    if not rows:
+        return 0
+    connection = await session.connection()
+    if settings.bulk_write_copy and connection.dialect.driver == "asyncpg":
+        # Runs inside the transaction if the session already executed something; otherwise
+        # the COPY autocommits, which is still all-or-nothing for the batch
+        raw = await connection.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            Measurement.__tablename__,
+            records=rows,
+            columns=MEASUREMENT_COLUMNS,
+        )
+        return len(rows)
+
+    table = Measurement.__table__
+    for start in range(0, len(rows), INSERT_CHUNK_ROWS):
+        values = [dict(zip(MEASUREMENT_COLUMNS, row)) for row in rows[start:start + INSERT_CHUNK_ROWS]]
+        await connection.execute(insert(table).values(values))
+    return len(rows)
@@ -0,0 +1,84 @@
+"""
+Process-local registry of known device IDs.
+
+Ingest paths call ``device_registry.ensure`` before writing rows that reference a
+device. Known devices cost a set lookup; an unknown one is inserted once with
+INSERT ... ON CONFLICT DO NOTHING in its own committed transaction, so concurrent
+requests (or processes) creating the same device do not race. The registry is
+loaded at startup and the devices router invalidates entries it changes.
+
+Each worker process has its own registry. A device deleted through another process
+stays known here until this process restarts or invalidates it.
+"""
+
+import asyncio
+import logging
+from collections.abc import Iterable
+
+from sqlalchemy import select
+
+from app.database import async_session_maker, upsert_insert
+from app.models.device import Device
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceRegistry:
+    """Known device IDs, with idempotent creation of new ones."""
+
+    def __init__(self):
+        self._known: set[str] = set()
+        self._lock = asyncio.Lock()
+
+    async def load(self) -> int:
+        """Replace the registry with the device IDs in the database."""
+        async with async_session_maker() as session:
+            result = await session.execute(select(Device.device_id))
+            self._known = set(result.scalars().all())
+        logger.info(f"Device registry loaded {len(self._known)} devices")
+        return len(self._known)
+
+    def __contains__(self, device_id: str) -> bool:
+        return device_id in self._known
+
+    async def ensure(self, device_id: str) -> None:
+        """Make sure a device row exists, creating it on first use."""
+        if device_id not in self._known:
+            await self.ensure_many([device_id])
+
+    async def ensure_many(self, device_ids: Iterable[str]) -> None:
+        """Make sure device rows exist for every ID, creating missing ones in one statement."""
+        missing = set(device_ids) - self._known
+        if not missing:
+            return
+        async with self._lock:
+            missing -= self._known
+            if not missing:
+                return
+            async with async_session_maker() as session:
+                insert = upsert_insert(session)
+                if insert is None:
+                    # No portable upsert; fall back to checking first
+                    result = await session.execute(
+                        select(Device.device_id).where(Device.device_id.in_(missing))
+                    )
+                    session.add_all(Device(device_id=d) for d in missing - set(result.scalars().all()))
+                else:
+                    await session.execute(
+                        insert(Device)
+                        .values([{"device_id": d} for d in missing])
+                        .on_conflict_do_nothing(index_elements=["device_id"])
+                    )
+                await session.commit()
+            self._known |= missing
+            logger.info(f"Registered devices: {', '.join(sorted(missing))}")
+
+    def invalidate(self, device_id: str | None = None) -> None:
+        """Forget one device, or all of them, so the next ingest checks the database again."""
+        if device_id is None:
+            self._known.clear()
+        else:
+            self._known.discard(device_id)
+
+
+device_registry = DeviceRegistry()
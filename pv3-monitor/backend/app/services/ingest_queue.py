@@ -0,0 +1,194 @@
+"""
+Group-commit queue for measurement ingest.
+
+Ingest endpoints put validated rows (see bulk_write.measurement_rows) on a per-process
+asyncio queue and return. One writer task drains the queue and commits everything
+that arrived within ``max_delay`` seconds of the first pending submission, up to
+``max_rows`` rows, in a single transaction. Many small collector posts then cost one
+commit (and one fsync) instead of one each.
+
+Callers that need the rows to be durable before they answer pass ``wait=True`` and
+get the commit's outcome. If a group commit fails, each submission in it is retried
+in its own transaction, so one bad post (e.g. an unknown device) only fails itself.
+Everything still queued is committed by ``stop``, which the application lifespan
+calls on shutdown.
+"""
+
+import asyncio
+import logging
+import time
+
+from app.config import settings
+from app.database import async_session_maker
+from app.services.bulk_write import write_measurements
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class IngestQueue:
+    """Per-process queue of measurement rows with a single group-commit writer."""
+
+    def __init__(self, max_rows: int = 5000, max_delay: float = 0.05, max_pending: int = 1000):
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        # Submissions waiting beyond this make submit() wait, pushing back on callers
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self._task: asyncio.Task | None = None
+
+        self.pending_rows = 0
+        self.committed_rows = 0
+        self.failed_rows = 0
+        self.failed_submissions = 0
+        self.commits = 0
+        self.group_retries = 0
+        self.last_batch_rows = 0
+        self.max_batch_rows = 0
+        self.last_commit_seconds = 0.0
+        self.max_commit_seconds = 0.0
+        self._commit_seconds_total = 0.0
+
+    def start(self) -> None:
+        """Start the writer task on the running event loop."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="ingest-queue-writer")
+
+    async def stop(self) -> None:
+        """Commit everything queued so far and stop the writer task."""
+        if self._task is None:
+            return
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+
+    async def submit(self, rows: list[tuple], wait: bool = False) -> int:
+        """Queue measurement rows; with ``wait``, return once they are committed.
+
+        Raises the commit's exception to waiting callers if it fails. Without the
+        writer task running (e.g. outside the app lifespan) rows are written directly.
+        """
+        if not rows:
+            return 0
+        if self._task is None:
+            async with async_session_maker() as session:
+                written = await write_measurements(session, rows)
+                await session.commit()
+            return written
+
+        future = asyncio.get_running_loop().create_future() if wait else None
+        self.pending_rows += len(rows)
+        await self._queue.put((rows, future))
+        if future is not None:
+            await future
+        return len(rows)
+
+    def stats(self) -> dict:
+        """Queue depth, batch sizes and commit latency since startup."""
+        return {
+            "queue_depth": self._queue.qsize(),
+            "pending_rows": self.pending_rows,
+            "committed_rows": self.committed_rows,
+            "failed_rows": self.failed_rows,
+            "failed_submissions": self.failed_submissions,
+            "commits": self.commits,
+            "group_retries": self.group_retries,
+            "last_batch_rows": self.last_batch_rows,
+            "max_batch_rows": self.max_batch_rows,
+            "avg_batch_rows": round(self.committed_rows / self.commits, 1) if self.commits else 0,
+            "last_commit_ms": round(self.last_commit_seconds * 1000, 2),
+            "max_commit_ms": round(self.max_commit_seconds * 1000, 2),
+            "avg_commit_ms": round(self._commit_seconds_total / self.commits * 1000, 2) if self.commits else 0,
+        }
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                return
+            items = [item]
+            queued_rows = len(item[0])
+            deadline = loop.time() + self.max_delay
+            while queued_rows < self.max_rows:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                if item is _STOP:
+                    stopping = True
+                    break
+                items.append(item)
+                queued_rows += len(item[0])
+            await self._commit(items)
+
+    async def _commit(self, items: list[tuple[list[tuple], asyncio.Future | None]]) -> None:
+        rows = [row for item_rows, _ in items for row in item_rows]
+        started = time.perf_counter()
+        try:
+            await self._write(rows)
+        except Exception as e:
+            if len(items) == 1:
+                self._fail(items[0], e)
+                return
+            # Find the submissions that cannot commit rather than failing the whole group
+            self.group_retries += 1
+            logger.warning(f"Ingest commit of {len(rows)} measurements failed, retrying {len(items)} submissions individually: {e}")
+            for item in items:
+                try:
+                    await self._write(item[0])
+                except Exception as item_error:
+                    self._fail(item, item_error)
+                else:
+                    self._committed(item, time.perf_counter() - started)
+            return
+
+        self._committed((rows, None), time.perf_counter() - started)
+        for _, future in items:
+            if future is not None and not future.done():
+                future.set_result(None)
+
+    async def _write(self, rows: list[tuple]) -> None:
+        async with async_session_maker() as session:
+            await write_measurements(session, rows)
+            await session.commit()
+
+    def _committed(self, item: tuple[list[tuple], asyncio.Future | None], elapsed: float) -> None:
+        rows, future = item
+        self.pending_rows -= len(rows)
+        self.committed_rows += len(rows)
+        self.commits += 1
+        self.last_batch_rows = len(rows)
+        self.max_batch_rows = max(self.max_batch_rows, len(rows))
+        self.last_commit_seconds = elapsed
+        self.max_commit_seconds = max(self.max_commit_seconds, elapsed)
+        self._commit_seconds_total += elapsed
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    def _fail(self, item: tuple[list[tuple], asyncio.Future | None], error: Exception) -> None:
+        rows, future = item
+        self.pending_rows -= len(rows)
+        self.failed_rows += len(rows)
+        self.failed_submissions += 1
+        if future is None:
+            # Nobody is waiting on this submission, so the log is the only record of the loss
+            logger.error(f"Dropped {len(rows)} queued measurements for {rows[0][0]}: commit failed: {error}")
+        else:
+            logger.error(f"Ingest commit of {len(rows)} measurements for {rows[0][0]} failed: {error}")
+            if not future.done():
+                future.set_exception(error)
+
+
+ingest_queue = IngestQueue(
+    max_rows=settings.ingest_commit_max_rows,
+    max_delay=settings.ingest_commit_max_delay_ms / 1000,
+    max_pending=settings.ingest_queue_max_pending,
+)
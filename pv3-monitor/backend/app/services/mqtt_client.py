@@ -1,36 +1,71 @@
 import asyncio
 import json
 import logging
+from collections import deque
 from datetime import datetime, timezone
 from typing import Callable
 
 import paho.mqtt.client as mqtt
 
 from app.config import settings
+from app.routers.websocket import broadcast_alarms_update, broadcast_measurement_update
+from app.services.alarm_state import alarm_state
+from app.services.bulk_write import decoded_rows
+from app.services.device_registry import device_registry
+from app.services.ingest_queue import ingest_queue
+from app.services.topic_trie import TopicTrie
+from pv3common.mapping import TopicRouter
+from pv3common.outlier import OutlierFilter, load_rules
 
 logger = logging.getLogger(__name__)
 
 
 class MQTTService:
-    """MQTT client service for receiving P3 data."""
+    """MQTT client service for receiving P3 data.
 
-    def __init__(self) -> None:
+    paho's network thread routes and decodes each message, then appends it to a
+    bounded deque. A single consumer task on the event loop drains the deque in
+    batches and runs the handlers in arrival order. The thread wakes the consumer
+    once per burst rather than once per message. When the deque is full because
+    the loop has stalled, new messages are dropped and counted.
+    """
+
+    def __init__(self, capacity: int = 10000, batch_size: int = 500) -> None:
         self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
         self.client.on_connect = self._on_connect
         self.client.on_message = self._on_message
         self.client.on_disconnect = self._on_disconnect
 
         self.connected = False
-        self.message_handlers: dict[str, Callable] = {}
+        self.message_handlers = TopicTrie()
         self._loop: asyncio.AbstractEventLoop | None = None
 
+        self.capacity = capacity
+        self.batch_size = batch_size
+        # deque append/popleft are atomic, so the paho thread and the loop share it unlocked
+        self._inbox: deque = deque()
+        self._wakeup = asyncio.Event()
+        self._wakeup_pending = False
+        self._consumer: asyncio.Task | None = None
+        self._closing = False
+
+        self.received = 0
+        self.dropped = 0
+        self.handled = 0
+        self.batches = 0
+        self.max_depth = 0
+
     def set_event_loop(self, loop: asyncio.AbstractEventLoop) -> None:
         """Set the asyncio event loop for callbacks."""
         self._loop = loop
 
     def register_handler(self, topic_suffix: str, handler: Callable) -> None:
-        """Register a handler for a specific topic suffix."""
-        self.message_handlers[topic_suffix] = handler
+        """Register a handler for a topic suffix under any device's P3 prefix.
+
+        The suffix may use MQTT wildcards (``inverter/+``, ``bms/#``); the most
+        specific matching suffix handles a message.
+        """
+        self.message_handlers.add(f"pv/PV3/{{device_id}}/{topic_suffix}", handler)
 
     def _on_connect(
         self,
@@ -44,8 +79,9 @@ class MQTTService:
         if rc == 0:
             logger.info("Connected to MQTT broker")
             self.connected = True
-            # Subscribe to all P3 topics for the configured device
-            topic = f"pv/PV3/{settings.p3_device_id}/#"
+            # Subscribe to all P3 topics for the configured device, or for every device
+            device = "+" if settings.mqtt_all_devices else settings.p3_device_id
+            topic = f"pv/PV3/{device}/#"
             client.subscribe(topic)
             logger.info(f"Subscribed to {topic}")
         else:
@@ -71,12 +107,14 @@ class MQTTService:
     ) -> None:
         """Handle incoming MQTT messages."""
         try:
-            # Extract topic suffix (e.g., "bms/soc" from "pv/PV3/PV001001DEV/bms/soc")
-            topic_parts = msg.topic.split("/")
-            if len(topic_parts) >= 4:
-                topic_suffix = "/".join(topic_parts[3:])
-            else:
-                topic_suffix = msg.topic
+            # Route before decoding, so unhandled topics cost nothing
+            route = self._find_handler(msg.topic)
+            if route is None or not self._loop:
+                return
+            handler, captures = route
+            device_id = captures["device_id"]
+            # Topic suffix, e.g. "bms/soc" from "pv/PV3/PV001001DEV/bms/soc"
+            topic_suffix = msg.topic.split("/", 3)[3]
 
             # Parse JSON payload
             try:
@@ -84,32 +122,72 @@ class MQTTService:
             except json.JSONDecodeError:
                 payload = msg.payload.decode()
 
-            # Find and call appropriate handler
-            handler = self._find_handler(topic_suffix)
-            if handler and self._loop:
-                asyncio.run_coroutine_threadsafe(
-                    handler(settings.p3_device_id, topic_suffix, payload),
-                    self._loop,
-                )
+            self.received += 1
+            if len(self._inbox) >= self.capacity:
+                self.dropped += 1
+                if self.dropped % 1000 == 1:
+                    logger.warning(f"MQTT handoff queue full, {self.dropped} messages dropped so far")
+                return
+            self._inbox.append((handler, device_id, topic_suffix, payload))
+            if not self._wakeup_pending:
+                self._wakeup_pending = True
+                self._loop.call_soon_threadsafe(self._wakeup.set)
 
         except Exception as e:
             logger.error(f"Error processing MQTT message: {e}")
 
-    def _find_handler(self, topic_suffix: str) -> Callable | None:
-        """Find the appropriate handler for a topic."""
-        # Try exact match first
-        if topic_suffix in self.message_handlers:
-            return self.message_handlers[topic_suffix]
-
-        # Try prefix match
-        for pattern, handler in self.message_handlers.items():
-            if topic_suffix.startswith(pattern):
-                return handler
-
-        return None
+    def _find_handler(self, topic: str) -> tuple[Callable, dict[str, str]] | None:
+        """Find the handler for a full topic, with the device ID it was published for."""
+        return self.message_handlers.match(topic)
+
+    async def _consume(self) -> None:
+        """Wait for the paho thread's wakeup, then handle everything queued."""
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            # Reset before draining: a message appended after this point either gets
+            # drained below or sends a new wakeup
+            self._wakeup_pending = False
+            await self._handle_queued()
+            if self._closing:
+                return
+
+    async def _handle_queued(self) -> None:
+        inbox = self._inbox
+        while inbox:
+            self.max_depth = max(self.max_depth, len(inbox))
+            batch = [inbox.popleft() for _ in range(min(len(inbox), self.batch_size))]
+            for handler, device_id, topic_suffix, payload in batch:
+                try:
+                    await handler(device_id, topic_suffix, payload)
+                except Exception as e:
+                    logger.error(f"Error handling MQTT message {topic_suffix} for {device_id}: {e}")
+            self.handled += len(batch)
+            self.batches += 1
+            # Let requests and other tasks run between batches of a long backlog
+            await asyncio.sleep(0)
+
+    def stats(self) -> dict:
+        """Handoff queue depth and message counts since startup."""
+        return {
+            "queue_depth": len(self._inbox),
+            "max_depth": self.max_depth,
+            "received": self.received,
+            "handled": self.handled,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "avg_batch": round(self.handled / self.batches, 1) if self.batches else 0,
+        }
+
+    def start_consumer(self) -> None:
+        """Start the task that handles queued messages; call from the event loop's thread."""
+        if self._loop is not None and self._consumer is None:
+            self._consumer = self._loop.create_task(self._consume(), name="mqtt-consumer")
 
     def connect(self) -> None:
-        """Connect to the MQTT broker."""
+        """Connect to the MQTT broker and start the message consumer on the event loop."""
+        # connect() runs on the loop's thread (the application lifespan)
+        self.start_consumer()
         logger.info(f"Connecting to MQTT broker at {settings.mqtt_host}:{settings.mqtt_port}")
         self.client.connect(settings.mqtt_host, settings.mqtt_port, keepalive=60)
         self.client.loop_start()
@@ -121,54 +199,72 @@ class MQTTService:
         self.client.disconnect()
         self.connected = False
 
-
-# Topic handler functions
-async def handle_soc(device_id: str, topic: str, payload: dict) -> None:
-    """Handle bms/soc messages."""
-    logger.debug(f"SOC update for {device_id}: {payload}")
-    # TODO: Store measurement and broadcast to WebSocket clients
-
-
-async def handle_inverter_measurements(device_id: str, topic: str, payload: list) -> None:
-    """Handle inverter/measurements messages."""
-    logger.debug(f"Inverter measurements for {device_id}: {len(payload)} readings")
-    # TODO: Parse and store measurements
-
-
-async def handle_inverter_alarms(device_id: str, topic: str, payload: dict) -> None:
-    """Handle inverter/alarms messages."""
-    logger.debug(f"Alarms update for {device_id}")
-    # TODO: Update alarm states and create events for changes
+    async def close(self) -> None:
+        """Handle messages still queued and stop the consumer; call after disconnect."""
+        if self._consumer is None:
+            return
+        self._closing = True
+        self._wakeup.set()
+        await self._consumer
+        self._consumer = None
+        self._closing = False
 
 
-async def handle_pylontech_info(device_id: str, topic: str, payload: list) -> None:
-    """Handle pylontech/info messages."""
-    logger.debug(f"Pylontech info for {device_id}")
-    # TODO: Store battery health metrics
+# Mapping and outlier rules shared with the standalone and server-side collectors
+topic_router = TopicRouter()
+outlier_filter = OutlierFilter(load_rules(settings.outlier_config))
 
 
-async def handle_ffr_measurements(device_id: str, topic: str, payload: list) -> None:
-    """Handle ffr/measurements messages."""
-    logger.debug(f"FFR measurements for {device_id}: {len(payload)} channels")
-    # TODO: Store grid/house/aux power measurements
-
-
-async def handle_schedule_event(device_id: str, topic: str, payload: dict) -> None:
-    """Handle schedule/event messages."""
-    logger.debug(f"Schedule event for {device_id}: event={payload.get('event')}")
-    # TODO: Store schedule state
+# Topic handler functions
+async def handle_mapped_topic(device_id: str, topic: str, payload: dict | list) -> None:
+    """Decode any mapped P3 topic into measurements and alarm flags.
+
+    With ``mqtt_ingest_enabled``, measurements go on the group-commit ingest queue,
+    alarm flags through the alarm state engine, and both are broadcast to WebSocket
+    clients.
+    """
+    spec = topic_router.get(topic)
+    if spec is None or not isinstance(payload, (dict, list)):
+        return
+    decoded = spec.decode(payload)
+    logger.debug(
+        f"{topic} for {device_id}: {len(decoded.measurements)} measurements, "
+        f"{len(decoded.alarms)} alarm flags"
+    )
+    if not settings.mqtt_ingest_enabled:
+        return
+
+    try:
+        await store_decoded(device_id, topic, decoded)
+    except Exception as e:
+        logger.error(f"Failed to store {topic} for {device_id}: {e}")
+
+
+async def store_decoded(device_id: str, topic: str, decoded) -> None:
+    """Write one decoded message through the ingest queue and alarm engine, then broadcast."""
+    await device_registry.ensure(device_id)
+    now = datetime.now(timezone.utc)
+
+    if decoded.measurements:
+        measurements = outlier_filter.filter(device_id, decoded.measurements)
+        await ingest_queue.submit(decoded_rows(device_id, measurements, f"pv/PV3/{device_id}/{topic}", now))
+        data = {"timestamp": now.isoformat()}
+        for metric, value, _ in measurements:
+            data[metric] = value
+        await broadcast_measurement_update(device_id, data)
+
+    if decoded.alarms:
+        changed, _ = await alarm_state.apply(device_id, decoded.alarms)
+        if changed:
+            await broadcast_alarms_update(device_id, changed)
 
 
 # Global MQTT service instance
-mqtt_service = MQTTService()
+mqtt_service = MQTTService(capacity=settings.mqtt_queue_capacity, batch_size=settings.mqtt_queue_batch)
 
 
 def setup_mqtt_handlers() -> None:
     """Register all MQTT topic handlers."""
-    mqtt_service.register_handler("bms/soc", handle_soc)
-    mqtt_service.register_handler("inverter/measurements", handle_inverter_measurements)
-    mqtt_service.register_handler("inverter/alarms", handle_inverter_alarms)
-    mqtt_service.register_handler("pylontech/info", handle_pylontech_info)
-    mqtt_service.register_handler("ffr/measurements", handle_ffr_measurements)
-    mqtt_service.register_handler("schedule/event", handle_schedule_event)
+    for topic_suffix in topic_router.specs:
+        mqtt_service.register_handler(topic_suffix, handle_mapped_topic)
 
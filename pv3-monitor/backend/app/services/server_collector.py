@@ -1,16 +1,22 @@
 import asyncio
 import json
 import logging
+import time
+from collections.abc import Iterable
 from datetime import datetime, timezone
+from fnmatch import fnmatchcase
 from typing import Optional
 import asyncio_mqtt as aiomqtt
 import paho.mqtt.client as paho
-from sqlalchemy import select
-from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database import async_session_maker
-from app.models.measurement import Measurement
-from app.models.device import Device
+from app.config import settings
+from app.schemas.sampling import SamplingPolicy
+from app.services.bulk_write import record_rows
+from app.services.device_registry import device_registry
+from app.services.ingest_queue import ingest_queue
+from pv3common.aggregate import WindowAggregator
+from pv3common.mapping import TopicRouter
+from pv3common.outlier import OutlierFilter, load_rules
 
 logger = logging.getLogger(__name__)
 
@@ -18,228 +24,272 @@ logger = logging.getLogger(__name__)
 if not hasattr(paho.Client, "message_retry_set"):
     setattr(paho.Client, "message_retry_set", lambda self, *_, **__: None)
 
+# Seconds between event loop lag probes
+LAG_PROBE_INTERVAL = 1.0
+
+_STOP = object()
+
 
 class ServerMQTTCollector:
-    """Server-side MQTT collector that runs 24/7 independent of browser."""
+    """Server-side MQTT collector that runs 24/7 independent of browser.
+
+    The MQTT consume loop only decodes messages and adds every sample to a
+    WindowAggregator (count, min, max, mean and last per metric). Sampling policies
+    give metric groups their own window length and stored aggregate; other metrics
+    use ``interval`` seconds and the mean. There is one aggregator per window
+    length, and each metric's aggregator is looked up once and cached. A timer
+    closes windows on their wall-clock boundaries and puts all metrics closed
+    together on a bounded queue as one snapshot. A separate writer task persists
+    snapshots through the ingest queue in one bulk insert each, so a slow database
+    never holds up the message iterator. If the writer falls ``max_pending``
+    snapshots behind, the oldest is dropped.
+    """
     
-    def __init__(self, broker_host: str, device_id: str, port: int = 1883, interval: int = 5):
+    def __init__(
+        self,
+        broker_host: str,
+        device_id: str,
+        port: int = 1883,
+        interval: int = 5,
+        max_pending: int = 10,
+        policies: Iterable[SamplingPolicy] = (),
+    ):
         self.broker_host = broker_host
         self.device_id = device_id
         self.port = port
         self.interval = interval  # Store interval in seconds
         self.running = False
-        self.current_data = {}
         self.last_store = None
         self.messages_received = 0
-        self._last_soc: float | None = None
-        self._soc_outlier_threshold_percent = 1.0
+        self.router = TopicRouter()
+        self.outliers = OutlierFilter(load_rules(settings.outlier_config))
+        self.policies: list[SamplingPolicy] = list(policies)
+        # Window length in seconds -> aggregator
+        self.aggregators: dict[int, WindowAggregator] = {}
+        # Metric -> (aggregator, aggregation) under the current policies
+        self._metric_routes: dict[str, tuple[WindowAggregator, str]] = {}
+        # Records the aggregators emitted (closed windows, categorical changes), written with the next snapshot
+        self._pending_records: list[tuple[str, dict]] = []
+
+        self._snapshots: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self.snapshots_dropped = 0
+        self.snapshots_written = 0
+        self.write_errors = 0
+        self.last_write = None
+        self.last_write_seconds = 0.0
+        self.max_write_seconds = 0.0
+        self.loop_lag_seconds = 0.0
+        self.max_loop_lag_seconds = 0.0
+        self._writer: Optional[asyncio.Task] = None
+        self._sampler: Optional[asyncio.Task] = None
+        self._lag_probe: Optional[asyncio.Task] = None
         
     async def start(self):
         """Start the MQTT collector service."""
         self.running = True
         logger.info(f"Starting server MQTT collector for {self.device_id} at {self.broker_host}:{self.port}")
         logger.info(f"Collection interval: {self.interval} seconds")
+        self.start_tasks()
         
-        while self.running:
-            try:
-                async with aiomqtt.Client(self.broker_host, self.port) as client:
-                    topic = f"pv/PV3/{self.device_id}/#"
-                    await client.subscribe(topic)
-                    logger.info(f"Subscribed to {topic}")
-                    
-                    async for message in client.messages:
-                        await self.handle_message(message)
-                        
-            except aiomqtt.MqttError as e:
-                logger.error(f"MQTT connection error: {e}. Reconnecting in 5s...")
-                await asyncio.sleep(5)
-            except Exception as e:
-                logger.error(f"Unexpected error in collector: {e}. Reconnecting in 5s...")
-                await asyncio.sleep(5)
+        try:
+            while self.running:
+                try:
+                    async with aiomqtt.Client(self.broker_host, self.port) as client:
+                        async with client.messages() as messages:
+                            topic = f"pv/PV3/{self.device_id}/#"
+                            await client.subscribe(topic)
+                            logger.info(f"Subscribed to {topic}")
+                            
+                            async for message in messages:
+                                self.handle_message(message)
+                            
+                except aiomqtt.MqttError as e:
+                    logger.error(f"MQTT connection error: {e}. Reconnecting in 5s...")
+                    await asyncio.sleep(5)
+                except Exception as e:
+                    logger.error(f"Unexpected error in collector: {e}. Reconnecting in 5s...")
+                    await asyncio.sleep(5)
+        finally:
+            await self.stop_tasks()
+    
+    def start_tasks(self):
+        """Start the window timer, snapshot writer and loop-lag probe on the running loop.
+
+        ``start`` calls this before connecting; code that feeds ``handle_message``
+        itself (e.g. a capture replay) calls it and ``stop_tasks`` directly.
+        """
+        self._writer = asyncio.create_task(self._write_snapshots())
+        self._sampler = asyncio.create_task(self._close_windows())
+        self._lag_probe = asyncio.create_task(self._probe_loop_lag())
+    
+    async def stop_tasks(self):
+        """Stop the background tasks, writing the partial windows and queued snapshots first."""
+        if self._writer is None:
+            return
+        self._lag_probe.cancel()
+        self._sampler.cancel()
+        # Write the partial windows and the snapshots still queued before the task ends
+        self._flush_windows()
+        self._queue_snapshot(self._pending_records)
+        self._pending_records = []
+        if not self._writer.done():
+            await self._snapshots.put(_STOP)
+            await self._writer
+        self._writer = self._sampler = self._lag_probe = None
     
     async def stop(self):
         """Stop the collector."""
         self.running = False
         logger.info("Server MQTT collector stopped")
     
-    async def handle_message(self, message):
-        """Process incoming MQTT message and update current_data."""
+    def handle_message(self, message):
+        """Process incoming MQTT message and add its samples to the current window."""
         topic = str(message.topic)
         self.messages_received += 1
         
+        # Unmapped topics are dropped before the payload is decoded
+        routed = self.router.route(topic)
+        if routed is None:
+            return
+        _, spec = routed
+        
         try:
             payload = json.loads(message.payload.decode())
         except json.JSONDecodeError:
             return
         
-        # Extract topic suffix
-        topic_parts = topic.split("/")
-        if len(topic_parts) >= 4:
-            topic_suffix = "/".join(topic_parts[3:])
-        else:
-            return
-        
-        # Parse based on topic (reuse logic from standalone collector)
+        # Decode and filter outliers the same way as the standalone collector
         try:
-            if topic_suffix == "bms/soc":
-                await self._parse_soc(payload)
-            elif topic_suffix == "inverter/measurements":
-                await self._parse_inverter_measurements(payload)
-            elif topic_suffix == "ffr/measurements":
-                await self._parse_ffr_measurements(payload)
-            elif topic_suffix == "pylontech/info":
-                await self._parse_pylontech_info(payload)
-            elif topic_suffix == "inverter/charge":
-                await self._parse_charge(payload)
-            elif topic_suffix == "schedule/event":
-                await self._parse_schedule(payload)
+            measurements = spec.decode(payload).measurements
+            now = time.time()
+            units = self.router.units
+            routes = self._metric_routes
+            for metric_name, value, unit in self.outliers.filter(self.device_id, measurements):
+                route = routes.get(metric_name) or self._route_metric(metric_name)
+                unit = unit or units.get(metric_name, "")
+                records = route[0].add(self.device_id, metric_name, float(value), unit, "server_collector", now)
+                if records:
+                    self._collect(records)
         except Exception as e:
             logger.error(f"Error parsing {topic}: {e}")
-        
-        # Store measurement if interval has passed
-        await self._maybe_store_measurement()
     
-    async def _parse_soc(self, payload):
-        """Parse bms/soc messages."""
-        soc: float | None = None
-        if isinstance(payload, list):
-            for item in payload:
-                if isinstance(item, dict) and item.get("measurement") == "StateOfCharge":
-                    value = item.get("value")
-                    if value is not None:
-                        soc = value / 100.0
-                        break
-        elif isinstance(payload, dict):
-            usable_soc = payload.get("usable_soc") or payload.get("StateOfCharge")
-            if usable_soc is not None:
-                soc = usable_soc / 100.0
-
-        if soc is None:
-            return
-
-        if self._last_soc is not None and abs(soc - self._last_soc) > self._soc_outlier_threshold_percent:
-            logger.warning(
-                "SOC outlier detected: prev=%.2f%% new=%.2f%% (Δ=%.2f%%). Keeping previous SOC.",
-                self._last_soc,
-                soc,
-                abs(soc - self._last_soc),
-            )
-            self.current_data["soc_raw"] = soc
-            self.current_data["soc"] = self._last_soc
-            return
-
-        self._last_soc = soc
-        self.current_data["soc"] = soc
+    def _route_metric(self, metric_name: str) -> tuple[WindowAggregator, str]:
+        """Find the first policy matching a metric and cache its aggregator and aggregation."""
+        interval, aggregation = self.interval, "mean"
+        for policy in self.policies:
+            if any(fnmatchcase(metric_name, pattern) for pattern in policy.metrics):
+                interval, aggregation = policy.interval_seconds, policy.aggregation
+                break
+        aggregator = self.aggregators.get(interval)
+        if aggregator is None:
+            aggregator = self.aggregators[interval] = WindowAggregator(interval)
+        route = self._metric_routes[metric_name] = (aggregator, aggregation)
+        return route
     
-    async def _parse_inverter_measurements(self, payload):
-        """Parse inverter/measurements."""
-        for item in payload:
-            channel = item.get("channel")
-            measurement = item.get("measurement")
-            value = item.get("value")
-            
-            if value is None:
-                continue
-            
-            if channel == "BATTERY":
-                if measurement == "Voltage":
-                    self.current_data["battery_voltage"] = value / 1000.0
-                elif measurement == "ChargeCurrent":
-                    self.current_data["battery_current"] = value / 1000.0
-                elif measurement == "Capacity":
-                    self.current_data["battery_capacity"] = value
-            elif channel == "GRID":
-                if measurement == "Voltage":
-                    self.current_data["grid_voltage"] = value / 1000.0
-                elif measurement == "Frequency":
-                    self.current_data["grid_frequency"] = value / 1000.0
+    def _collect(self, records: list[tuple[str, dict]]):
+        """Set each aggregate record's stored value to its policy's aggregation and keep it for the next snapshot."""
+        routes = self._metric_routes
+        for _, record in records:
+            aggregation = routes[record["metric_name"]][1]
+            # Categorical records carry only the value
+            if aggregation != "mean" and "sample_count" in record:
+                record["metric_value"] = record[f"value_{aggregation}"]
+        self._pending_records += records
     
-    async def _parse_ffr_measurements(self, payload):
-        """Parse ffr/measurements (CT clamps)."""
-        for item in payload:
-            channel = item.get("channel")
-            measurement = item.get("measurement")
-            value = item.get("value")
-            
-            if value is None or measurement != "Power":
-                continue
-            
-            # Note: LOCAL=house, HOUSE=grid (swapped)
-            if channel == "LOCAL":
-                self.current_data["house_power"] = value / 1000.0
-            elif channel == "HOUSE":
-                self.current_data["grid_power"] = value / 1000.0
+    def _flush_windows(self):
+        """Close every open window early, e.g. before the policies change."""
+        for aggregator in self.aggregators.values():
+            self._collect(aggregator.flush())
+    
+    def set_policies(self, policies: Iterable[SamplingPolicy]):
+        """Replace the sampling policies without reconnecting.
+
+        Open windows are closed and written with the next snapshot; metrics are
+        routed under the new policies from their next sample.
+        """
+        self._flush_windows()
+        self.policies = list(policies)
+        self.aggregators = {}
+        self._metric_routes = {}
+        logger.info(f"Sampling policies updated: {len(self.policies)} policies")
     
-    async def _parse_pylontech_info(self, payload):
-        """Parse pylontech/info."""
-        if not isinstance(payload, list):
+    async def _close_windows(self):
+        """Close aggregation windows on their boundaries, whether or not messages arrive."""
+        while True:
+            # Wake for the next boundary of any window length, at least once a second
+            # so that windows of newly added policies are closed on time too
+            now = time.time()
+            delay = min([interval - now % interval for interval in self.aggregators] + [1.0])
+            await asyncio.sleep(delay)
+            now = time.time()
+            for aggregator in list(self.aggregators.values()):
+                records = aggregator.roll(now)
+                if records:
+                    self._collect(records)
+            if self._pending_records:
+                self.last_store = datetime.now(timezone.utc)
+                self._queue_snapshot(self._pending_records)
+                self._pending_records = []
+    
+    def _queue_snapshot(self, records: list[tuple[str, dict]]):
+        """Queue one window's records for the writer, dropping the oldest snapshot if it is behind."""
+        if not records:
             return
-        
-        for item in payload:
-            measurement = item.get("measurement")
-            value_type = item.get("type")
-            value = item.get("value")
-            
-            if value is None:
-                continue
-            
-            if measurement == "CellTemperature" and value_type == "Avg":
-                self.current_data["cell_temp_avg"] = value / 1000.0
-            elif measurement == "StateOfHealth" and value_type == "Avg":
-                self.current_data["soh"] = value
+        if self._snapshots.full():
+            # The writer is behind; keep the newest snapshots
+            self._snapshots.get_nowait()
+            self.snapshots_dropped += 1
+            logger.warning(f"Server collector writer is behind, dropped a snapshot ({self.snapshots_dropped} so far)")
+        self._snapshots.put_nowait(record_rows(records))
     
-    async def _parse_charge(self, payload):
-        """Parse inverter/charge."""
-        power = payload.get("power")
-        if power is not None:
-            self.current_data["battery_power"] = power
+    async def _write_snapshots(self):
+        """Persist queued snapshots until stopped."""
+        while True:
+            rows = await self._snapshots.get()
+            if rows is _STOP:
+                return
+            started = time.perf_counter()
+            try:
+                await device_registry.ensure(self.device_id)
+                await ingest_queue.submit(rows, wait=True)
+            except Exception as e:
+                self.write_errors += 1
+                logger.error(f"Failed to store measurement: {e}")
+                continue
+            elapsed = time.perf_counter() - started
+            self.snapshots_written += 1
+            self.last_write = datetime.now(timezone.utc)
+            self.last_write_seconds = elapsed
+            self.max_write_seconds = max(self.max_write_seconds, elapsed)
+            logger.debug(f"Stored {len(rows)} measurements")
     
-    async def _parse_schedule(self, payload):
-        """Parse schedule/event."""
-        event = payload.get("event")
-        if event is not None:
-            self.current_data["schedule_event"] = event
+    async def _probe_loop_lag(self):
+        """Measure how late the event loop runs a timer; high values stall message handling."""
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(LAG_PROBE_INTERVAL)
+            lag = max(0.0, loop.time() - started - LAG_PROBE_INTERVAL)
+            self.loop_lag_seconds = lag
+            self.max_loop_lag_seconds = max(self.max_loop_lag_seconds, lag)
     
-    async def _maybe_store_measurement(self):
-        """Store measurement if interval has passed."""
-        now = datetime.now(timezone.utc)
-        
-        if self.last_store and (now - self.last_store).total_seconds() < self.interval:
-            return
-        
-        self.last_store = now
-        
-        # Store in database
-        try:
-            async with async_session_maker() as session:
-                # Ensure device exists
-                result = await session.execute(
-                    select(Device).where(Device.device_id == self.device_id)
-                )
-                device = result.scalar_one_or_none()
-                if not device:
-                    device = Device(device_id=self.device_id)
-                    session.add(device)
-                    await session.commit()
-                
-                # Store all current measurements as individual records
-                for metric_name, metric_value in self.current_data.items():
-                    if metric_value is not None:
-                        measurement = Measurement(
-                            device_id=self.device_id,
-                            timestamp=now,
-                            metric_name=metric_name,
-                            metric_value=float(metric_value),
-                            unit="",  # Could be improved
-                            source_topic="server_collector",
-                        )
-                        session.add(measurement)
-                
-                await session.commit()
-                logger.debug(f"Stored {len(self.current_data)} measurements")
-                
-        except Exception as e:
-            logger.error(f"Failed to store measurement: {e}")
+    def stats(self) -> dict:
+        """Sampling windows, writer queue, write latency and event loop lag."""
+        return {
+            "windows": {
+                interval: {"samples_in": aggregator.samples_in, "records_out": aggregator.records_out}
+                for interval, aggregator in sorted(self.aggregators.items())
+            },
+            "snapshots_pending": self._snapshots.qsize(),
+            "snapshots_written": self.snapshots_written,
+            "snapshots_dropped": self.snapshots_dropped,
+            "write_errors": self.write_errors,
+            "last_write": self.last_write.isoformat() if self.last_write else None,
+            "last_write_ms": round(self.last_write_seconds * 1000, 2),
+            "max_write_ms": round(self.max_write_seconds * 1000, 2),
+            "loop_lag_ms": round(self.loop_lag_seconds * 1000, 2),
+            "max_loop_lag_ms": round(self.max_loop_lag_seconds * 1000, 2),
+        }
 
 
 # Global collector instance
@@ -247,7 +297,13 @@ _collector: Optional[ServerMQTTCollector] = None
 _collector_task: Optional[asyncio.Task] = None
 
 
-async def start_server_collector(broker_host: str, device_id: str, port: int = 1883, interval: int = 5):
+async def start_server_collector(
+    broker_host: str,
+    device_id: str,
+    port: int = 1883,
+    interval: int = 5,
+    policies: Iterable[SamplingPolicy] = (),
+):
     """Start the global server collector."""
     global _collector, _collector_task
     
@@ -255,7 +311,7 @@ async def start_server_collector(broker_host: str, device_id: str, port: int = 1
         logger.warning("Server collector already running")
         return
     
-    _collector = ServerMQTTCollector(broker_host, device_id, port, interval)
+    _collector = ServerMQTTCollector(broker_host, device_id, port, interval, policies=policies)
     _collector_task = asyncio.create_task(_collector.start())
     logger.info("Server collector task created")
 
@@ -279,6 +335,12 @@ async def stop_server_collector():
     logger.info("Server collector stopped and cleaned up")
 
 
+def update_sampling_policies(policies: Iterable[SamplingPolicy]):
+    """Apply new sampling policies to the running collector, if any."""
+    if _collector:
+        _collector.set_policies(policies)
+
+
 def get_collector_status() -> dict:
     """Get current collector status."""
     global _collector
@@ -289,5 +351,7 @@ def get_collector_status() -> dict:
         "mqtt_host": _collector.broker_host if _collector else None,
         "device_id": _collector.device_id if _collector else None,
         "interval": _collector.interval if _collector else None,
+        "outliers_rejected": dict(_collector.outliers.rejected) if _collector else {},
+        "writer": _collector.stats() if _collector else None,
     }
 
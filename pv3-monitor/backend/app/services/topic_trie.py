@@ -0,0 +1,98 @@
+"""
+MQTT topic trie for routing messages to handlers.
+
+Patterns are MQTT topic filters split into levels: ``+`` matches one level, ``#``
+matches the remaining levels (including none) and must come last, and ``{name}``
+matches one level like ``+`` and captures it under ``name``. Matching walks one trie
+node per topic level, preferring an exact level over ``+`` over ``#``, so the most
+specific pattern wins regardless of registration order. Results are cached per
+topic, since a broker publishes the same small set of topics over and over.
+"""
+
+from typing import Any
+
+
+class _Node:
+    __slots__ = ("children", "single", "multi", "terminal")
+
+    def __init__(self):
+        self.children: dict[str, _Node] = {}
+        # Child for a single-level wildcard (+ or {name})
+        self.single: _Node | None = None
+        # Terminal of a pattern ending in # at this node
+        self.multi: tuple[Any, tuple] | None = None
+        # Terminal of a pattern ending at this node: (value, ((level, name), ...))
+        self.terminal: tuple[Any, tuple] | None = None
+
+
+class TopicTrie:
+    """Map MQTT topic filters to values and match concrete topics against them."""
+
+    def __init__(self, cache_size: int = 4096):
+        self._root = _Node()
+        self._patterns: dict[str, Any] = {}
+        self._cache: dict[str, tuple[Any, dict[str, str]] | None] = {}
+        self.cache_size = cache_size
+
+    def __len__(self) -> int:
+        return len(self._patterns)
+
+    def __contains__(self, pattern: str) -> bool:
+        return pattern in self._patterns
+
+    def add(self, pattern: str, value: Any) -> None:
+        """Register a value for a topic filter, replacing any value it already had."""
+        levels = pattern.split("/")
+        node = self._root
+        captures = []
+        for index, level in enumerate(levels):
+            if level == "#":
+                if index != len(levels) - 1:
+                    raise ValueError(f"'#' must be the last level: {pattern}")
+                node.multi = (value, tuple(captures))
+                break
+            if level == "+" or (level.startswith("{") and level.endswith("}")):
+                if level != "+":
+                    captures.append((index, level[1:-1]))
+                if node.single is None:
+                    node.single = _Node()
+                node = node.single
+            elif "+" in level or "#" in level:
+                raise ValueError(f"Wildcards must fill a whole level: {pattern}")
+            else:
+                child = node.children.get(level)
+                if child is None:
+                    child = node.children[level] = _Node()
+                node = child
+        else:
+            node.terminal = (value, tuple(captures))
+        self._patterns[pattern] = value
+        self._cache.clear()
+
+    def match(self, topic: str) -> tuple[Any, dict[str, str]] | None:
+        """Return (value, captures) of the most specific matching filter, or None."""
+        try:
+            return self._cache[topic]
+        except KeyError:
+            pass
+        levels = topic.split("/")
+        found = self._search(self._root, levels, 0)
+        result = None if found is None else (found[0], {name: levels[i] for i, name in found[1]})
+        if len(self._cache) >= self.cache_size:
+            self._cache.clear()
+        self._cache[topic] = result
+        return result
+
+    def _search(self, node: _Node, levels: list[str], index: int) -> tuple[Any, tuple] | None:
+        if index == len(levels):
+            return node.terminal or node.multi
+        child = node.children.get(levels[index])
+        if child is not None:
+            found = self._search(child, levels, index + 1)
+            if found is not None:
+                return found
+        if node.single is not None:
+            found = self._search(node.single, levels, index + 1)
+            if found is not None:
+                return found
+        return node.multi
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Throughput of P3 topic decoding: legacy if/elif chains vs the compiled mapping table.
+
+Reports messages per second on one core (CPU time, single thread) for a message mix
+that includes topics nothing is mapped to.
+
+    python benchmarks/bench_mapping.py [--messages 200000]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from legacy_parsers import legacy_on_message
+from pv3common.mapping import TopicRouter
+
+DEVICE_ID = "PV001001DEV"
+
+SAMPLE_PAYLOADS = {
+    "bms/soc": [{"measurement": "StateOfCharge", "value": 9700}],
+    "inverter/measurements": [
+        {"channel": "BATTERY", "measurement": "Voltage", "type": "Dc", "value": 49800, "unit": "mV"},
+        {"channel": "BATTERY", "measurement": "ChargeCurrent", "type": "Dc", "value": -1200, "unit": "mA"},
+        {"channel": "BATTERY", "measurement": "Capacity", "type": "Dc", "value": 77, "unit": "%"},
+        {"channel": "GRID", "measurement": "Voltage", "type": "Ac", "value": 225800, "unit": "mV"},
+        {"channel": "GRID", "measurement": "Frequency", "type": "Ac", "value": 50012, "unit": "mHz"},
+        {"channel": "GRID", "measurement": "Power", "type": "Active", "value": -406464, "unit": "mW"},
+        {"channel": "GRID", "measurement": "Power", "type": "Reactive", "value": 1200, "unit": "mVAr"},
+    ],
+    "inverter/alarms": {
+        "timestamp": "2025-12-20T06:22:50Z",
+        "warnings_summary": "0",
+        "inverter_temperature": "35.5",
+        "boost_temperature": "33.0",
+        "inner_temperature": "30.1",
+        **{f"alarm_{i}": "0" for i in range(22)},
+    },
+    "inverter/charge": {"power": 591},
+    "pylontech/info": [
+        {"measurement": m, "type": t, "value": v}
+        for m, t, v in [
+            ("StateOfHealth", "Avg", 92), ("StateOfHealth", "Min", 92),
+            ("CycleNumber", "Avg", 844), ("CycleNumber", "Max", 877),
+            ("CellTemperature", "Avg", 20100), ("CellTemperature", "Max", 20900),
+            ("CellTemperature", "Min", 19400), ("BMSTemperature", "Avg", 20300),
+            ("BMSTemperature", "Max", 20800), ("CellVoltage", "Max", 3317),
+            ("CellVoltage", "Min", 3315), ("ModuleVoltage", "Avg", 49746),
+            ("Current", "Total", -10230), ("ChargeVoltageLimit", "", 53250),
+            ("DischargeVoltageLimit", "", 45000), ("ChargeCurrentLimit", "", 60000),
+            ("DischargeCurrentLimit", "", -150000),
+        ]
+    ],
+    "ffr/measurements": [
+        {"channel": c, "measurement": "Power", "type": "Active", "value": v}
+        for c, v in [("LOCAL", 11736), ("HOUSE", -406464), ("AUX1", -1480)]
+    ],
+    "schedule/event": {"event": 0, "setpoint": 0},
+    # Published by the P3 but not mapped to any metric
+    "status/heartbeat": {"uptime": 123456, "version": "3.2.1"},
+    "ffr/status": {"state": "idle", "armed": False},
+}
+
+
+def build_messages() -> list[tuple[str, bytes]]:
+    """One message per sample topic, as (topic, raw payload) pairs."""
+    return [
+        (f"pv/PV3/{DEVICE_ID}/{suffix}", json.dumps(payload).encode())
+        for suffix, payload in SAMPLE_PAYLOADS.items()
+    ]
+
+
+def compiled_on_message(router: TopicRouter, topic: str, raw: bytes):
+    """Route on the topic suffix, then decode and map with the compiled table."""
+    routed = router.route(topic)
+    if routed is None:
+        return None
+    return routed[1].decode(json.loads(raw.decode()))
+
+
+def measure(fn, messages: list[tuple[str, bytes]], total: int) -> float:
+    """Messages per CPU second for fn over `total` messages."""
+    rounds = max(1, total // len(messages))
+    started = time.process_time()
+    for _ in range(rounds):
+        for topic, raw in messages:
+            fn(topic, raw)
+    return rounds * len(messages) / (time.process_time() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200_000, help="messages per run")
+    args = parser.parse_args()
+
+    router = TopicRouter()
+    messages = build_messages()
+
+    before = measure(legacy_on_message, messages, args.messages)
+    after = measure(lambda topic, raw: compiled_on_message(router, topic, raw), messages, args.messages)
+
+    print(f"{'implementation':<20} {'msg/s/core':>12}")
+    print(f"{'legacy if/elif':<20} {before:>12,.0f}")
+    print(f"{'compiled mapping':<20} {after:>12,.0f}")
+    print(f"speedup: {after / before:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
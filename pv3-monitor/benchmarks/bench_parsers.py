@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Per-topic cost of the P3 parse path: decode, route and map, plus the full message
+handlers of the collector, ServerMQTTCollector and MQTTService.
+
+For every topic in payloads.TOPICS and every stage it reports time per message (best of
+--repeat runs, CPU-bound, GC disabled) and allocations per message from tracemalloc:
+the transient peak while handling one message and the blocks still held afterwards.
+Results can be written as JSON and compared against an earlier run.
+
+    python benchmarks/bench_parsers.py [--messages 2000] [--output results.json] [--compare baseline.json]
+
+The server and service stages need the backend's packages (backend/requirements.txt);
+they are skipped when those are not installed.
+"""
+
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Callable
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "collector"))
+
+from payloads import TOPICS, generate_all
+from pv3common.mapping import TopicRouter
+
+# A stage takes the list of (topic, raw) messages and returns a per-message callable and its inputs
+Stage = Callable[[list[tuple[str, bytes]]], tuple[Callable, list]]
+
+
+def _drive(coro):
+    """Run a coroutine that never suspends, without an event loop in the timing."""
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coro.close()
+    raise RuntimeError("handler suspended; it cannot be benchmarked synchronously")
+
+
+def decode_stage(messages):
+    return (lambda raw: json.loads(raw.decode())), [raw for _, raw in messages]
+
+
+def route_stage(messages):
+    router = TopicRouter()
+    return router.route, [topic for topic, _ in messages]
+
+
+def map_stage(messages):
+    router = TopicRouter()
+    spec = router.route(messages[0][0])[1]
+    return spec.decode, [json.loads(raw.decode()) for _, raw in messages]
+
+
+def collector_stage(messages):
+    """PV3Collector.on_message: MessageProcessor.handle with the outlier filter, queuing on an empty sink set."""
+    from processor import MessageProcessor
+    from pv3common.outlier import OutlierFilter
+    from sinks import SinkSet
+
+    processor = MessageProcessor(SinkSet([]), outliers=OutlierFilter())
+    return (lambda message: processor.handle(*message)), messages
+
+
+def server_stage(messages):
+    """ServerMQTTCollector.handle_message: decode, outlier filter and window aggregation."""
+    from app.services.server_collector import ServerMQTTCollector
+
+    collector = ServerMQTTCollector("benchmark", "benchmark", interval=10**9)
+    inputs = [SimpleNamespace(topic=topic, payload=raw) for topic, raw in messages]
+    return collector.handle_message, inputs
+
+
+def service_stage(messages):
+    """MQTTService._on_message: topic trie routing, JSON decode and the mapped-topic handler."""
+    from app.services.mqtt_client import MQTTService, handle_mapped_topic, topic_router
+
+    service = MQTTService()
+    for suffix in topic_router.specs:
+        service.register_handler(suffix, handle_mapped_topic)
+
+    def handle(message):
+        topic, raw = message
+        handler, captures = service._find_handler(topic)
+        _drive(handler(captures["device_id"], topic.split("/", 3)[3], json.loads(raw.decode())))
+
+    return handle, messages
+
+
+STAGES: dict[str, Stage] = {
+    "decode": decode_stage,
+    "route": route_stage,
+    "map": map_stage,
+    "collector": collector_stage,
+    "server": server_stage,
+    "service": service_stage,
+}
+
+
+def _backend_available() -> bool:
+    sys.path.insert(0, os.path.join(ROOT, "backend"))
+    try:
+        import app.services.mqtt_client  # noqa: F401
+        import app.services.server_collector  # noqa: F401
+    except ImportError as e:
+        print(f"Skipping server and service stages: {e}", file=sys.stderr)
+        return False
+    return True
+
+
+def time_per_message(fn: Callable, inputs: list, repeat: int) -> float:
+    """Best-of-`repeat` nanoseconds per call of fn over all inputs."""
+    best = float("inf")
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter_ns()
+            for item in inputs:
+                fn(item)
+            best = min(best, time.perf_counter_ns() - started)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return best / len(inputs)
+
+
+def allocations_per_message(fn: Callable, inputs: list) -> tuple[float, float, float]:
+    """Mean transient peak bytes, retained blocks and retained bytes per call of fn."""
+    results = []
+    peak_total = 0
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        for item in inputs:
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            results.append(fn(item))
+            peak_total += tracemalloc.get_traced_memory()[1] - current
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    diff = after.compare_to(before, "filename")
+    # The results list itself is benchmark bookkeeping, not a cost of the parser
+    list_bytes = sys.getsizeof(results)
+    blocks = sum(stat.count_diff for stat in diff) - 1
+    size = sum(stat.size_diff for stat in diff) - list_bytes
+    count = len(inputs)
+    return peak_total / count, max(blocks, 0) / count, max(size, 0) / count
+
+
+def run(messages_per_topic: int, repeat: int, seed: int, stages: list[str]) -> dict:
+    messages = generate_all(messages_per_topic, seed)
+    results = {}
+    for suffix in TOPICS:
+        topic_messages = messages[suffix]
+        entry = {
+            "payload_bytes": sum(len(raw) for _, raw in topic_messages) / len(topic_messages),
+            "stages": {},
+        }
+        for name in stages:
+            fn, inputs = STAGES[name](topic_messages)
+            # Warm up caches (and the SOC/state a handler keeps) before timing
+            for item in inputs[:100]:
+                fn(item)
+            ns = time_per_message(fn, inputs, repeat)
+            peak, blocks, retained = allocations_per_message(fn, inputs)
+            entry["stages"][name] = {
+                "ns_per_message": round(ns, 1),
+                "messages_per_second": round(1e9 / ns),
+                "alloc_peak_bytes": round(peak, 1),
+                "retained_blocks": round(blocks, 2),
+                "retained_bytes": round(retained, 1),
+            }
+        results[suffix] = entry
+    return results
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(results: dict, baseline: dict | None = None):
+    header = f"{'topic':<24} {'stage':<10} {'bytes':>7} {'ns/msg':>10} {'msg/s':>11} {'peak B':>9} {'kept blk':>9}"
+    if baseline:
+        header += f" {'vs base':>8}"
+    print(header)
+    for suffix, entry in results.items():
+        for name, stage in entry["stages"].items():
+            line = (
+                f"{suffix:<24} {name:<10} {entry['payload_bytes']:>7.0f} {stage['ns_per_message']:>10,.0f} "
+                f"{stage['messages_per_second']:>11,} {stage['alloc_peak_bytes']:>9,.0f} {stage['retained_blocks']:>9.1f}"
+            )
+            if baseline:
+                before = baseline.get(suffix, {}).get("stages", {}).get(name)
+                if before:
+                    change = stage["ns_per_message"] / before["ns_per_message"] - 1
+                    line += f" {change:>+8.1%}"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000, help="generated messages per topic")
+    parser.add_argument("--repeat", type=int, default=5, help="timing runs per stage; the best is reported")
+    parser.add_argument("--seed", type=int, default=0, help="payload generator seed")
+    parser.add_argument("--stages", default=",".join(STAGES), help="comma-separated stages to run")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare time per message against")
+    args = parser.parse_args()
+
+    stages = [name.strip() for name in args.stages.split(",") if name.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+    if {"server", "service"} & set(stages) and not _backend_available():
+        stages = [name for name in stages if name not in ("server", "service")]
+
+    # Handlers log per message (e.g. SOC outliers); keep that out of the timings
+    logging.disable(logging.WARNING)
+    results = run(args.messages, args.repeat, args.seed, stages)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    print_table(results, baseline)
+
+    if args.output:
+        report = {
+            "meta": {
+                "created": datetime.now(timezone.utc).isoformat(),
+                "commit": _git_commit(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "messages_per_topic": args.messages,
+                "repeat": args.repeat,
+                "seed": args.seed,
+            },
+            "results": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
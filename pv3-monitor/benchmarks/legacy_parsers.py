@@ -0,0 +1,161 @@
+"""
+Frozen copy of the if/elif topic decoding the collector used before the compiled
+mapping table, kept only as the "before" baseline for bench_mapping.py.
+"""
+
+import json
+
+
+def legacy_on_message(topic: str, raw: bytes) -> list[tuple[str, float, str]]:
+    """Decode, route and map one message the way PV3Collector.on_message used to."""
+    topic_parts = topic.split("/")
+    if len(topic_parts) >= 4:
+        topic_suffix = "/".join(topic_parts[3:])
+    else:
+        return []
+
+    try:
+        payload = json.loads(raw.decode())
+    except json.JSONDecodeError:
+        return []
+
+    if topic_suffix == "bms/soc":
+        return _soc(payload)
+    elif topic_suffix == "inverter/measurements":
+        return _inverter_measurements(payload)
+    elif topic_suffix == "inverter/alarms":
+        return _inverter_alarms(payload)
+    elif topic_suffix == "inverter/charge":
+        power = payload.get("power")
+        return [("battery_power", power, "W")] if power is not None else []
+    elif topic_suffix == "pylontech/info":
+        return _pylontech_info(payload)
+    elif topic_suffix == "ffr/measurements":
+        return _ffr_measurements(payload)
+    elif topic_suffix == "schedule/event":
+        out = []
+        if payload.get("event") is not None:
+            out.append(("schedule_event", payload["event"], ""))
+        if payload.get("setpoint") is not None:
+            out.append(("schedule_setpoint", payload["setpoint"], "W"))
+        return out
+    return []
+
+
+def _soc(payload):
+    if isinstance(payload, list):
+        for item in payload:
+            if item.get("measurement") == "StateOfCharge":
+                value = item.get("value")
+                if value is not None:
+                    return [("soc", value / 100.0, "%")]
+        return []
+    usable_soc = payload.get("usable_soc") or payload.get("StateOfCharge")
+    return [("soc", usable_soc / 100.0, "%")] if usable_soc is not None else []
+
+
+def _inverter_measurements(payload):
+    out = []
+    for item in payload:
+        channel = item.get("channel", "")
+        measurement = item.get("measurement", "")
+        value = item.get("value")
+        if value is None:
+            continue
+        if channel == "BATTERY":
+            if measurement == "Voltage":
+                out.append(("battery_voltage", value / 1000.0, "V"))
+            elif measurement == "ChargeCurrent":
+                out.append(("battery_current", value / 1000.0, "A"))
+            elif measurement == "Capacity":
+                out.append(("battery_capacity", value, "%"))
+        elif channel == "GRID":
+            if measurement == "Voltage" and item.get("type") == "Ac":
+                out.append(("grid_voltage", value / 1000.0, "V"))
+            elif measurement == "Frequency":
+                out.append(("grid_frequency", value / 1000.0, "Hz"))
+            elif measurement == "Power" and item.get("type") == "Active":
+                out.append(("grid_power", value / 1000.0, "W"))
+    return out
+
+
+def _inverter_alarms(payload):
+    exclude_keys = ["timestamp", "warnings_summary", "inverter_temperature", "boost_temperature", "inner_temperature"]
+    out = []
+    alarm_states = {}
+    for key, value in payload.items():
+        if key in exclude_keys:
+            if "temperature" in key:
+                try:
+                    out.append((key, float(value), "C"))
+                except (ValueError, TypeError):
+                    pass
+        else:
+            alarm_states[key] = value == "1"
+    return out
+
+
+def _pylontech_info(payload):
+    out = []
+    for item in payload:
+        measurement_type = item.get("measurement")
+        value_type = item.get("type")
+        value = item.get("value")
+        if value is None:
+            continue
+        if measurement_type == "StateOfHealth":
+            if value_type == "Avg":
+                out.append(("soh", float(value), "%"))
+            elif value_type == "Min":
+                out.append(("soh_min", float(value), "%"))
+        elif measurement_type == "CycleNumber":
+            if value_type == "Avg":
+                out.append(("cycle_count_avg", float(value), "cycles"))
+            elif value_type == "Max":
+                out.append(("cycle_count_max", float(value), "cycles"))
+        elif measurement_type == "CellTemperature":
+            if value_type == "Avg":
+                out.append(("cell_temp_avg", value / 1000.0, "C"))
+            elif value_type == "Max":
+                out.append(("cell_temp_max", value / 1000.0, "C"))
+            elif value_type == "Min":
+                out.append(("cell_temp_min", value / 1000.0, "C"))
+        elif measurement_type == "BMSTemperature":
+            if value_type == "Avg":
+                out.append(("bms_temp_avg", value / 1000.0, "C"))
+            elif value_type == "Max":
+                out.append(("bms_temp_max", value / 1000.0, "C"))
+        elif measurement_type == "CellVoltage":
+            if value_type == "Max":
+                out.append(("cell_voltage_max", float(value), "mV"))
+            elif value_type == "Min":
+                out.append(("cell_voltage_min", float(value), "mV"))
+        elif measurement_type == "ModuleVoltage" and value_type == "Avg":
+            out.append(("module_voltage_avg", value / 1000.0, "V"))
+        elif measurement_type == "Current" and value_type == "Total":
+            out.append(("battery_current_total", value / 1000.0, "A"))
+        elif measurement_type == "ChargeVoltageLimit":
+            out.append(("charge_voltage_limit", value / 1000.0, "V"))
+        elif measurement_type == "DischargeVoltageLimit":
+            out.append(("discharge_voltage_limit", value / 1000.0, "V"))
+        elif measurement_type == "ChargeCurrentLimit":
+            out.append(("charge_current_limit", value / 1000.0, "A"))
+        elif measurement_type == "DischargeCurrentLimit":
+            out.append(("discharge_current_limit", abs(value / 1000.0), "A"))
+    return out
+
+
+def _ffr_measurements(payload):
+    out = []
+    for item in payload:
+        channel = item.get("channel")
+        value = item.get("value")
+        if value is None or item.get("measurement") != "Power" or item.get("type") != "Active":
+            continue
+        if channel == "LOCAL":
+            out.append(("house_power", value / 1000.0, "W"))
+        elif channel == "HOUSE":
+            out.append(("grid_power", value / 1000.0, "W"))
+        elif channel == "AUX1":
+            out.append(("aux_power", value / 1000.0, "W"))
+    return out
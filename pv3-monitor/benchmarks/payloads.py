@@ -0,0 +1,152 @@
+"""
+Synthetic P3 MQTT payloads for benchmarks.
+
+Messages follow the shapes the P3 publishes, including the entries nothing is mapped to
+(per-module and per-cell Pylontech readings, inverter channels without a metric), so
+payload sizes and the share of skipped items are close to the real stream. Values drift
+around plausible operating points; a fixed seed gives the same messages on every run.
+"""
+
+import json
+import math
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+
+DEVICE_ID = "PV001001DEV"
+
+# Topics covered by the generator, in the order benchmarks report them
+TOPICS = [
+    "bms/soc",
+    "inverter/measurements",
+    "inverter/alarms",
+    "ffr/measurements",
+    "pylontech/info",
+]
+
+# Pylontech US-series pack defaults: modules per battery and cells per module
+PYLONTECH_MODULES = 4
+PYLONTECH_CELLS = 15
+
+INVERTER_ALARM_COUNT = 22
+
+
+def _jitter(rng: random.Random, centre: float, spread: float) -> int:
+    return int(round(centre + rng.uniform(-spread, spread)))
+
+
+def bms_soc(rng: random.Random, step: int) -> list[dict]:
+    # SOC moves slowly, so consecutive samples stay within the outlier filter's threshold
+    soc = 6500 + 3000 * math.sin(step / 2000)
+    return [{"measurement": "StateOfCharge", "value": _jitter(rng, soc, 5)}]
+
+
+def inverter_measurements(rng: random.Random, step: int) -> list[dict]:
+    grid_power = _jitter(rng, -400_000, 2_500_000)
+    battery_current = _jitter(rng, 0, 50_000)
+    items = [
+        ("BATTERY", "Voltage", "Dc", _jitter(rng, 50_000, 2_000), "mV"),
+        ("BATTERY", "ChargeCurrent", "Dc", battery_current, "mA"),
+        ("BATTERY", "Power", "Dc", battery_current * 50, "mW"),
+        ("BATTERY", "Capacity", "Dc", _jitter(rng, 65, 30), "%"),
+        ("GRID", "Voltage", "Ac", _jitter(rng, 235_000, 8_000), "mV"),
+        ("GRID", "Current", "Ac", abs(grid_power) // 235, "mA"),
+        ("GRID", "Frequency", "Ac", _jitter(rng, 50_000, 150), "mHz"),
+        ("GRID", "Power", "Active", grid_power, "mW"),
+        ("GRID", "Power", "Reactive", _jitter(rng, 0, 50_000), "mVAr"),
+        ("GRID", "Power", "Apparent", abs(grid_power) + 1_000, "mVA"),
+        ("LOAD", "Voltage", "Ac", _jitter(rng, 235_000, 8_000), "mV"),
+        ("LOAD", "Current", "Ac", _jitter(rng, 2_000, 1_500), "mA"),
+        ("LOAD", "Power", "Active", _jitter(rng, 450_000, 400_000), "mW"),
+        ("EPS", "Voltage", "Ac", 0, "mV"),
+        ("EPS", "Power", "Active", 0, "mW"),
+    ]
+    return [
+        {"channel": channel, "measurement": measurement, "type": value_type, "value": value, "unit": unit}
+        for channel, measurement, value_type, value, unit in items
+    ]
+
+
+def inverter_alarms(rng: random.Random, step: int) -> dict:
+    timestamp = datetime(2025, 12, 20, 6, 0, tzinfo=timezone.utc) + timedelta(seconds=rng.randrange(86400))
+    payload = {
+        "timestamp": timestamp.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "warnings_summary": "0",
+        "inverter_temperature": f"{rng.uniform(25, 55):.1f}",
+        "boost_temperature": f"{rng.uniform(25, 50):.1f}",
+        "inner_temperature": f"{rng.uniform(20, 40):.1f}",
+    }
+    for i in range(INVERTER_ALARM_COUNT):
+        payload[f"alarm_{i}"] = "1" if rng.random() < 0.02 else "0"
+    return payload
+
+
+def ffr_measurements(rng: random.Random, step: int) -> list[dict]:
+    return [
+        {"channel": "LOCAL", "measurement": "Power", "type": "Active", "value": _jitter(rng, 450_000, 400_000)},
+        {"channel": "HOUSE", "measurement": "Power", "type": "Active", "value": _jitter(rng, -400_000, 2_500_000)},
+        {"channel": "AUX1", "measurement": "Power", "type": "Active", "value": _jitter(rng, 0, 5_000)},
+        {"channel": "AUX2", "measurement": "Power", "type": "Active", "value": 0},
+        {"channel": "LOCAL", "measurement": "Frequency", "type": "Ac", "value": _jitter(rng, 50_000, 150)},
+    ]
+
+
+def pylontech_info(
+    rng: random.Random,
+    step: int,
+    modules: int = PYLONTECH_MODULES,
+    cells: int = PYLONTECH_CELLS,
+) -> list[dict]:
+    """Pack summary followed by per-module and per-cell readings (the bulk of the payload)."""
+    cell_mv = [_jitter(rng, 3_310, 15) for _ in range(modules * cells)]
+    cell_mc = [_jitter(rng, 20_000, 1_500) for _ in range(modules * cells)]
+    current = _jitter(rng, 0, 50_000)
+    summary = [
+        ("StateOfHealth", "Avg", 92), ("StateOfHealth", "Min", 91),
+        ("CycleNumber", "Avg", 844), ("CycleNumber", "Max", 877),
+        ("CellTemperature", "Avg", sum(cell_mc) // len(cell_mc)),
+        ("CellTemperature", "Max", max(cell_mc)), ("CellTemperature", "Min", min(cell_mc)),
+        ("BMSTemperature", "Avg", _jitter(rng, 20_300, 800)),
+        ("BMSTemperature", "Max", _jitter(rng, 20_800, 800)),
+        ("CellVoltage", "Max", max(cell_mv)), ("CellVoltage", "Min", min(cell_mv)),
+        ("ModuleVoltage", "Avg", sum(cell_mv) // modules),
+        ("Current", "Total", current),
+        ("ChargeVoltageLimit", "", 53_250), ("DischargeVoltageLimit", "", 45_000),
+        ("ChargeCurrentLimit", "", 60_000), ("DischargeCurrentLimit", "", -150_000),
+    ]
+    items = [{"measurement": m, "type": t, "value": v} for m, t, v in summary]
+    for module in range(modules):
+        channel = f"MODULE{module + 1}"
+        module_cells = slice(module * cells, (module + 1) * cells)
+        items += [
+            {"channel": channel, "measurement": "ModuleVoltage", "type": "", "value": sum(cell_mv[module_cells])},
+            {"channel": channel, "measurement": "ModuleCurrent", "type": "", "value": current // modules},
+            {"channel": channel, "measurement": "ModuleSOC", "type": "", "value": _jitter(rng, 65, 30)},
+        ]
+        for cell in range(cells):
+            index = module * cells + cell
+            items.append({"channel": channel, "measurement": "Cell", "type": f"V{cell + 1}", "value": cell_mv[index]})
+            items.append({"channel": channel, "measurement": "Cell", "type": f"T{cell + 1}", "value": cell_mc[index]})
+    return items
+
+
+GENERATORS: dict[str, Callable[[random.Random, int], list | dict]] = {
+    "bms/soc": bms_soc,
+    "inverter/measurements": inverter_measurements,
+    "inverter/alarms": inverter_alarms,
+    "ffr/measurements": ffr_measurements,
+    "pylontech/info": pylontech_info,
+}
+
+
+def generate(suffix: str, count: int, seed: int = 0, device_id: str = DEVICE_ID) -> list[tuple[str, bytes]]:
+    """`count` messages for one topic suffix, as (topic, raw payload) pairs."""
+    rng = random.Random(f"{seed}:{suffix}")
+    topic = f"pv/PV3/{device_id}/{suffix}"
+    make = GENERATORS[suffix]
+    return [(topic, json.dumps(make(rng, step), separators=(",", ":")).encode()) for step in range(count)]
+
+
+def generate_all(count: int, seed: int = 0, device_id: str = DEVICE_ID) -> dict[str, list[tuple[str, bytes]]]:
+    """`count` messages for every topic in TOPICS."""
+    return {suffix: generate(suffix, count, seed, device_id) for suffix in TOPICS}
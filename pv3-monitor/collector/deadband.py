@@ -0,0 +1,154 @@
+"""
+Report-by-exception filtering for the PV3 MQTT collector.
+
+Most P3 metrics barely move between messages. DeadbandFilter forwards a sample only
+when it moves past its metric's deadband or when the metric has been silent for its
+heartbeat interval, and counts what each rule suppressed.
+"""
+
+import json
+import logging
+import time
+from typing import NamedTuple
+
+logger = logging.getLogger("pv3_collector.deadband")
+
+
+class DeadbandRule(NamedTuple):
+    """Forward when |change| > max(absolute, relative * |last|), or after max_silence seconds."""
+
+    absolute: float = 0.0
+    relative: float = 0.0
+    max_silence: float = 300.0
+
+
+# Metrics without a rule are always forwarded. A zero deadband forwards on any change.
+DEFAULT_RULES: dict[str, DeadbandRule] = {
+    # Battery health
+    "soh": DeadbandRule(max_silence=900),
+    "soh_min": DeadbandRule(max_silence=900),
+    "cycle_count_avg": DeadbandRule(max_silence=900),
+    "cycle_count_max": DeadbandRule(max_silence=900),
+    "cell_voltage_max": DeadbandRule(absolute=2.0),
+    "cell_voltage_min": DeadbandRule(absolute=2.0),
+    "module_voltage_avg": DeadbandRule(absolute=0.05),
+    # Limits
+    "charge_voltage_limit": DeadbandRule(max_silence=900),
+    "discharge_voltage_limit": DeadbandRule(max_silence=900),
+    "charge_current_limit": DeadbandRule(max_silence=900),
+    "discharge_current_limit": DeadbandRule(max_silence=900),
+    "max_charge_power": DeadbandRule(max_silence=900),
+    "max_discharge_power": DeadbandRule(max_silence=900),
+    # Temperatures
+    "cell_temp_avg": DeadbandRule(absolute=0.2),
+    "cell_temp_max": DeadbandRule(absolute=0.2),
+    "cell_temp_min": DeadbandRule(absolute=0.2),
+    "bms_temp_avg": DeadbandRule(absolute=0.2),
+    "bms_temp_max": DeadbandRule(absolute=0.2),
+    "inverter_temperature": DeadbandRule(absolute=0.5),
+    "boost_temperature": DeadbandRule(absolute=0.5),
+    "inner_temperature": DeadbandRule(absolute=0.5),
+    # Slow-moving state
+    "battery_capacity": DeadbandRule(),
+    "grid_voltage": DeadbandRule(absolute=0.5),
+    "grid_frequency": DeadbandRule(absolute=0.02),
+    "eps_reserve": DeadbandRule(max_silence=900),
+    "eps_schedule_reserve": DeadbandRule(max_silence=900),
+}
+
+
+def load_rules(path: str | None) -> dict[str, DeadbandRule]:
+    """Default rules, overridden per metric by an optional JSON file.
+
+    The file maps metric names to ``{"absolute": ..., "relative": ..., "max_silence": ...}``;
+    ``null`` removes the rule so the metric is always forwarded.
+    """
+    rules = dict(DEFAULT_RULES)
+    if not path:
+        return rules
+
+    with open(path, encoding="utf-8") as f:
+        overrides = json.load(f)
+    for metric, spec in overrides.items():
+        if spec is None:
+            rules.pop(metric, None)
+        else:
+            rules[metric] = DeadbandRule(**spec)
+    logger.info(f"Loaded {len(overrides)} deadband overrides from {path}")
+    return rules
+
+
+class DeadbandFilter:
+    """Per device and metric deadband with a heartbeat."""
+
+    def __init__(self, rules: dict[str, DeadbandRule] | None = None, report_interval: float = 600.0):
+        self.rules = rules if rules is not None else dict(DEFAULT_RULES)
+        self.report_interval = report_interval
+
+        # Per metric: forwarded because the value moved (or was the first), forwarded only
+        # because max_silence elapsed, and suppressed
+        self.forwarded: dict[str, int] = {}
+        self.heartbeats: dict[str, int] = {}
+        self.suppressed: dict[str, int] = {}
+
+        # (device_id, metric) -> (last forwarded value, when it was forwarded)
+        self._last: dict[tuple[str, str], tuple[float, float]] = {}
+        self._last_report = time.monotonic()
+
+    def allow(self, device_id: str, metric: str, value: float, now: float) -> bool:
+        """Decide whether a sample should be forwarded, updating state if it is."""
+        rule = self.rules.get(metric)
+        if rule is None:
+            return True
+
+        key = (device_id, metric)
+        last = self._last.get(key)
+        counts = self.forwarded
+        if last is not None:
+            last_value, last_time = last
+            threshold = max(rule.absolute, rule.relative * abs(last_value))
+            if abs(value - last_value) <= threshold:
+                if now - last_time < rule.max_silence:
+                    self.suppressed[metric] = self.suppressed.get(metric, 0) + 1
+                    return False
+                counts = self.heartbeats
+
+        self._last[key] = (value, now)
+        counts[metric] = counts.get(metric, 0) + 1
+        return True
+
+    def filter(self, device_id: str, measurements: list[dict], now: float | None = None) -> list[dict]:
+        """Drop the measurements that are inside their deadband."""
+        if now is None:
+            now = time.monotonic()
+        kept = [
+            m for m in measurements
+            if self.allow(device_id, m["metric_name"], m["metric_value"], now)
+        ]
+        if now - self._last_report >= self.report_interval:
+            self._report(now)
+        return kept
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """Forwarded, heartbeat and suppressed sample counts per rule."""
+        return {
+            metric: {
+                "forwarded": self.forwarded.get(metric, 0),
+                "heartbeat": self.heartbeats.get(metric, 0),
+                "suppressed": self.suppressed.get(metric, 0),
+            }
+            for metric in self.rules
+        }
+
+    def _report(self, now: float):
+        self._last_report = now
+        total_suppressed = sum(self.suppressed.values())
+        total = total_suppressed + sum(self.forwarded.values()) + sum(self.heartbeats.values())
+        if not total:
+            return
+        top = sorted(self.suppressed.items(), key=lambda kv: kv[1], reverse=True)[:5]
+        logger.info(
+            f"Deadband suppressed {total_suppressed}/{total} samples "
+            f"({100.0 * total_suppressed / total:.1f}%); top: "
+            + ", ".join(f"{metric}={count}" for metric, count in top)
+        )
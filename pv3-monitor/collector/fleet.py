@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+PV3 MQTT Fleet Collector
+
+Collects from many Powervault P3 units in one asyncio process. Each P3 runs its own
+broker, so every device gets its own MQTT connection task with its own reconnect
+backoff; a dead unit only delays itself. Messages from all devices go through one
+MessageProcessor (per-device state) and one set of output sinks.
+
+Devices come from FLEET_CONFIG (a JSON file) and/or, with FLEET_FROM_API, from the
+devices table via GET /api/devices. Both are re-read every FLEET_REFRESH_SECONDS.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+from typing import NamedTuple
+
+import asyncio_mqtt as aiomqtt
+import paho.mqtt.client as paho
+import requests
+
+from metrics import CollectorMetrics
+from mqtt_collector import (
+    API_URL,
+    METRICS_HOST,
+    METRICS_PORT,
+    SINK_OUTPUT_DIR,
+    SINK_PROMETHEUS_PORT,
+    SPOOL_DIR,
+    build_processor,
+    build_sinks,
+)
+from processor import MessageProcessor
+
+# Fleet configuration
+FLEET_CONFIG = os.getenv("FLEET_CONFIG", "")
+FLEET_FROM_API = os.getenv("FLEET_FROM_API", "false").lower() in ("1", "true", "yes")
+FLEET_REFRESH_SECONDS = float(os.getenv("FLEET_REFRESH_SECONDS", "300"))
+FLEET_STATUS_SECONDS = float(os.getenv("FLEET_STATUS_SECONDS", "60"))
+FLEET_BACKOFF_INITIAL_SECONDS = float(os.getenv("FLEET_BACKOFF_INITIAL_SECONDS", "1"))
+FLEET_BACKOFF_MAX_SECONDS = float(os.getenv("FLEET_BACKOFF_MAX_SECONDS", "300"))
+FLEET_MESSAGE_QUEUE_SIZE = int(os.getenv("FLEET_MESSAGE_QUEUE_SIZE", "1000"))
+
+logger = logging.getLogger("pv3_collector.fleet")
+
+# asyncio-mqtt with paho-mqtt>=2.1.0 lacks message_retry_set; add no-op to avoid AttributeError
+if not hasattr(paho.Client, "message_retry_set"):
+    setattr(paho.Client, "message_retry_set", lambda self, *_, **__: None)
+
+
+class DeviceEndpoint(NamedTuple):
+    """Where to reach one P3's broker."""
+
+    device_id: str
+    host: str
+    port: int = 1883
+    username: str | None = None
+    password: str | None = None
+
+
+def load_devices_file(path: str) -> list[DeviceEndpoint]:
+    """Read devices from a JSON file.
+
+    The file holds a list (or ``{"devices": [...]}``) of objects with ``device_id``,
+    ``host`` and optionally ``port``, ``username`` and ``password``.
+    """
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get("devices", [])
+    return [
+        DeviceEndpoint(
+            device_id=entry["device_id"],
+            host=entry["host"],
+            port=int(entry.get("port") or 1883),
+            username=entry.get("username"),
+            password=entry.get("password"),
+        )
+        for entry in data
+    ]
+
+
+def fetch_devices(api_url: str, timeout: float = 10.0) -> list[DeviceEndpoint]:
+    """Read devices with an MQTT host from the devices table."""
+    response = requests.get(f"{api_url}/api/devices", timeout=timeout)
+    response.raise_for_status()
+    return [
+        DeviceEndpoint(
+            device_id=device["device_id"],
+            host=device["mqtt_host"],
+            port=device.get("mqtt_port") or 1883,
+        )
+        for device in response.json()
+        if device.get("mqtt_host")
+    ]
+
+
+def read_fleet() -> list[DeviceEndpoint] | None:
+    """Read the configured device list, or None if no source could be read."""
+    devices: dict[str, DeviceEndpoint] = {}
+    loaded = False
+    if FLEET_CONFIG:
+        try:
+            for endpoint in load_devices_file(FLEET_CONFIG):
+                devices[endpoint.device_id] = endpoint
+            loaded = True
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Failed to read fleet config {FLEET_CONFIG}: {e}")
+    if FLEET_FROM_API:
+        try:
+            for endpoint in fetch_devices(API_URL):
+                devices.setdefault(endpoint.device_id, endpoint)
+            loaded = True
+        except (requests.RequestException, ValueError, KeyError) as e:
+            logger.error(f"Failed to fetch devices from {API_URL}: {e}")
+    return list(devices.values()) if loaded else None
+
+
+class Backoff:
+    """Exponential reconnect delay with jitter, one per device."""
+
+    def __init__(self, initial: float, maximum: float):
+        self.initial = initial
+        self.maximum = maximum
+        self.current = initial
+
+    def next(self) -> float:
+        """Return the next delay and double the ceiling for the one after."""
+        # Jitter spreads out reconnects of units that dropped at the same time
+        delay = random.uniform(self.current / 2, self.current)
+        self.current = min(self.current * 2, self.maximum)
+        return delay
+
+    def reset(self):
+        self.current = self.initial
+
+
+class DeviceConnection:
+    """One P3 broker connection, reconnecting on its own schedule."""
+
+    def __init__(self, endpoint: DeviceEndpoint, processor: MessageProcessor):
+        self.endpoint = endpoint
+        self.processor = processor
+        self.backoff = Backoff(FLEET_BACKOFF_INITIAL_SECONDS, FLEET_BACKOFF_MAX_SECONDS)
+        self.connected = False
+        self.reconnects = 0
+        self.errors = 0
+        self.task: asyncio.Task | None = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run(), name=f"pv3-device-{self.endpoint.device_id}")
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    async def run(self):
+        endpoint = self.endpoint
+        topic = f"pv/PV3/{endpoint.device_id}/#"
+        while True:
+            try:
+                async with aiomqtt.Client(
+                    endpoint.host,
+                    endpoint.port,
+                    username=endpoint.username,
+                    password=endpoint.password,
+                    keepalive=60,
+                ) as client:
+                    async with client.messages(queue_maxsize=FLEET_MESSAGE_QUEUE_SIZE) as messages:
+                        await client.subscribe(topic)
+                        logger.info(f"Connected to {endpoint.host}:{endpoint.port}, subscribed to {topic}")
+                        self.connected = True
+                        self.backoff.reset()
+                        async for message in messages:
+                            self.handle(message)
+            except aiomqtt.MqttError as e:
+                logger.warning(f"MQTT error for {endpoint.device_id} at {endpoint.host}:{endpoint.port}: {e}")
+            except Exception as e:
+                logger.error(f"Unexpected error for {endpoint.device_id}: {e}", exc_info=True)
+
+            self.connected = False
+            self.reconnects += 1
+            delay = self.backoff.next()
+            logger.info(f"Reconnecting to {endpoint.device_id} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    def handle(self, message: aiomqtt.Message):
+        topic = message.topic.value
+        try:
+            self.processor.handle(topic, message.payload)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Error processing message from {topic}: {e}", exc_info=True)
+
+
+class FleetCollector:
+    """Hold one connection task per device and keep the set in line with the configuration."""
+
+    def __init__(
+        self,
+        spool_dir: str = SPOOL_DIR,
+        output_dir: str = SINK_OUTPUT_DIR,
+        prometheus_port: int = SINK_PROMETHEUS_PORT,
+        refresh_interval: float = FLEET_REFRESH_SECONDS,
+        status_interval: float = FLEET_STATUS_SECONDS,
+        metrics_port: int = METRICS_PORT,
+    ):
+        self.metrics = CollectorMetrics() if metrics_port else None
+        self.metrics_port = metrics_port
+        self.sinks, self.spool, self.replayer = build_sinks(spool_dir, output_dir, prometheus_port, self.metrics)
+        self.processor = build_processor(self.sinks, self.metrics)
+        self.connections: dict[str, DeviceConnection] = {}
+        if self.metrics:
+            self.metrics.watch(
+                self.processor,
+                self.sinks,
+                lambda: [((device_id,), c.reconnects) for device_id, c in list(self.connections.items())],
+                self.spool,
+            )
+        self.refresh_interval = refresh_interval
+        self.status_interval = status_interval
+        self.running = False
+
+    async def load_devices(self) -> list[DeviceEndpoint] | None:
+        """Read the configured device list, or None if no source could be read."""
+        return await asyncio.to_thread(read_fleet)
+
+    async def sync(self, endpoints: list[DeviceEndpoint]):
+        """Start connections for new devices, restart changed ones and stop removed ones."""
+        wanted = {endpoint.device_id: endpoint for endpoint in endpoints}
+        for device_id in list(self.connections):
+            connection = self.connections[device_id]
+            if wanted.get(device_id) != connection.endpoint:
+                await connection.stop()
+                del self.connections[device_id]
+                logger.info(f"Stopped collecting from {device_id}")
+        for device_id, endpoint in wanted.items():
+            if device_id not in self.connections:
+                connection = DeviceConnection(endpoint, self.processor)
+                self.connections[device_id] = connection
+                connection.start()
+                logger.info(f"Collecting from {device_id} at {endpoint.host}:{endpoint.port}")
+
+    def log_status(self):
+        connected = sum(1 for c in self.connections.values() if c.connected)
+        messages = sum(state.messages for state in self.processor.devices.values())
+        logger.info(
+            f"Fleet: {connected}/{len(self.connections)} devices connected, "
+            f"{messages} messages, sinks {self.sinks.stats()}"
+        )
+
+    async def run(self):
+        """Collect from the fleet, refreshing the device list, until stopped or cancelled."""
+        self.running = True
+        self.sinks.start()
+        if self.replayer:
+            self.replayer.start()
+        if self.metrics:
+            self.metrics.serve(METRICS_HOST, self.metrics_port)
+
+        loop = asyncio.get_running_loop()
+        next_refresh = 0.0
+        next_status = loop.time() + self.status_interval
+        try:
+            while self.running:
+                now = loop.time()
+                if now >= next_refresh:
+                    endpoints = await self.load_devices()
+                    # Keep the current fleet if the device list could not be read
+                    if endpoints is not None:
+                        await self.sync(endpoints)
+                    next_refresh = now + self.refresh_interval
+                if now >= next_status:
+                    self.log_status()
+                    next_status = now + self.status_interval
+                # Close aggregation windows on time even for devices that went quiet
+                self.processor.tick()
+                await asyncio.sleep(min(next_refresh, next_status, now + 1.0) - loop.time())
+        finally:
+            logger.info("Shutting down...")
+            await self.sync([])
+            self.processor.flush()
+            await asyncio.to_thread(self.sinks.stop)
+            if self.replayer:
+                self.replayer.stop()
+                self.spool.close()
+            if self.metrics:
+                self.metrics.stop()
+
+
+def main():
+    logger.info(f"Starting PV3 MQTT Fleet Collector")
+    logger.info(f"Fleet config: {FLEET_CONFIG or 'none'}; devices from API: {FLEET_FROM_API}")
+    logger.info(f"API URL: {API_URL}")
+    logger.info(f"Spool: {SPOOL_DIR or 'disabled'}")
+    if not FLEET_CONFIG and not FLEET_FROM_API:
+        raise SystemExit("Set FLEET_CONFIG and/or FLEET_FROM_API to define the fleet")
+
+    try:
+        asyncio.run(FleetCollector().run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
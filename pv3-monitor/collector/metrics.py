@@ -0,0 +1,271 @@
+"""
+Operational metrics for the PV3 MQTT collector, in Prometheus text format.
+
+CollectorMetrics holds the counters and histograms the message path updates (messages
+per topic, parse failures, measurements per metric, upload batch sizes and latency).
+Values that already live elsewhere, such as sink queue depths, reconnect counts and
+per-device message times, are read when /metrics is scraped instead of being copied on
+every change. No client library is needed; MetricsServer serves the text exposition
+from a daemon thread.
+"""
+
+import logging
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterable
+
+logger = logging.getLogger("pv3_collector.metrics")
+
+# Collect callbacks return (label values, value) pairs
+Samples = Iterable[tuple[tuple[str, ...], float]]
+
+BATCH_SIZE_BUCKETS = (1, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    """A named metric family with fixed label names."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), collect: Callable[[], Samples] | None = None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        # With a collect callback the values are read at scrape time and never set directly
+        self.collect = collect
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def samples(self) -> list[tuple[tuple[str, ...], float]]:
+        if self.collect is not None:
+            return sorted(self.collect())
+        with self._lock:
+            return sorted(self._values.items())
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in self.samples():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, *labels: str):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    """Cumulative-bucket histogram; observations are counted into the first bucket they fit."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [count per bucket (last is +Inf), sum]
+        self._series: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, *labels: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][index] += 1
+            series[1][0] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            series = sorted((labels, list(counts), total[0]) for labels, (counts, total) in self._series.items())
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                bucket_labels = _labels(self.labelnames, labels, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Ordered set of metric families rendered together."""
+
+    def __init__(self):
+        self.metrics: list[Metric] = []
+
+    def add(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Serve a render callable as ``/metrics`` over HTTP from a daemon thread."""
+
+    def __init__(self, render: Callable[[], str], host: str = "0.0.0.0", port: int = 9180):
+        self.render = render
+        self.host = host
+        self.port = port
+        self._server: ThreadingHTTPServer | None = None
+
+    def start(self):
+        render = self.render
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name=f"pv3-metrics-{self.port}", daemon=True).start()
+        logger.info(f"Serving metrics on {self.host}:{self.port}/metrics")
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class CollectorMetrics:
+    """The collector's own metrics: what it received, parsed, emitted and uploaded."""
+
+    def __init__(self):
+        self.registry = MetricsRegistry()
+        add = self.registry.add
+        self.messages = add(Counter(
+            "pv3_collector_messages_total", "MQTT messages received, by topic suffix", ["topic"],
+        ))
+        self.parse_failures = add(Counter(
+            "pv3_collector_parse_failures_total", "Messages whose payload was not valid JSON", ["topic"],
+        ))
+        self.measurements = add(Counter(
+            "pv3_collector_measurements_total", "Measurements handed to the sinks, by metric", ["metric"],
+        ))
+        self.upload_batch_size = add(Histogram(
+            "pv3_collector_upload_batch_size", "Measurements per API POST", buckets=BATCH_SIZE_BUCKETS,
+        ))
+        self.upload_latency = add(Histogram(
+            "pv3_collector_upload_latency_seconds", "API POST latency, by outcome", ["result"],
+        ))
+        self._server: MetricsServer | None = None
+
+    def watch(self, processor, sinks, reconnects: Callable[[], Samples], spool=None):
+        """Expose state kept by the processor, the sinks, the spool and the MQTT connections."""
+        add = self.registry.add
+        add(Gauge(
+            "pv3_collector_sink_queue_depth", "Submissions waiting in each sink's queue", ["sink"],
+            collect=lambda: [((sink.name,), sink.queue_depth) for sink in sinks.sinks],
+        ))
+        add(Counter(
+            "pv3_collector_sink_records_total", "Records per sink by outcome", ["sink", "outcome"],
+            collect=lambda: [
+                ((sink.name, outcome), getattr(sink, outcome))
+                for sink in sinks.sinks
+                for outcome in ("written", "dropped", "failed")
+            ],
+        ))
+        if spool is not None:
+            add(Gauge(
+                "pv3_collector_spool_backlog_records", "Spooled records not yet replayed to the API",
+                collect=lambda: [((), spool.stats()["backlog_records"])],
+            ))
+            add(Gauge(
+                "pv3_collector_spool_backlog_bytes", "Bytes on disk held by the spool",
+                collect=lambda: [((), spool.stats()["backlog_bytes"])],
+            ))
+            add(Counter(
+                "pv3_collector_spool_records_total", "Spooled records by outcome", ["outcome"],
+                collect=lambda: [
+                    (("replayed",), spool.replayed_records),
+                    (("dropped",), spool.dropped_records),
+                ],
+            ))
+        add(Counter(
+            "pv3_collector_reconnects_total", "MQTT reconnections, by device", ["device_id"],
+            collect=reconnects,
+        ))
+        if processor.outliers:
+            add(Counter(
+                "pv3_collector_outliers_rejected_total", "Samples replaced by the outlier filter, by metric", ["metric"],
+                collect=lambda: [((metric,), count) for metric, count in list(processor.outliers.rejected.items())],
+            ))
+        if processor.deadband:
+            add(Counter(
+                "pv3_collector_deadband_samples_total", "Samples seen by each deadband rule, by outcome", ["metric", "outcome"],
+                collect=lambda: [
+                    ((metric, outcome), count)
+                    for metric, counts in processor.deadband.stats().items()
+                    for outcome, count in counts.items()
+                ],
+            ))
+        if processor.bursts:
+            add(Counter(
+                "pv3_collector_frequency_events_total", "Grid frequency events captured by burst capture",
+                collect=lambda: [((), processor.bursts.events_captured)],
+            ))
+        add(Gauge(
+            "pv3_collector_last_message_age_seconds", "Seconds since the last message from each device", ["device_id"],
+            collect=lambda: [
+                ((state.device_id,), time.time() - state.last_message_at)
+                for state in list(processor.devices.values())
+                if state.last_message_at is not None
+            ],
+        ))
+
+    def serve(self, host: str, port: int):
+        self._server = MetricsServer(self.registry.render, host, port)
+        self._server.start()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.stop()
+            self._server = None
@@ -5,16 +5,27 @@ PV3 MQTT Data Collector
 Subscribes to Powervault P3 MQTT topics and stores data via the PV3 Monitor API.
 """
 
-import json
 import logging
 import os
 import sys
 import time
-from datetime import datetime, timezone
 from typing import Any
 
 import paho.mqtt.client as mqtt
-import requests
+
+# The shared pv3common package lives alongside the collector directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from deadband import DeadbandFilter, load_rules
+from metrics import CollectorMetrics
+from processor import MessageProcessor
+from pv3common.aggregate import DEFAULT_CATEGORICAL, WindowAggregator
+from pv3common.burst import DEFAULT_BURST_METRICS, BurstCapture
+from pv3common.outlier import OutlierFilter
+from pv3common.outlier import load_rules as load_outlier_rules
+from sinks import InfluxLineSink, MqttPublishSink, PrometheusSink, RotatingFileSink, SinkSet, StreamSink
+from spool import SegmentSpool, SpoolReplayer
+from uploader import BatchUploader
 
 # Configuration
 MQTT_HOST = os.getenv("MQTT_HOST", "192.168.1.215")
@@ -22,6 +33,72 @@ MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
 P3_DEVICE_ID = os.getenv("P3_DEVICE_ID", "PV001001DEV")
 API_URL = os.getenv("API_URL", "http://localhost:8800")
 
+# Upload batching
+UPLOAD_MIN_BATCH = int(os.getenv("UPLOAD_MIN_BATCH", "20"))
+UPLOAD_MAX_BATCH = int(os.getenv("UPLOAD_MAX_BATCH", "2000"))
+UPLOAD_MAX_AGE_SECONDS = float(os.getenv("UPLOAD_MAX_AGE_SECONDS", "1.0"))
+UPLOAD_TARGET_LATENCY_SECONDS = float(os.getenv("UPLOAD_TARGET_LATENCY_SECONDS", "0.5"))
+UPLOAD_QUEUE_SIZE = int(os.getenv("UPLOAD_QUEUE_SIZE", "10000"))
+UPLOAD_TIMEOUT_SECONDS = float(os.getenv("UPLOAD_TIMEOUT_SECONDS", "10"))
+
+# Output sinks: comma-separated from rest, stream, influx, csv, ndjson, prometheus
+SINKS = os.getenv("SINKS", "rest")
+SINK_QUEUE_SIZE = int(os.getenv("SINK_QUEUE_SIZE", "10000"))
+SINK_BATCH_SIZE = int(os.getenv("SINK_BATCH_SIZE", "500"))
+SINK_MAX_AGE_SECONDS = float(os.getenv("SINK_MAX_AGE_SECONDS", "1.0"))
+SINK_OUTPUT_DIR = os.getenv("SINK_OUTPUT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "output"))
+SINK_INFLUX_PATH = os.getenv("SINK_INFLUX_PATH", os.path.join(SINK_OUTPUT_DIR, "pv3.lp"))
+SINK_FILE_MAX_MB = float(os.getenv("SINK_FILE_MAX_MB", "64"))
+SINK_FILE_KEEP = int(os.getenv("SINK_FILE_KEEP", "10"))
+SINK_PROMETHEUS_HOST = os.getenv("SINK_PROMETHEUS_HOST", "0.0.0.0")
+SINK_PROMETHEUS_PORT = int(os.getenv("SINK_PROMETHEUS_PORT", "9108"))
+# Streaming ingest over a WebSocket to the backend, instead of one POST per batch
+STREAM_URL = os.getenv("STREAM_URL", API_URL.replace("http", "ws", 1) + "/api/ws/ingest")
+STREAM_MAX_INFLIGHT = int(os.getenv("STREAM_MAX_INFLIGHT", "32"))
+# "mqtt" sink: flat retained topics on a local broker, e.g. for Home Assistant
+MQTT_PUBLISH_HOST = os.getenv("MQTT_PUBLISH_HOST", "localhost")
+MQTT_PUBLISH_PORT = int(os.getenv("MQTT_PUBLISH_PORT", "1883"))
+MQTT_PUBLISH_PREFIX = os.getenv("MQTT_PUBLISH_PREFIX", "pv3")
+MQTT_PUBLISH_MIN_INTERVAL = float(os.getenv("MQTT_PUBLISH_MIN_INTERVAL", "5"))
+MQTT_PUBLISH_DISCOVERY = os.getenv("MQTT_PUBLISH_DISCOVERY", "true").lower() in ("1", "true", "yes")
+MQTT_DISCOVERY_PREFIX = os.getenv("MQTT_DISCOVERY_PREFIX", "homeassistant")
+
+# On-disk spool for data the API cannot take (empty SPOOL_DIR disables it)
+SPOOL_DIR = os.getenv("SPOOL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "spool"))
+SPOOL_MAX_MB = float(os.getenv("SPOOL_MAX_MB", "256"))
+SPOOL_MAX_AGE_HOURS = float(os.getenv("SPOOL_MAX_AGE_HOURS", "168"))
+SPOOL_SEGMENT_MB = float(os.getenv("SPOOL_SEGMENT_MB", "4"))
+REPLAY_BATCH_SIZE = int(os.getenv("REPLAY_BATCH_SIZE", "5000"))
+REPLAY_MAX_BATCHES_PER_SECOND = float(os.getenv("REPLAY_MAX_BATCHES_PER_SECOND", "2"))
+REPLAY_RETRY_SECONDS = float(os.getenv("REPLAY_RETRY_SECONDS", "15"))
+
+# Report-by-exception: only forward samples that moved past their deadband or are due a heartbeat (opt-in)
+DEADBAND_ENABLED = os.getenv("DEADBAND_ENABLED", "false").lower() in ("1", "true", "yes")
+DEADBAND_CONFIG = os.getenv("DEADBAND_CONFIG", "")
+
+# Hampel outlier filter on SOC, cell voltages and temperatures (rules overridable per metric)
+OUTLIER_ENABLED = os.getenv("OUTLIER_ENABLED", "true").lower() in ("1", "true", "yes")
+OUTLIER_CONFIG = os.getenv("OUTLIER_CONFIG", "")
+
+# Edge pre-aggregation: upload per-window min/max/mean/last/count instead of raw samples (0 disables)
+AGGREGATE_SECONDS = float(os.getenv("AGGREGATE_SECONDS", "0"))
+# Comma-separated metrics forwarded on change instead of aggregated (default: built-in list)
+AGGREGATE_CATEGORICAL = os.getenv("AGGREGATE_CATEGORICAL", "")
+
+# Burst capture: full-rate grid samples around grid frequency excursions, uploaded as events (opt-in)
+BURST_ENABLED = os.getenv("BURST_ENABLED", "false").lower() in ("1", "true", "yes")
+BURST_LOW_HZ = float(os.getenv("BURST_LOW_HZ", "49.8"))
+BURST_HIGH_HZ = float(os.getenv("BURST_HIGH_HZ", "50.2"))
+BURST_PRE_SECONDS = float(os.getenv("BURST_PRE_SECONDS", "30"))
+BURST_POST_SECONDS = float(os.getenv("BURST_POST_SECONDS", "30"))
+BURST_MAX_SECONDS = float(os.getenv("BURST_MAX_SECONDS", "300"))
+# Comma-separated metrics captured alongside grid_frequency (default: built-in list)
+BURST_METRICS = os.getenv("BURST_METRICS", "")
+
+# Collector health metrics in Prometheus text format (METRICS_PORT=0 disables)
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9180"))
+
 # Logging
 logging.basicConfig(
     level=logging.INFO,
@@ -34,6 +111,115 @@ logging.basicConfig(
 logger = logging.getLogger("pv3_collector")
 
 
+def build_sinks(
+    spool_dir: str = SPOOL_DIR,
+    output_dir: str = SINK_OUTPUT_DIR,
+    prometheus_port: int = SINK_PROMETHEUS_PORT,
+    metrics: CollectorMetrics | None = None,
+) -> tuple[SinkSet, SegmentSpool | None, SpoolReplayer | None]:
+    """Create the configured output sinks.
+
+    The REST sink also gets the spool and its replayer, unless spool_dir is empty.
+    """
+    names = [name.strip() for name in SINKS.split(",") if name.strip()]
+    spool = None
+    replayer = None
+    options = {"max_queue": SINK_QUEUE_SIZE, "batch_size": SINK_BATCH_SIZE, "max_age": SINK_MAX_AGE_SECONDS}
+    sinks = []
+    for name in names:
+        if name == "rest":
+            if spool_dir:
+                spool = SegmentSpool(
+                    spool_dir,
+                    max_bytes=int(SPOOL_MAX_MB * 1024 * 1024),
+                    max_age=SPOOL_MAX_AGE_HOURS * 3600,
+                    segment_bytes=int(SPOOL_SEGMENT_MB * 1024 * 1024),
+                )
+                replayer = SpoolReplayer(
+                    spool,
+                    API_URL,
+                    batch_size=REPLAY_BATCH_SIZE,
+                    max_batches_per_second=REPLAY_MAX_BATCHES_PER_SECOND,
+                    retry_interval=REPLAY_RETRY_SECONDS,
+                )
+            sinks.append(BatchUploader(
+                API_URL,
+                min_batch=UPLOAD_MIN_BATCH,
+                max_batch=UPLOAD_MAX_BATCH,
+                max_age=UPLOAD_MAX_AGE_SECONDS,
+                target_latency=UPLOAD_TARGET_LATENCY_SECONDS,
+                max_queue=UPLOAD_QUEUE_SIZE,
+                timeout=UPLOAD_TIMEOUT_SECONDS,
+                spool=spool,
+                metrics=metrics,
+            ))
+        elif name == "stream":
+            sinks.append(StreamSink(STREAM_URL, max_inflight=STREAM_MAX_INFLIGHT, **options))
+        elif name == "mqtt":
+            sinks.append(MqttPublishSink(
+                MQTT_PUBLISH_HOST,
+                MQTT_PUBLISH_PORT,
+                prefix=MQTT_PUBLISH_PREFIX,
+                min_interval=MQTT_PUBLISH_MIN_INTERVAL,
+                discovery=MQTT_PUBLISH_DISCOVERY,
+                discovery_prefix=MQTT_DISCOVERY_PREFIX,
+                **options,
+            ))
+        elif name == "influx":
+            influx_path = SINK_INFLUX_PATH
+            if output_dir != SINK_OUTPUT_DIR:
+                influx_path = os.path.join(output_dir, os.path.basename(SINK_INFLUX_PATH))
+            sinks.append(InfluxLineSink(influx_path, **options))
+        elif name in ("csv", "ndjson"):
+            sinks.append(RotatingFileSink(
+                output_dir,
+                fmt=name,
+                max_bytes=int(SINK_FILE_MAX_MB * 1024 * 1024),
+                keep=SINK_FILE_KEEP,
+                **options,
+            ))
+        elif name == "prometheus":
+            sinks.append(PrometheusSink(SINK_PROMETHEUS_HOST, prometheus_port, **options))
+        else:
+            raise ValueError(f"Unknown sink: {name}")
+    return SinkSet(sinks), spool, replayer
+
+
+def build_processor(sinks: SinkSet, metrics: CollectorMetrics | None = None) -> MessageProcessor:
+    """Create the message processor with the configured outlier filter, burst capture and deadband rules or aggregation."""
+    outliers = OutlierFilter(load_outlier_rules(OUTLIER_CONFIG)) if OUTLIER_ENABLED else None
+    bursts = None
+    if BURST_ENABLED:
+        bursts = BurstCapture(
+            low=BURST_LOW_HZ,
+            high=BURST_HIGH_HZ,
+            pre_seconds=BURST_PRE_SECONDS,
+            post_seconds=BURST_POST_SECONDS,
+            max_seconds=BURST_MAX_SECONDS,
+            metrics=(
+                {metric.strip() for metric in BURST_METRICS.split(",") if metric.strip()}
+                if BURST_METRICS
+                else DEFAULT_BURST_METRICS
+            ),
+        )
+    if AGGREGATE_SECONDS > 0:
+        categorical = (
+            {metric.strip() for metric in AGGREGATE_CATEGORICAL.split(",") if metric.strip()}
+            if AGGREGATE_CATEGORICAL
+            else DEFAULT_CATEGORICAL
+        )
+        # Aggregation supersedes the deadband: every sample counts towards its window
+        return MessageProcessor(
+            sinks,
+            aggregator=WindowAggregator(AGGREGATE_SECONDS, categorical),
+            outliers=outliers,
+            metrics=metrics,
+            bursts=bursts,
+        )
+    deadband = DeadbandFilter(load_rules(DEADBAND_CONFIG)) if DEADBAND_ENABLED else None
+    return MessageProcessor(sinks, deadband=deadband, outliers=outliers, metrics=metrics, bursts=bursts)
+
+
 class PV3Collector:
     """MQTT collector for Powervault P3 data."""
 
@@ -42,14 +228,13 @@ class PV3Collector:
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
         self.client.on_disconnect = self.on_disconnect
-        self.session = requests.Session()
-        self.session.headers.update({"Content-Type": "application/json"})
+        self.metrics = CollectorMetrics() if METRICS_PORT else None
+        self.sinks, self.spool, self.replayer = build_sinks(metrics=self.metrics)
+        self.processor = build_processor(self.sinks, self.metrics)
+        if self.metrics:
+            self.metrics.watch(self.processor, self.sinks, lambda: [((P3_DEVICE_ID,), self.reconnects)], self.spool)
         self.connected = False
-        self._last_soc: float | None = None
-
-        # Outlier filter: ignore any single SOC sample that jumps more than this many percentage points.
-        # Intended to smooth rare bad readings (~1 in 20) that are ~10% off.
-        self._soc_outlier_threshold_percent = 1.0
+        self.connections = 0
 
     def on_connect(
         self,
@@ -63,6 +248,7 @@ class PV3Collector:
         if rc == 0:
             logger.info(f"Connected to MQTT broker at {MQTT_HOST}:{MQTT_PORT}")
             self.connected = True
+            self.connections += 1
             # Subscribe to all P3 topics
             topic = f"pv/PV3/{P3_DEVICE_ID}/#"
             client.subscribe(topic)
@@ -83,6 +269,10 @@ class PV3Collector:
         logger.warning(f"Disconnected from MQTT broker: {rc}")
         self.connected = False
 
+    @property
+    def reconnects(self) -> int:
+        return max(0, self.connections - 1)
+
     def on_message(
         self,
         client: mqtt.Client,
@@ -91,600 +281,26 @@ class PV3Collector:
     ):
         """Handle incoming MQTT messages."""
         try:
-            # Extract topic suffix
-            topic_parts = msg.topic.split("/")
-            if len(topic_parts) >= 4:
-                topic_suffix = "/".join(topic_parts[3:])
-            else:
-                return
-
-            # Parse JSON payload
-            try:
-                payload = json.loads(msg.payload.decode())
-            except json.JSONDecodeError:
-                logger.error(f"Failed to parse JSON from {msg.topic}")
-                return
-
-            # Route to appropriate handler
-            if topic_suffix == "bms/soc":
-                self.handle_soc(payload, msg.topic)
-            elif topic_suffix == "inverter/measurements":
-                self.handle_inverter_measurements(payload, msg.topic)
-            elif topic_suffix == "inverter/alarms":
-                self.handle_inverter_alarms(payload, msg.topic)
-            elif topic_suffix == "inverter/charge":
-                self.handle_inverter_charge(payload, msg.topic)
-            elif topic_suffix == "pylontech/info":
-                self.handle_pylontech_info(payload, msg.topic)
-            elif topic_suffix == "ffr/measurements":
-                self.handle_ffr_measurements(payload, msg.topic)
-            elif topic_suffix == "schedule/event":
-                self.handle_schedule_event(payload, msg.topic)
-            elif topic_suffix == "m4/maxpower":
-                self.handle_maxpower(payload, msg.topic)
-            elif topic_suffix == "eps/status":
-                self.handle_eps_status(payload, msg.topic)
-            elif topic_suffix == "eps_schedule/event":
-                self.handle_eps_schedule(payload, msg.topic)
-            elif topic_suffix == "safetycheck/state":
-                self.handle_safetycheck(payload, msg.topic)
-
+            self.processor.handle(msg.topic, msg.payload)
         except Exception as e:
             logger.error(f"Error processing message from {msg.topic}: {e}", exc_info=True)
 
-    def post_measurements(self, measurements: list[dict], source_topic: str):
-        """POST measurements to API."""
-        if not measurements:
-            return
-            
-        try:
-            url = f"{API_URL}/api/devices/{P3_DEVICE_ID}/measurements/batch"
-            response = self.session.post(url, json=measurements)
-            response.raise_for_status()
-            logger.debug(f"Stored {len(measurements)} measurements from {source_topic}")
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 422:
-                logger.error(f"Validation error from {source_topic}: {e.response.text}")
-                logger.debug(f"Problematic data: {measurements}")
-            else:
-                logger.error(f"HTTP error storing measurements from {source_topic}: {e}")
-        except Exception as e:
-            logger.error(f"Failed to store measurements from {source_topic}: {e}")
-
-    def post_alarms(self, alarm_states: dict[str, bool]):
-        """POST alarm states to API."""
-        try:
-            url = f"{API_URL}/api/devices/{P3_DEVICE_ID}/alarms"
-            response = self.session.post(url, json=alarm_states)
-            response.raise_for_status()
-            logger.debug(f"Updated {len(alarm_states)} alarm states")
-        except Exception as e:
-            logger.error(f"Failed to update alarm states: {e}")
-
-    # Topic Handlers
-
-    def handle_soc(self, payload: dict | list, topic: str):
-        """Handle bms/soc messages."""
-        # BMS SoC is a list of measurements
-        if isinstance(payload, list):
-            for item in payload:
-                if item.get("measurement") == "StateOfCharge":
-                    value = item.get("value")
-                    if value is not None:
-                        # Convert from integer (1100 = 11.00%)
-                        soc = value / 100.0
-                        if self._last_soc is not None and abs(soc - self._last_soc) > self._soc_outlier_threshold_percent:
-                            logger.warning(
-                                "SOC outlier detected: prev=%.2f%% new=%.2f%% (Δ=%.2f%%). Keeping previous SOC.",
-                                self._last_soc,
-                                soc,
-                                abs(soc - self._last_soc),
-                            )
-                            self.post_measurements(
-                                [
-                                    {
-                                        "metric_name": "soc_raw",
-                                        "metric_value": soc,
-                                        "unit": "%",
-                                        "source_topic": topic,
-                                    },
-                                    {
-                                        "metric_name": "soc",
-                                        "metric_value": self._last_soc,
-                                        "unit": "%",
-                                        "source_topic": topic,
-                                    },
-                                ],
-                                topic,
-                            )
-                        else:
-                            self._last_soc = soc
-                            self.post_measurements(
-                                [
-                                    {
-                                        "metric_name": "soc",
-                                        "metric_value": soc,
-                                        "unit": "%",
-                                        "source_topic": topic,
-                                    }
-                                ],
-                                topic,
-                            )
-                    return
-        else:
-            # Legacy dict format support
-            usable_soc = payload.get("usable_soc") or payload.get("StateOfCharge")
-            if usable_soc is not None:
-                soc = usable_soc / 100.0
-                if self._last_soc is not None and abs(soc - self._last_soc) > self._soc_outlier_threshold_percent:
-                    logger.warning(
-                        "SOC outlier detected (legacy): prev=%.2f%% new=%.2f%% (Δ=%.2f%%). Keeping previous SOC.",
-                        self._last_soc,
-                        soc,
-                        abs(soc - self._last_soc),
-                    )
-                    self.post_measurements(
-                        [
-                            {
-                                "metric_name": "soc_raw",
-                                "metric_value": soc,
-                                "unit": "%",
-                                "source_topic": topic,
-                            },
-                            {
-                                "metric_name": "soc",
-                                "metric_value": self._last_soc,
-                                "unit": "%",
-                                "source_topic": topic,
-                            },
-                        ],
-                        topic,
-                    )
-                else:
-                    self._last_soc = soc
-                    self.post_measurements(
-                        [
-                            {
-                                "metric_name": "soc",
-                                "metric_value": soc,
-                                "unit": "%",
-                                "source_topic": topic,
-                            }
-                        ],
-                        topic,
-                    )
-
-    def handle_inverter_measurements(self, payload: list[dict], topic: str):
-        """Handle inverter/measurements messages."""
-        measurements = []
-        
-        for item in payload:
-            channel = item.get("channel", "")
-            measurement = item.get("measurement", "")
-            value = item.get("value")
-            unit = item.get("unit", "")
-
-            if value is None:
-                continue
-
-            # Map channels and measurements to metric names
-            if channel == "BATTERY":
-                if measurement == "Voltage":
-                    measurements.append({
-                        "metric_name": "battery_voltage",
-                        "metric_value": value / 1000.0,  # mV to V
-                        "unit": "V",
-                        "source_topic": topic,
-                    })
-                elif measurement == "ChargeCurrent":
-                    measurements.append({
-                        "metric_name": "battery_current",
-                        "metric_value": value / 1000.0,  # mA to A
-                        "unit": "A",
-                        "source_topic": topic,
-                    })
-                elif measurement == "Capacity":
-                    measurements.append({
-                        "metric_name": "battery_capacity",
-                        "metric_value": value,
-                        "unit": "%",
-                        "source_topic": topic,
-                    })
-            elif channel == "GRID":
-                if measurement == "Voltage" and item.get("type") == "Ac":
-                    measurements.append({
-                        "metric_name": "grid_voltage",
-                        "metric_value": value / 1000.0,
-                        "unit": "V",
-                        "source_topic": topic,
-                    })
-                elif measurement == "Frequency":
-                    measurements.append({
-                        "metric_name": "grid_frequency",
-                        "metric_value": value / 1000.0,
-                        "unit": "Hz",
-                        "source_topic": topic,
-                    })
-                elif measurement == "Power" and item.get("type") == "Active":
-                    measurements.append({
-                        "metric_name": "grid_power",
-                        "metric_value": value / 1000.0,  # mW to W
-                        "unit": "W",
-                        "source_topic": topic,
-                    })
-
-        if measurements:
-            self.post_measurements(measurements, topic)
-
-    def handle_inverter_alarms(self, payload: dict, topic: str):
-        """Handle inverter/alarms messages."""
-        # Extract alarm flags (excluding temperature fields)
-        exclude_keys = ["timestamp", "warnings_summary", "inverter_temperature", "boost_temperature", "inner_temperature"]
-        alarm_states = {}
-        measurements = []
-
-        for key, value in payload.items():
-            if key in exclude_keys:
-                # Store temperatures as measurements
-                if "temperature" in key:
-                    try:
-                        temp_value = float(value)
-                        measurements.append({
-                            "metric_name": key,
-                            "metric_value": temp_value,
-                            "unit": "C",
-                            "source_topic": topic,
-                        })
-                    except (ValueError, TypeError):
-                        pass
-            else:
-                # Alarm flag
-                alarm_states[key] = value == "1"
-
-        if alarm_states:
-            self.post_alarms(alarm_states)
-        
-        if measurements:
-            self.post_measurements(measurements, topic)
-
-    def handle_inverter_charge(self, payload: dict, topic: str):
-        """Handle inverter/charge messages."""
-        power = payload.get("power")
-        if power is not None:
-            self.post_measurements([{
-                "metric_name": "battery_power",
-                "metric_value": power,
-                "unit": "W",
-                "source_topic": topic,
-            }], topic)
-
-    def handle_pylontech_info(self, payload: list[dict], topic: str):
-        """Handle pylontech/info messages."""
-        measurements = []
-
-        for item in payload:
-            measurement_type = item.get("measurement")
-            value_type = item.get("type")
-            value = item.get("value")
-
-            if value is None:
-                continue
-
-            # Map Pylontech measurements
-            if measurement_type == "StateOfHealth":
-                if value_type == "Avg":
-                    measurements.append({
-                        "metric_name": "soh",
-                        "metric_value": float(value),
-                        "unit": "%",
-                        "source_topic": topic,
-                    })
-                elif value_type == "Min":
-                    measurements.append({
-                        "metric_name": "soh_min",
-                        "metric_value": float(value),
-                        "unit": "%",
-                        "source_topic": topic,
-                    })
-            elif measurement_type == "CycleNumber":
-                if value_type == "Avg":
-                    measurements.append({
-                        "metric_name": "cycle_count_avg",
-                        "metric_value": float(value),
-                        "unit": "cycles",
-                        "source_topic": topic,
-                    })
-                elif value_type == "Max":
-                    measurements.append({
-                        "metric_name": "cycle_count_max",
-                        "metric_value": float(value),
-                        "unit": "cycles",
-                        "source_topic": topic,
-                    })
-            elif measurement_type == "CellTemperature":
-                if value_type == "Avg":
-                    measurements.append({
-                        "metric_name": "cell_temp_avg",
-                        "metric_value": value / 1000.0,  # mC to C
-                        "unit": "C",
-                        "source_topic": topic,
-                    })
-                elif value_type == "Max":
-                    measurements.append({
-                        "metric_name": "cell_temp_max",
-                        "metric_value": value / 1000.0,
-                        "unit": "C",
-                        "source_topic": topic,
-                    })
-                elif value_type == "Min":
-                    measurements.append({
-                        "metric_name": "cell_temp_min",
-                        "metric_value": value / 1000.0,
-                        "unit": "C",
-                        "source_topic": topic,
-                    })
-            elif measurement_type == "BMSTemperature":
-                if value_type == "Avg":
-                    measurements.append({
-                        "metric_name": "bms_temp_avg",
-                        "metric_value": value / 1000.0,
-                        "unit": "C",
-                        "source_topic": topic,
-                    })
-                elif value_type == "Max":
-                    measurements.append({
-                        "metric_name": "bms_temp_max",
-                        "metric_value": value / 1000.0,
-                        "unit": "C",
-                        "source_topic": topic,
-                    })
-            elif measurement_type == "CellVoltage":
-                if value_type == "Max":
-                    measurements.append({
-                        "metric_name": "cell_voltage_max",
-                        "metric_value": float(value),
-                        "unit": "mV",
-                        "source_topic": topic,
-                    })
-                elif value_type == "Min":
-                    measurements.append({
-                        "metric_name": "cell_voltage_min",
-                        "metric_value": float(value),
-                        "unit": "mV",
-                        "source_topic": topic,
-                    })
-            elif measurement_type == "ModuleVoltage" and value_type == "Avg":
-                measurements.append({
-                    "metric_name": "module_voltage_avg",
-                    "metric_value": value / 1000.0,  # mV to V
-                    "unit": "V",
-                    "source_topic": topic,
-                })
-            elif measurement_type == "Current" and value_type == "Total":
-                measurements.append({
-                    "metric_name": "battery_current_total",
-                    "metric_value": value / 1000.0,  # mA to A
-                    "unit": "A",
-                    "source_topic": topic,
-                })
-            elif measurement_type == "ChargeVoltageLimit":
-                measurements.append({
-                    "metric_name": "charge_voltage_limit",
-                    "metric_value": value / 1000.0,  # mV to V
-                    "unit": "V",
-                    "source_topic": topic,
-                })
-            elif measurement_type == "DischargeVoltageLimit":
-                measurements.append({
-                    "metric_name": "discharge_voltage_limit",
-                    "metric_value": value / 1000.0,  # mV to V
-                    "unit": "V",
-                    "source_topic": topic,
-                })
-            elif measurement_type == "ChargeCurrentLimit":
-                measurements.append({
-                    "metric_name": "charge_current_limit",
-                    "metric_value": value / 1000.0,  # mA to A
-                    "unit": "A",
-                    "source_topic": topic,
-                })
-            elif measurement_type == "DischargeCurrentLimit":
-                measurements.append({
-                    "metric_name": "discharge_current_limit",
-                    "metric_value": abs(value / 1000.0),  # mA to A, make positive
-                    "unit": "A",
-                    "source_topic": topic,
-                })
-
-        if measurements:
-            self.post_measurements(measurements, topic)
-
-    def handle_ffr_measurements(self, payload: list[dict], topic: str):
-        """Handle ffr/measurements messages (CT clamp data)."""
-        measurements = []
-
-        for item in payload:
-            channel = item.get("channel")
-            measurement = item.get("measurement")
-            value = item.get("value")
-
-            if value is None or measurement != "Power" or item.get("type") != "Active":
-                continue
-
-            # Map FFR channels to metrics (SWAPPED: LOCAL=house, HOUSE=grid)
-            if channel == "LOCAL":
-                # LOCAL CT actually measures house consumption
-                measurements.append({
-                    "metric_name": "house_power",
-                    "metric_value": value / 1000.0,  # mW to W
-                    "unit": "W",
-                    "source_topic": topic,
-                })
-            elif channel == "HOUSE":
-                # HOUSE CT actually measures grid (positive = import, negative = export)
-                measurements.append({
-                    "metric_name": "grid_power",
-                    "metric_value": value / 1000.0,
-                    "unit": "W",
-                    "source_topic": topic,
-                })
-            elif channel == "AUX1":
-                measurements.append({
-                    "metric_name": "aux_power",
-                    "metric_value": value / 1000.0,
-                    "unit": "W",
-                    "source_topic": topic,
-                })
-
-        if measurements:
-            self.post_measurements(measurements, topic)
-
-    def handle_schedule_event(self, payload: dict, topic: str):
-        """Handle schedule/event messages."""
-        event = payload.get("event")
-        setpoint = payload.get("setpoint")
-        
-        measurements = []
-        if event is not None:
-            measurements.append({
-                "metric_name": "schedule_event",
-                "metric_value": event,
-                "unit": "",
-                "source_topic": topic,
-            })
-        if setpoint is not None:
-            measurements.append({
-                "metric_name": "schedule_setpoint",
-                "metric_value": setpoint,
-                "unit": "W",
-                "source_topic": topic,
-            })
-        
-        if measurements:
-            self.post_measurements(measurements, topic)
-
-    def handle_maxpower(self, payload: dict | list, topic: str):
-        """Handle m4/maxpower messages."""
-        # Maxpower can be a dict or list
-        if isinstance(payload, list):
-            if not payload:
-                return
-            payload = payload[0]
-            
-        measurements = []
-        
-        chg_power = payload.get("ChgPower")
-        dchg_power = payload.get("DchgPower")
-        
-        if chg_power is not None:
-            measurements.append({
-                "metric_name": "max_charge_power",
-                "metric_value": float(chg_power),
-                "unit": "W",
-                "source_topic": topic,
-            })
-        if dchg_power is not None:
-            measurements.append({
-                "metric_name": "max_discharge_power",
-                "metric_value": float(dchg_power),
-                "unit": "W",
-                "source_topic": topic,
-            })
-        
-        if measurements:
-            self.post_measurements(measurements, topic)
-
-    def handle_eps_status(self, payload: dict | list, topic: str):
-        """Handle eps/status messages."""
-        # EPS status can be a dict or list
-        if isinstance(payload, list):
-            if not payload:
-                return
-            payload = payload[0]
-        
-        measurements = []
-        
-        reserve = payload.get("Reserve")
-        mode = payload.get("Mode")
-        
-        if reserve is not None:
-            measurements.append({
-                "metric_name": "eps_reserve",
-                "metric_value": float(reserve),
-                "unit": "%",
-                "source_topic": topic,
-            })
-        if mode is not None:
-            measurements.append({
-                "metric_name": "eps_mode",
-                "metric_value": float(mode),
-                "unit": "",
-                "source_topic": topic,
-            })
-        
-        if measurements:
-            self.post_measurements(measurements, topic)
-
-    def handle_eps_schedule(self, payload: dict | list, topic: str):
-        """Handle eps_schedule/event messages."""
-        if isinstance(payload, list):
-            if not payload:
-                return
-            payload = payload[0]
-        
-        measurements = []
-        
-        reserved_soc = payload.get("reserved_soc")
-        event = payload.get("event")
-        
-        if reserved_soc is not None:
-            measurements.append({
-                "metric_name": "eps_schedule_reserve",
-                "metric_value": float(reserved_soc),
-                "unit": "%",
-                "source_topic": topic,
-            })
-        if event is not None:
-            # Convert on/off to 1/0
-            event_value = 1.0 if event == "on" else 0.0
-            measurements.append({
-                "metric_name": "eps_schedule_event",
-                "metric_value": event_value,
-                "unit": "",
-                "source_topic": topic,
-            })
-        
-        if measurements:
-            self.post_measurements(measurements, topic)
-
-    def handle_safetycheck(self, payload: dict | list, topic: str):
-        """Handle safetycheck/state messages."""
-        if isinstance(payload, list):
-            if not payload:
-                return
-            payload = payload[0]
-        
-        measurements = []
-        
-        # Extract any power limits or safety check values
-        for key, value in payload.items():
-            if isinstance(value, (int, float)):
-                measurements.append({
-                    "metric_name": f"safetycheck_{key}",
-                    "metric_value": float(value),
-                    "unit": "",
-                    "source_topic": topic,
-                })
-        
-        if measurements:
-            self.post_measurements(measurements, topic)
-
     def run(self):
         """Start the collector."""
         logger.info(f"Starting PV3 MQTT Collector")
         logger.info(f"MQTT Broker: {MQTT_HOST}:{MQTT_PORT}")
         logger.info(f"Device ID: {P3_DEVICE_ID}")
         logger.info(f"API URL: {API_URL}")
+        logger.info(f"Sinks: {', '.join(self.sinks.stats())}")
+        logger.info(f"Spool: {SPOOL_DIR or 'disabled'}")
+        logger.info(f"Aggregation: {f'{AGGREGATE_SECONDS:g}s windows' if AGGREGATE_SECONDS > 0 else 'disabled'}")
+        logger.info(f"Burst capture: {f'outside {BURST_LOW_HZ:g}-{BURST_HIGH_HZ:g} Hz' if BURST_ENABLED else 'disabled'}")
+
+        self.sinks.start()
+        if self.replayer:
+            self.replayer.start()
+        if self.metrics:
+            self.metrics.serve(METRICS_HOST, METRICS_PORT)
 
         # Connect to MQTT broker
         while True:
@@ -694,6 +310,13 @@ class PV3Collector:
             except KeyboardInterrupt:
                 logger.info("Shutting down...")
                 self.client.disconnect()
+                self.processor.flush()
+                self.sinks.stop()
+                if self.replayer:
+                    self.replayer.stop()
+                    self.spool.close()
+                if self.metrics:
+                    self.metrics.stop()
                 break
             except Exception as e:
                 logger.error(f"Connection error: {e}")
@@ -0,0 +1,176 @@
+"""
+Transport-independent message processing for the PV3 MQTT collector.
+
+MessageProcessor turns raw (topic, payload) pairs into uploads. It keeps the state
+that has to survive between messages per device (the outlier filter windows are keyed
+by device too), so one processor can serve a single broker or a whole fleet of them.
+"""
+
+import json
+import logging
+import time
+from datetime import datetime, timezone
+
+from deadband import DeadbandFilter
+from metrics import CollectorMetrics
+from pv3common.aggregate import WindowAggregator
+from pv3common.burst import BurstCapture
+from pv3common.mapping import TopicRouter
+from pv3common.outlier import OutlierFilter
+from sinks import SinkSet
+
+logger = logging.getLogger("pv3_collector.processor")
+
+
+class DeviceState:
+    """State carried between messages from one P3."""
+
+    def __init__(self, device_id: str):
+        self.device_id = device_id
+        self.messages = 0
+        self.last_message_at: float | None = None
+
+
+class MessageProcessor:
+    """Route, decode and filter P3 messages, then queue them on the output sinks."""
+
+    def __init__(
+        self,
+        sink: SinkSet,
+        router: TopicRouter | None = None,
+        deadband: DeadbandFilter | None = None,
+        aggregator: WindowAggregator | None = None,
+        outliers: OutlierFilter | None = None,
+        metrics: CollectorMetrics | None = None,
+        bursts: BurstCapture | None = None,
+    ):
+        self.sink = sink
+        self.router = router if router is not None else TopicRouter()
+        self.deadband = deadband
+        # With an aggregator, windowed aggregates are uploaded instead of raw samples
+        self.aggregator = aggregator
+        # Replaces outlying samples (rare bad readings ~10% off) with the window median
+        self.outliers = outliers
+        self.metrics = metrics
+        # Keeps full-rate grid samples around frequency excursions, ahead of deadband and aggregation
+        self.bursts = bursts
+        self.devices: dict[str, DeviceState] = {}
+
+    def device(self, device_id: str) -> DeviceState:
+        """Return the state for a device, creating it on first use."""
+        state = self.devices.get(device_id)
+        if state is None:
+            state = self.devices[device_id] = DeviceState(device_id)
+        return state
+
+    def handle(self, topic: str, raw: bytes):
+        """Process one MQTT message. The device is taken from the topic."""
+        # Unmapped topics are dropped before the payload is decoded
+        routed = self.router.route(topic)
+        if routed is None:
+            if self.metrics is not None:
+                self.metrics.messages.inc(topic.split("/", 3)[-1])
+            return
+        device_id, spec = routed
+        if self.metrics is not None:
+            self.metrics.messages.inc(spec.suffix)
+
+        state = self.device(device_id)
+        state.messages += 1
+        state.last_message_at = time.time()
+
+        # Parse JSON payload
+        try:
+            payload = json.loads(raw.decode())
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            logger.error(f"Failed to parse JSON from {topic}")
+            if self.metrics is not None:
+                self.metrics.parse_failures.inc(spec.suffix)
+            return
+
+        decoded = spec.decode(payload)
+
+        if decoded.alarms:
+            self.sink.submit_alarms(device_id, decoded.alarms)
+
+        if decoded.measurements:
+            decoded_measurements = decoded.measurements
+            if self.bursts:
+                self.submit_events(self.bursts.add(device_id, decoded_measurements, state.last_message_at))
+            if self.outliers:
+                decoded_measurements = self.outliers.filter(device_id, decoded_measurements)
+            measurements = [
+                {
+                    "metric_name": metric,
+                    "metric_value": value,
+                    "unit": unit,
+                    "source_topic": topic,
+                }
+                for metric, value, unit in decoded_measurements
+            ]
+            self.post_measurements(state, measurements)
+
+    def post_measurements(self, state: DeviceState, measurements: list[dict]):
+        """Queue measurements for upload, stamped with their arrival time."""
+        if self.aggregator:
+            self.post_aggregated(state, measurements)
+            return
+
+        if self.deadband:
+            measurements = self.deadband.filter(state.device_id, measurements)
+        if not measurements:
+            return
+
+        timestamp = datetime.now(timezone.utc).isoformat()
+        for measurement in measurements:
+            measurement.setdefault("timestamp", timestamp)
+        self.submit(state.device_id, measurements)
+
+    def post_aggregated(self, state: DeviceState, measurements: list[dict]):
+        """Feed measurements into the current window, uploading whatever it releases."""
+        now = time.time()
+        add = self.aggregator.add
+        records = []
+        for m in measurements:
+            records += add(state.device_id, m["metric_name"], m["metric_value"], m["unit"], m["source_topic"], now)
+        self.submit_records(records)
+
+    def tick(self, now: float | None = None):
+        """Close the aggregation window and finished frequency events, even when no messages arrive."""
+        now = time.time() if now is None else now
+        if self.aggregator:
+            self.submit_records(self.aggregator.roll(now))
+        if self.bursts:
+            self.submit_events(self.bursts.tick(now))
+
+    def flush(self):
+        """Upload the partial aggregation window and events in progress, e.g. on shutdown."""
+        if self.aggregator:
+            self.submit_records(self.aggregator.flush())
+        if self.bursts:
+            self.submit_events(self.bursts.flush())
+
+    def submit_events(self, events: list[dict]):
+        """Queue finished frequency events on the sinks."""
+        for event in events:
+            logger.info(
+                f"Frequency event on {event['device_id']}: {event['min_frequency']:.3f}-{event['max_frequency']:.3f} Hz, "
+                f"{event['sample_count']} samples from {event['start_time']} to {event['end_time']}"
+            )
+            self.sink.submit_event(event["device_id"], event)
+
+    def submit_records(self, records: list[tuple[str, dict]]):
+        """Queue (device_id, record) pairs on the sinks, one submission per device."""
+        by_device: dict[str, list[dict]] = {}
+        for device_id, record in records:
+            by_device.setdefault(device_id, []).append(record)
+        for device_id, measurements in by_device.items():
+            self.submit(device_id, measurements)
+
+    def submit(self, device_id: str, measurements: list[dict]):
+        """Hand measurements to the sinks, counting them per metric."""
+        if self.metrics is not None:
+            inc = self.metrics.measurements.inc
+            for measurement in measurements:
+                inc(measurement["metric_name"])
+        self.sink.submit(device_id, measurements)
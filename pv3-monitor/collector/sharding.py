@@ -0,0 +1,37 @@
+"""
+Consistent hashing of devices onto collector workers.
+
+Each worker owns many points (virtual nodes) on a hash ring and a device belongs to
+the first point at or after its own hash. Adding or removing a worker only moves the
+devices that land on that worker's points, roughly 1/N of the fleet.
+"""
+
+import bisect
+import hashlib
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Map keys to a fixed set of nodes by consistent hashing."""
+
+    def __init__(self, nodes: list[int], vnodes: int = 64):
+        if not nodes:
+            raise ValueError("HashRing needs at least one node")
+        points = sorted((_hash(f"{node}#{i}"), node) for node in nodes for i in range(vnodes))
+        self._hashes = [h for h, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key: str) -> int:
+        """Return the node that owns a key."""
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._nodes[index]
+
+    def assign(self, keys: list[str]) -> dict[int, list[str]]:
+        """Group keys by owning node. Nodes without keys are left out."""
+        assignment: dict[int, list[str]] = {}
+        for key in keys:
+            assignment.setdefault(self.node_for(key), []).append(key)
+        return assignment
@@ -0,0 +1,749 @@
+"""
+Output sinks for the PV3 MQTT collector.
+
+Every sink has its own bounded queue and delivery thread, so a slow sink only fills
+(and then drops from) its own queue while the others keep up. SinkSet hands each
+submission to every sink. The REST sink is uploader.BatchUploader, which has its own
+adaptive batching and spool; the sinks here share the Sink base class.
+
+Records are passed to all sinks as the same dict objects and must be treated as
+read-only.
+"""
+
+import csv
+import json
+import random
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+import paho.mqtt.client as mqtt
+from websockets.exceptions import WebSocketException
+from websockets.sync.client import ClientConnection, connect
+
+from metrics import MetricsServer, escape_label
+
+logger = logging.getLogger("pv3_collector.sinks")
+
+_STOP = object()
+
+# Report drops at most this often per sink
+_DROP_LOG_INTERVAL = 60.0
+
+
+class Sink:
+    """Bounded queue, delivery thread and batching shared by the built-in sinks.
+
+    Subclasses implement ``write`` for batches of ``(device_id, measurement)`` pairs and
+    may implement ``write_alarms`` (setting ``accepts_alarms``) and ``close``. Frequency
+    events are only recorded by the REST sink (``accepts_events``).
+    """
+
+    name = "sink"
+    accepts_alarms = False
+    accepts_events = False
+    # When set, idle() is called after this many seconds without records to write
+    idle_interval: float | None = None
+
+    def __init__(self, max_queue: int = 10000, batch_size: int = 500, max_age: float = 1.0):
+        self.batch_size = batch_size
+        self.max_age = max_age
+
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name=f"pv3-sink-{self.name}", daemon=True)
+        self._last_drop_log = 0.0
+
+    # Producer side (never blocks)
+
+    def submit(self, device_id: str, measurements: list[dict]) -> bool:
+        """Queue measurements. Returns False and counts them as dropped if the queue is full."""
+        if not measurements:
+            return True
+        try:
+            self._queue.put_nowait(("measurements", device_id, measurements))
+            return True
+        except queue.Full:
+            self._drop(len(measurements))
+            return False
+
+    def submit_alarms(self, device_id: str, alarm_states: dict[str, bool]) -> bool:
+        """Queue alarm states if this sink records them."""
+        if not self.accepts_alarms:
+            return True
+        try:
+            self._queue.put_nowait(("alarms", device_id, alarm_states))
+            return True
+        except queue.Full:
+            self._drop(1)
+            return False
+
+    def submit_event(self, device_id: str, event: dict) -> bool:
+        """Frequency events are not recorded by the built-in sinks."""
+        return True
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of submissions waiting to be written."""
+        return self._queue.qsize()
+
+    def _drop(self, count: int):
+        self.dropped += count
+        now = time.monotonic()
+        if now - self._last_drop_log >= _DROP_LOG_INTERVAL:
+            self._last_drop_log = now
+            logger.warning(f"Sink {self.name} queue full; {self.dropped} records dropped so far")
+
+    # Lifecycle
+
+    def start(self):
+        """Start the delivery thread."""
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Write everything queued so far and stop the delivery thread."""
+        if not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    # Delivery thread
+
+    def _run(self):
+        batch: list[tuple[str, dict]] = []
+        oldest: float | None = None
+        while True:
+            wait = self.idle_interval if oldest is None else max(0.0, oldest + self.max_age - time.monotonic())
+            try:
+                item = self._queue.get(timeout=wait)
+            except queue.Empty:
+                item = None
+                if oldest is None:
+                    self._idle()
+
+            if item is _STOP:
+                self._write(batch)
+                self._close()
+                return
+
+            if item is not None:
+                kind, device_id, data = item
+                if kind == "alarms":
+                    self._write_alarms(device_id, data)
+                else:
+                    if oldest is None:
+                        oldest = time.monotonic()
+                    batch.extend((device_id, record) for record in data)
+
+            if batch and (len(batch) >= self.batch_size or time.monotonic() - oldest >= self.max_age):
+                self._write(batch)
+                batch = []
+                oldest = None
+
+    def _write(self, batch: list[tuple[str, dict]]):
+        if not batch:
+            return
+        try:
+            self.write(batch)
+            self.written += len(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            logger.error(f"Sink {self.name} failed to write {len(batch)} records: {e}")
+
+    def _write_alarms(self, device_id: str, alarm_states: dict[str, bool]):
+        try:
+            self.write_alarms(device_id, alarm_states)
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Sink {self.name} failed to write alarm states for {device_id}: {e}")
+
+    def _idle(self):
+        try:
+            self.idle()
+        except Exception as e:
+            logger.error(f"Sink {self.name} failed while idle: {e}")
+
+    def _close(self):
+        try:
+            self.close()
+        except Exception as e:
+            logger.error(f"Sink {self.name} failed to close: {e}")
+
+    # Implemented by subclasses
+
+    def write(self, batch: list[tuple[str, dict]]):
+        raise NotImplementedError
+
+    def write_alarms(self, device_id: str, alarm_states: dict[str, bool]):
+        pass
+
+    def idle(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _epoch(record: dict) -> float:
+    timestamp = record.get("timestamp")
+    if timestamp is None:
+        return time.time()
+    return datetime.fromisoformat(timestamp).timestamp()
+
+
+# Aggregate fields written alongside the value when present (see pv3common.aggregate)
+_AGGREGATE_FIELDS = ("value_min", "value_max", "value_last", "sample_count")
+
+
+class InfluxLineSink(Sink):
+    """Append InfluxDB line protocol to a file, one line per sample.
+
+    The metric name is the measurement, ``device_id`` and ``unit`` are tags and the
+    value goes in the ``value`` field, e.g. ``soc,device_id=PV001001DEV,unit=% value=97``.
+    Alarm states are written to the ``pv3_alarm`` measurement.
+    """
+
+    name = "influx"
+    accepts_alarms = True
+
+    def __init__(self, path: str, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._file = None
+
+    def _open(self):
+        if self._file is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+        return self._file
+
+    def write(self, batch: list[tuple[str, dict]]):
+        lines = []
+        for device_id, record in batch:
+            tags = f"device_id={_escape_tag(device_id)}"
+            if record.get("unit"):
+                tags += f",unit={_escape_tag(record['unit'])}"
+            fields = f"value={float(record['metric_value'])!r}"
+            for field in _AGGREGATE_FIELDS:
+                value = record.get(field)
+                if value is not None:
+                    fields += f",{field}={value}i" if field == "sample_count" else f",{field}={float(value)!r}"
+            lines.append(f"{_escape_measurement(record['metric_name'])},{tags} {fields} {int(_epoch(record) * 1e9)}\n")
+        f = self._open()
+        f.writelines(lines)
+        f.flush()
+
+    def write_alarms(self, device_id: str, alarm_states: dict[str, bool]):
+        timestamp = time.time_ns()
+        f = self._open()
+        f.writelines(
+            f"pv3_alarm,device_id={_escape_tag(device_id)},alarm={_escape_tag(name)} "
+            f"active={'true' if active else 'false'} {timestamp}\n"
+            for name, active in alarm_states.items()
+        )
+        f.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _escape_measurement(value: str) -> str:
+    return value.replace(",", r"\,").replace(" ", r"\ ")
+
+
+def _escape_tag(value: str) -> str:
+    return value.replace(",", r"\,").replace("=", r"\=").replace(" ", r"\ ")
+
+
+class RotatingFileSink(Sink):
+    """Write samples to CSV or NDJSON files, starting a new file past ``max_bytes``.
+
+    Files are named ``pv3-<UTC start time>.<format>``; only the newest ``keep`` are kept.
+    """
+
+    COLUMNS = ["timestamp", "device_id", "metric_name", "metric_value", "unit", "source_topic", *_AGGREGATE_FIELDS]
+
+    def __init__(self, directory: str, fmt: str = "csv", max_bytes: int = 64 * 1024 * 1024, keep: int = 10, **kwargs):
+        if fmt not in ("csv", "ndjson"):
+            raise ValueError(f"Unsupported file format: {fmt}")
+        self.name = fmt
+        super().__init__(**kwargs)
+        self.directory = directory
+        self.fmt = fmt
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self._file = None
+        self._writer = None
+
+    def _open(self):
+        if self._file is not None and self._file.tell() < self.max_bytes:
+            return
+        self.close()
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        path = os.path.join(self.directory, f"pv3-{stamp}.{self.fmt}")
+        self._file = open(path, "w", encoding="utf-8", newline="")
+        if self.fmt == "csv":
+            self._writer = csv.DictWriter(self._file, fieldnames=self.COLUMNS, extrasaction="ignore")
+            self._writer.writeheader()
+        self._prune()
+
+    def _prune(self):
+        files = sorted(
+            name for name in os.listdir(self.directory)
+            if name.startswith("pv3-") and name.endswith(f".{self.fmt}")
+        )
+        for name in files[:-self.keep]:
+            os.remove(os.path.join(self.directory, name))
+
+    def write(self, batch: list[tuple[str, dict]]):
+        self._open()
+        if self.fmt == "csv":
+            self._writer.writerows({**record, "device_id": device_id} for device_id, record in batch)
+        else:
+            self._file.writelines(
+                json.dumps({"device_id": device_id, **record}, separators=(",", ":")) + "\n"
+                for device_id, record in batch
+            )
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._writer = None
+
+
+class PrometheusSink(Sink):
+    """Keep the latest value of every metric in memory and serve it at ``/metrics``.
+
+    Each metric becomes a gauge named ``pv3_<metric>`` labelled with ``device_id``;
+    alarm states are exposed as ``pv3_alarm{device_id, alarm}``.
+    """
+
+    name = "prometheus"
+    accepts_alarms = True
+
+    def __init__(self, host: str = "0.0.0.0", port: int = 9108, **kwargs):
+        super().__init__(**kwargs)
+        self.host = host
+        self.port = port
+        self._lock = threading.Lock()
+        # gauge name -> {device_id: value}
+        self._values: dict[str, dict[str, float]] = {}
+        self._alarms: dict[tuple[str, str], bool] = {}
+        self._server: MetricsServer | None = None
+
+    def start(self):
+        self._server = MetricsServer(self.render, self.host, self.port)
+        self._server.start()
+        super().start()
+
+    def write(self, batch: list[tuple[str, dict]]):
+        with self._lock:
+            for device_id, record in batch:
+                gauge = f"pv3_{_METRIC_NAME.sub('_', record['metric_name'])}"
+                value = record.get("value_last")
+                if value is None:
+                    value = record["metric_value"]
+                self._values.setdefault(gauge, {})[device_id] = float(value)
+
+    def write_alarms(self, device_id: str, alarm_states: dict[str, bool]):
+        with self._lock:
+            for name, active in alarm_states.items():
+                self._alarms[(device_id, name)] = active
+
+    def render(self) -> str:
+        """Text exposition of the current values."""
+        lines = []
+        with self._lock:
+            for gauge in sorted(self._values):
+                lines.append(f"# TYPE {gauge} gauge")
+                for device_id, value in sorted(self._values[gauge].items()):
+                    lines.append(f'{gauge}{{device_id="{escape_label(device_id)}"}} {value!r}')
+            if self._alarms:
+                lines.append("# TYPE pv3_alarm gauge")
+                for (device_id, name), active in sorted(self._alarms.items()):
+                    lines.append(
+                        f'pv3_alarm{{device_id="{escape_label(device_id)}",alarm="{escape_label(name)}"}} {int(active)}'
+                    )
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        if self._server is not None:
+            self._server.stop()
+            self._server = None
+
+
+_METRIC_NAME = re.compile(r"[^a-zA-Z0-9_]")
+
+
+# Timeout for collecting acks that have already arrived; websockets' recv(timeout=0)
+# does not return buffered messages
+_ACK_POLL_SECONDS = 0.001
+
+
+class StreamSink(Sink):
+    """Stream measurement frames to the backend over its WebSocket ingest channel.
+
+    Frames carry increasing sequence numbers and stay buffered until the backend
+    acknowledges them (acks are cumulative). At most ``max_inflight`` frames are
+    unacknowledged at a time; past that the sink waits for acks, its queue fills and
+    the backend's commit rate becomes the collector's send rate. After a reconnect
+    every unacknowledged frame is sent again, so delivery is at-least-once.
+    """
+
+    name = "stream"
+    idle_interval = 1.0
+
+    def __init__(self, url: str, max_inflight: int = 32, ack_timeout: float = 30.0, **kwargs):
+        super().__init__(**kwargs)
+        self.url = url
+        self.max_inflight = max_inflight
+        self.ack_timeout = ack_timeout
+        self.reconnects = 0
+
+        self._ws: ClientConnection | None = None
+        self._seq = 0
+        # seq -> (device_id, measurements), in send order
+        self._unacked: dict[int, tuple[str, list[dict]]] = {}
+        self._backoff = 1.0
+        self._stopping = False
+
+    def stop(self, timeout: float = 10.0):
+        self._stopping = True
+        super().stop(timeout)
+
+    def write(self, batch: list[tuple[str, dict]]):
+        by_device: dict[str, list[dict]] = {}
+        for device_id, record in batch:
+            by_device.setdefault(device_id, []).append(record)
+
+        for device_id, measurements in by_device.items():
+            while len(self._unacked) >= self.max_inflight:
+                if not self._receive(self.ack_timeout) and self._stopping:
+                    raise ConnectionError("stopped with frames unacknowledged")
+            self._seq += 1
+            self._unacked[self._seq] = (device_id, measurements)
+            self._send(self._seq)
+        self._receive(_ACK_POLL_SECONDS)
+
+    def idle(self):
+        if self._unacked:
+            self._receive(_ACK_POLL_SECONDS)
+
+    def close(self):
+        # Give the backend a moment to acknowledge the final frames
+        deadline = time.monotonic() + 5.0
+        while self._unacked and self._ws is not None and time.monotonic() < deadline:
+            self._receive(deadline - time.monotonic())
+        if self._unacked:
+            lost = sum(len(measurements) for _, measurements in self._unacked.values())
+            self.failed += lost
+            logger.warning(f"Sink {self.name} closed with {lost} measurements unacknowledged")
+        if self._ws is not None:
+            self._ws.close()
+            self._ws = None
+
+    def _send(self, seq: int):
+        device_id, measurements = self._unacked[seq]
+        frame = json.dumps({"seq": seq, "device_id": device_id, "measurements": measurements})
+        while True:
+            if self._ws is None:
+                # Reconnecting resends every unacknowledged frame, this one included
+                self._connect()
+                return
+            try:
+                self._ws.send(frame)
+                return
+            except (OSError, WebSocketException) as e:
+                logger.warning(f"Ingest stream send failed: {e}")
+                self._disconnect()
+
+    def _connect(self):
+        """Connect, retrying with backoff, and resend everything not yet acknowledged."""
+        while True:
+            try:
+                self._ws = connect(self.url, open_timeout=10, close_timeout=5)
+            except (OSError, WebSocketException) as e:
+                if self._stopping:
+                    raise ConnectionError(f"cannot reach {self.url}") from e
+                delay = random.uniform(self._backoff / 2, self._backoff)
+                logger.warning(f"Ingest stream connect to {self.url} failed: {e}; retrying in {delay:.1f}s")
+                time.sleep(delay)
+                self._backoff = min(self._backoff * 2, 60.0)
+                continue
+
+            self._backoff = 1.0
+            logger.info(f"Ingest stream connected to {self.url}")
+            try:
+                for seq, (device_id, measurements) in list(self._unacked.items()):
+                    self._ws.send(json.dumps({"seq": seq, "device_id": device_id, "measurements": measurements}))
+                return
+            except (OSError, WebSocketException) as e:
+                logger.warning(f"Ingest stream resend failed: {e}")
+                self._disconnect()
+
+    def _disconnect(self):
+        if self._ws is not None:
+            self._ws.close()
+            self._ws = None
+            self.reconnects += 1
+
+    def _receive(self, timeout: float) -> bool:
+        """Process acks arriving within `timeout`. Returns False if the connection dropped."""
+        if self._ws is None:
+            return False
+        try:
+            while True:
+                message = json.loads(self._ws.recv(timeout=timeout))
+                timeout = _ACK_POLL_SECONDS
+                if "ack" in message:
+                    acked = message["ack"]
+                    for seq in [seq for seq in self._unacked if seq <= acked]:
+                        del self._unacked[seq]
+                elif "nack" in message:
+                    rejected = self._unacked.pop(message["nack"], None)
+                    if rejected is not None:
+                        self.failed += len(rejected[1])
+                    logger.error(f"Ingest frame {message['nack']} rejected: {message.get('error')}")
+        except TimeoutError:
+            return True
+        except (OSError, WebSocketException, ValueError) as e:
+            logger.warning(f"Ingest stream dropped: {e}")
+            self._disconnect()
+            if not self._stopping:
+                self._connect()
+            return False
+
+
+# Home Assistant device class and unit per mapping unit
+_HA_UNITS = {
+    "%": (None, "%"),
+    "A": ("current", "A"),
+    "C": ("temperature", "°C"),
+    "Hz": ("frequency", "Hz"),
+    "V": ("voltage", "V"),
+    "W": ("power", "W"),
+    "mV": ("voltage", "mV"),
+    "cycles": (None, "cycles"),
+}
+
+
+def _state(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(round(value, 4))
+
+
+class MqttPublishSink(Sink):
+    """Republish decoded metrics as flat, retained topics on a local MQTT broker.
+
+    Each metric is published to ``<prefix>/<device_id>/<metric>`` as a plain number in
+    the mapping's unit, and alarm flags to ``<prefix>/<device_id>/alarm/<name>`` as
+    ``ON``/``OFF``. Unchanged values are not republished, and a metric is published at
+    most once per ``min_interval`` seconds; newer values arriving in between replace the
+    pending one. With ``discovery`` set, Home Assistant discovery configs are published
+    once per metric so sensors need no templates.
+    """
+
+    name = "mqtt"
+    accepts_alarms = True
+    # Publish conflated values that became due while no new records arrived
+    idle_interval = 1.0
+
+    def __init__(
+        self,
+        host: str,
+        port: int = 1883,
+        prefix: str = "pv3",
+        min_interval: float = 5.0,
+        discovery: bool = True,
+        discovery_prefix: str = "homeassistant",
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.host = host
+        self.port = port
+        self.prefix = prefix
+        self.min_interval = min_interval
+        self.discovery = discovery
+        self.discovery_prefix = discovery_prefix
+        self.published = 0
+
+        self._client: mqtt.Client | None = None
+        # (device_id, metric) -> (published state, monotonic publish time)
+        self._last: dict[tuple[str, str], tuple[str, float]] = {}
+        # (device_id, metric) -> latest state not yet published
+        self._pending: dict[tuple[str, str], str] = {}
+        self._alarms: dict[tuple[str, str], bool] = {}
+        # Discovery configs sent since the last (re)connect
+        self._announced: set[tuple[str, str]] = set()
+
+    @property
+    def availability_topic(self) -> str:
+        return f"{self.prefix}/status"
+
+    def start(self):
+        self._client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        self._client.will_set(self.availability_topic, "offline", qos=1, retain=True)
+        self._client.on_connect = self._on_connect
+        self._client.connect_async(self.host, self.port, keepalive=60)
+        self._client.loop_start()
+        super().start()
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        if reason_code != 0:
+            logger.error(f"Sink {self.name} failed to connect to {self.host}:{self.port}: {reason_code}")
+            return
+        logger.info(f"Sink {self.name} connected to {self.host}:{self.port}")
+        client.publish(self.availability_topic, "online", qos=1, retain=True)
+        # Re-announce in case the broker lost its retained messages
+        self._announced = set()
+
+    def write(self, batch: list[tuple[str, dict]]):
+        for device_id, record in batch:
+            key = (device_id, record["metric_name"])
+            if self.discovery and key not in self._announced:
+                self._announce(key, "sensor", record.get("unit") or "")
+            value = record.get("value_last")
+            self._pending[key] = _state(record["metric_value"] if value is None else value)
+        self._publish_due()
+
+    def write_alarms(self, device_id: str, alarm_states: dict[str, bool]):
+        for name, active in alarm_states.items():
+            key = (device_id, name)
+            if self.discovery and (device_id, f"alarm/{name}") not in self._announced:
+                self._announce((device_id, f"alarm/{name}"), "binary_sensor")
+            if self._alarms.get(key) == active:
+                continue
+            if self._publish(f"{self.prefix}/{device_id}/alarm/{name}", "ON" if active else "OFF"):
+                self._alarms[key] = active
+
+    def idle(self):
+        self._publish_due()
+
+    def close(self):
+        if self._client is None:
+            return
+        self._publish_due(force=True)
+        if self._client.is_connected():
+            self._client.publish(self.availability_topic, "offline", qos=1, retain=True).wait_for_publish(5.0)
+        self._client.disconnect()
+        self._client.loop_stop()
+        self._client = None
+
+    def _publish_due(self, force: bool = False):
+        now = time.monotonic()
+        for key, state in list(self._pending.items()):
+            last = self._last.get(key)
+            if last is not None:
+                if last[0] == state:
+                    del self._pending[key]
+                    continue
+                if not force and now - last[1] < self.min_interval:
+                    continue
+            if not self._publish(f"{self.prefix}/{key[0]}/{key[1]}", state):
+                # Not connected; keep the value pending until the broker is back
+                return
+            del self._pending[key]
+            self._last[key] = (state, now)
+
+    def _publish(self, topic: str, payload: str, qos: int = 0) -> bool:
+        """Publish a retained message. Returns False while disconnected from the broker."""
+        result = self._client.publish(topic, payload, qos=qos, retain=True)
+        if result.rc == mqtt.MQTT_ERR_NO_CONN:
+            return False
+        if result.rc != mqtt.MQTT_ERR_SUCCESS:
+            raise ConnectionError(f"publish to {topic} failed: {mqtt.error_string(result.rc)}")
+        self.published += 1
+        return True
+
+    def _announce(self, key: tuple[str, str], component: str, unit: str = ""):
+        """Publish the Home Assistant discovery config for one metric or alarm."""
+        device_id, name = key
+        object_id = f"{self.prefix}_{device_id}_{name}".replace("/", "_").lower()
+        config = {
+            "name": name.split("/")[-1].replace("_", " ").capitalize(),
+            "unique_id": object_id,
+            "state_topic": f"{self.prefix}/{device_id}/{name}",
+            "availability_topic": self.availability_topic,
+            "device": {
+                "identifiers": [f"{self.prefix}_{device_id}"],
+                "name": f"Powervault P3 {device_id}",
+                "manufacturer": "Powervault",
+                "model": "P3",
+            },
+        }
+        if component == "binary_sensor":
+            config["device_class"] = "problem"
+        else:
+            device_class, ha_unit = _HA_UNITS.get(unit, (None, unit or None))
+            if name == "soc" or name.startswith("soc_"):
+                device_class = "battery"
+            if device_class:
+                config["device_class"] = device_class
+            if ha_unit:
+                config["unit_of_measurement"] = ha_unit
+            config["state_class"] = "total_increasing" if unit == "cycles" else "measurement"
+        if self._publish(
+            f"{self.discovery_prefix}/{component}/{object_id}/config",
+            json.dumps(config, ensure_ascii=False),
+            qos=1,
+        ):
+            self._announced.add(key)
+
+
+class SinkSet:
+    """Fan submissions out to several sinks, each queueing and delivering on its own."""
+
+    def __init__(self, sinks: list):
+        self.sinks = sinks
+
+    def submit(self, device_id: str, measurements: list[dict]) -> bool:
+        """Queue measurements on every sink. Returns False if any sink had to drop them."""
+        accepted = True
+        for sink in self.sinks:
+            accepted = sink.submit(device_id, measurements) and accepted
+        return accepted
+
+    def submit_alarms(self, device_id: str, alarm_states: dict[str, bool]) -> bool:
+        """Queue alarm states on every sink that records them."""
+        accepted = True
+        for sink in self.sinks:
+            accepted = sink.submit_alarms(device_id, alarm_states) and accepted
+        return accepted
+
+    def submit_event(self, device_id: str, event: dict) -> bool:
+        """Queue a captured frequency event on every sink that records them."""
+        accepted = True
+        for sink in self.sinks:
+            if sink.accepts_events:
+                accepted = sink.submit_event(device_id, event) and accepted
+        return accepted
+
+    @property
+    def queue_depth(self) -> int:
+        """Deepest sink queue."""
+        return max((sink.queue_depth for sink in self.sinks), default=0)
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """Queue depth and dropped records per sink."""
+        return {sink.name: {"queue": sink.queue_depth, "dropped": sink.dropped} for sink in self.sinks}
+
+    def start(self):
+        for sink in self.sinks:
+            sink.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Stop all sinks, each flushing what it has queued."""
+        for sink in self.sinks:
+            sink.stop(timeout)
@@ -0,0 +1,358 @@
+"""
+Durable on-disk spool for the PV3 MQTT collector.
+
+When the API is unreachable or too slow to keep up, the uploader appends batches to
+a SegmentSpool instead of dropping them. A SpoolReplayer drains the spool back into
+the API in large, ordered batches once it is accepting writes again.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from uploader import ApiClient, POST_OK, POST_REJECTED
+
+logger = logging.getLogger("pv3_collector.spool")
+
+SEGMENT_SUFFIX = ".seg"
+CURSOR_FILE = "cursor.json"
+
+
+class SegmentSpool:
+    """Append-only spool of upload batches, split into numbered segment files.
+
+    Each segment holds one JSON record per line. Only closed segments are read, so the
+    replayer never races the writer; the active segment is rotated as soon as the
+    replayer catches up with it. Total size and record age are bounded by dropping
+    the oldest segments first.
+    """
+
+    def __init__(
+        self,
+        directory: str | Path,
+        max_bytes: int = 256 * 1024 * 1024,
+        max_age: float = 7 * 24 * 3600,
+        segment_bytes: int = 4 * 1024 * 1024,
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.segment_bytes = segment_bytes
+
+        self.dropped_records = 0
+        self.replayed_records = 0
+
+        self._lock = threading.Lock()
+        self._active = None
+        self._active_seq: int | None = None
+        self._sizes: dict[int, int] = {}
+        self._records: dict[int, int] = {}
+
+        for path in sorted(self.directory.glob(f"*{SEGMENT_SUFFIX}")):
+            seq = int(path.stem)
+            self._sizes[seq] = path.stat().st_size
+            self._records[seq] = self._count_records(path)
+
+        self._cursor_seq, self._cursor_offset = self._load_cursor()
+        if self._sizes:
+            logger.info(
+                f"Spool at {self.directory} holds {self.backlog_records} records "
+                f"in {len(self._sizes)} segments"
+            )
+
+    # Stats
+
+    @property
+    def backlog_records(self) -> int:
+        """Spooled records (measurements plus alarm updates) not yet replayed."""
+        return sum(self._records.values())
+
+    @property
+    def backlog_bytes(self) -> int:
+        """Bytes on disk held by the spool."""
+        return sum(self._sizes.values())
+
+    @property
+    def segments(self) -> int:
+        """Number of segment files on disk."""
+        return len(self._sizes)
+
+    def stats(self) -> dict:
+        """Backlog counters for logging and monitoring."""
+        # Under the lock: the writer and replayer threads change the segment maps
+        with self._lock:
+            return {
+                "backlog_records": self.backlog_records,
+                "backlog_bytes": self.backlog_bytes,
+                "segments": self.segments,
+                "dropped_records": self.dropped_records,
+                "replayed_records": self.replayed_records,
+            }
+
+    # Writer side
+
+    def append(self, kind: str, device_id: str, data: list[dict] | dict) -> bool:
+        """Append one upload batch to the spool."""
+        line = json.dumps({"t": time.time(), "k": kind, "d": device_id, "v": data}) + "\n"
+        encoded = line.encode()
+        count = len(data) if kind == "measurements" else 1
+
+        with self._lock:
+            try:
+                if self._active is None or self._sizes[self._active_seq] >= self.segment_bytes:
+                    self._rotate()
+                self._active.write(encoded)
+                self._active.flush()
+                os.fsync(self._active.fileno())
+            except OSError as e:
+                logger.error(f"Failed to write to spool: {e}")
+                self.dropped_records += count
+                return False
+
+            self._sizes[self._active_seq] += len(encoded)
+            self._records[self._active_seq] += count
+            self._enforce_bounds()
+        return True
+
+    def _rotate(self):
+        if self._active is not None:
+            self._active.close()
+        seq = max(self._sizes, default=0) + 1
+        self._active = open(self._segment_path(seq), "ab")
+        self._active_seq = seq
+        self._sizes[seq] = 0
+        self._records[seq] = 0
+
+    def _enforce_bounds(self):
+        cutoff = time.time() - self.max_age
+        for seq in sorted(self._sizes):
+            if seq == self._active_seq:
+                break
+            too_big = self.backlog_bytes > self.max_bytes
+            too_old = self._segment_path(seq).stat().st_mtime < cutoff
+            if not (too_big or too_old):
+                break
+            logger.warning(
+                f"Spool {'full' if too_big else 'expired'}: dropping segment {seq} "
+                f"with {self._records[seq]} records"
+            )
+            self.dropped_records += self._records[seq]
+            self._remove_segment(seq)
+
+    # Reader side
+
+    def read(self, max_records: int) -> list[tuple[dict, tuple[int, int]]]:
+        """Read the oldest unreplayed records, up to roughly max_records measurements.
+
+        Returns (record, position) pairs; pass a position to commit() once the records
+        up to it have been stored.
+        """
+        with self._lock:
+            self._enforce_bounds()
+            closed = sorted(seq for seq in self._sizes if seq != self._active_seq)
+            if not closed and self._active is not None and self._sizes[self._active_seq] > 0:
+                # Caught up with the writer: close the active segment so it can be read
+                self._active.close()
+                self._active = None
+                self._active_seq = None
+                closed = sorted(self._sizes)
+            if not closed:
+                return []
+
+            seq = closed[0]
+            offset = self._cursor_offset if seq == self._cursor_seq else 0
+
+        batch = []
+        count = 0
+        try:
+            f = open(self._segment_path(seq), "rb")
+        except FileNotFoundError:
+            # A concurrent append dropped the segment (spool full or expired), which also
+            # moved the cursor on; the next read starts at the oldest remaining segment
+            logger.debug(f"Spool segment {seq} was dropped before it could be replayed")
+            return []
+        with f:
+            f.seek(offset)
+            for line in f:
+                offset += len(line)
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.error(f"Skipping corrupt spool record in segment {seq}")
+                    continue
+                batch.append((record, (seq, offset)))
+                count += len(record["v"]) if record["k"] == "measurements" else 1
+                if count >= max_records:
+                    break
+
+        if not batch:
+            # Nothing left in this segment (or only corrupt lines)
+            self.commit((seq, offset))
+        return batch
+
+    def commit(self, position: tuple[int, int]):
+        """Mark everything up to position as replayed."""
+        seq, offset = position
+        with self._lock:
+            if seq not in self._sizes:
+                return
+            path = self._segment_path(seq)
+            if offset >= path.stat().st_size and seq != self._active_seq:
+                self._remove_segment(seq)
+                self._cursor_seq, self._cursor_offset = None, 0
+            else:
+                self._cursor_seq, self._cursor_offset = seq, offset
+                self._records[seq] = self._count_records(path, offset)
+            self._save_cursor()
+
+    def close(self):
+        """Close the active segment."""
+        with self._lock:
+            if self._active is not None:
+                self._active.close()
+                self._active = None
+                self._active_seq = None
+
+    # Helpers
+
+    def _segment_path(self, seq: int) -> Path:
+        return self.directory / f"{seq:016d}{SEGMENT_SUFFIX}"
+
+    def _remove_segment(self, seq: int):
+        self._segment_path(seq).unlink(missing_ok=True)
+        del self._sizes[seq]
+        del self._records[seq]
+        if seq == self._cursor_seq:
+            self._cursor_seq, self._cursor_offset = None, 0
+            self._save_cursor()
+
+    def _count_records(self, path: Path, offset: int = 0) -> int:
+        count = 0
+        with open(path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                count += len(record["v"]) if record["k"] == "measurements" else 1
+        return count
+
+    def _load_cursor(self) -> tuple[int | None, int]:
+        try:
+            cursor = json.loads((self.directory / CURSOR_FILE).read_text())
+            return cursor["segment"], cursor["offset"]
+        except (OSError, ValueError, KeyError):
+            return None, 0
+
+    def _save_cursor(self):
+        tmp = self.directory / f"{CURSOR_FILE}.tmp"
+        tmp.write_text(json.dumps({"segment": self._cursor_seq, "offset": self._cursor_offset}))
+        os.replace(tmp, self.directory / CURSOR_FILE)
+
+
+class SpoolReplayer:
+    """Drain a SegmentSpool back into the API in large, ordered, rate-limited batches."""
+
+    def __init__(
+        self,
+        spool: SegmentSpool,
+        api_url: str,
+        batch_size: int = 5000,
+        max_batches_per_second: float = 2.0,
+        retry_interval: float = 15.0,
+        timeout: float = 30.0,
+    ):
+        self.spool = spool
+        self.client = ApiClient(api_url, timeout=timeout)
+        self.batch_size = batch_size
+        self.min_interval = 1.0 / max_batches_per_second if max_batches_per_second > 0 else 0.0
+        self.retry_interval = retry_interval
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="pv3-spool-replayer", daemon=True)
+
+    def start(self):
+        """Start the replay thread."""
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Stop the replay thread."""
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            # One bad batch or segment must not end the thread, or the spool never drains again
+            try:
+                self._replay_next()
+            except Exception as e:
+                logger.exception(f"Spool replay failed: {e}. Retrying in {self.retry_interval:.0f}s")
+                self._stop.wait(self.retry_interval)
+
+    def _replay_next(self):
+        batch = self.spool.read(self.batch_size)
+        if not batch:
+            self._stop.wait(1.0)
+            return
+
+        if self._replay(batch):
+            backlog = self.spool.stats()["backlog_records"]
+            if backlog:
+                logger.debug(f"Replayed spooled data, backlog now {backlog} records")
+            else:
+                logger.info(f"Spool drained ({self.spool.replayed_records} records replayed so far)")
+        else:
+            logger.warning(
+                f"API not accepting replay, {self.spool.stats()['backlog_records']} records spooled. "
+                f"Retrying in {self.retry_interval:.0f}s"
+            )
+            self._stop.wait(self.retry_interval)
+
+    def _replay(self, batch: list[tuple[dict, tuple[int, int]]]) -> bool:
+        """Post a batch of spooled records in order, committing as each group lands."""
+        for kind, device_id, data, position, count in self._group(batch):
+            started = time.monotonic()
+            if kind == "measurements":
+                result = self.client.post_measurements(device_id, data)
+            elif kind == "frequency_event":
+                result = self.client.post_frequency_event(device_id, data)
+            else:
+                result = self.client.post_alarms(device_id, data)
+
+            if result == POST_REJECTED:
+                logger.error(f"API rejected {count} spooled records for {device_id}, discarding them")
+            elif result != POST_OK:
+                return False
+
+            self.spool.commit(position)
+            if result == POST_OK:
+                self.spool.replayed_records += count
+
+            elapsed = time.monotonic() - started
+            if elapsed < self.min_interval and self._stop.wait(self.min_interval - elapsed):
+                return True
+        return True
+
+    @staticmethod
+    def _group(batch: list[tuple[dict, tuple[int, int]]]):
+        """Merge consecutive records for the same device and kind, preserving order."""
+        group = None
+        for record, position in batch:
+            kind, device_id, data = record["k"], record["d"], record["v"]
+            if group and group[0] == kind == "measurements" and group[1] == device_id:
+                group[2].extend(data)
+                group[3] = position
+                group[4] += len(data)
+                continue
+            if group:
+                yield tuple(group)
+            count = len(data) if kind == "measurements" else 1
+            group = [kind, device_id, list(data) if kind == "measurements" else data, position, count]
+        if group:
+            yield tuple(group)
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+PV3 MQTT Collector Supervisor
+
+Runs the fleet collector as a supervisor plus COLLECTOR_WORKERS worker processes, so
+JSON decoding and mapping for a large fleet is spread over several cores. Devices are
+assigned to workers by consistent hashing (sharding.HashRing). Each worker is a
+FleetCollector for its share of the devices, with its own sinks, spool and output
+directories (and ports SINK_PROMETHEUS_PORT + index and METRICS_PORT + index), and
+reports throughput and event loop lag back to the supervisor. A worker that exits or
+stops reporting is restarted with the same devices; the others are not touched.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import time
+
+from fleet import (
+    FLEET_CONFIG,
+    FLEET_FROM_API,
+    FLEET_REFRESH_SECONDS,
+    FLEET_STATUS_SECONDS,
+    DeviceEndpoint,
+    FleetCollector,
+    read_fleet,
+)
+from mqtt_collector import API_URL, METRICS_PORT, SINK_OUTPUT_DIR, SINK_PROMETHEUS_PORT, SPOOL_DIR
+from sharding import HashRing
+
+# Supervisor configuration
+COLLECTOR_WORKERS = int(os.getenv("COLLECTOR_WORKERS", str(os.cpu_count() or 1)))
+WORKER_REPORT_SECONDS = float(os.getenv("WORKER_REPORT_SECONDS", "10"))
+WORKER_STALL_SECONDS = float(os.getenv("WORKER_STALL_SECONDS", "120"))
+WORKER_RESTART_MAX_SECONDS = float(os.getenv("WORKER_RESTART_MAX_SECONDS", "60"))
+
+# Event loop lag above this is logged as a saturated worker
+WORKER_LAG_WARNING_SECONDS = 1.0
+
+_LAG_PROBE_SECONDS = 0.5
+# A worker that ran at least this long before dying restarts without backoff
+_HEALTHY_RUN_SECONDS = 300.0
+
+logger = logging.getLogger("pv3_collector.supervisor")
+
+
+def worker_spool_dir(index: int) -> str:
+    """Each worker writes its own spool, so a restarted worker replays what it left behind."""
+    return os.path.join(SPOOL_DIR, f"worker-{index}") if SPOOL_DIR else ""
+
+
+class ShardWorker(FleetCollector):
+    """Fleet collector for the devices the supervisor assigned to one worker."""
+
+    def __init__(
+        self,
+        index: int,
+        devices: list[DeviceEndpoint],
+        control: multiprocessing.Queue,
+        reports: multiprocessing.Queue,
+    ):
+        # The device list comes from the supervisor; poll for changes every second
+        super().__init__(
+            spool_dir=worker_spool_dir(index),
+            output_dir=os.path.join(SINK_OUTPUT_DIR, f"worker-{index}"),
+            prometheus_port=SINK_PROMETHEUS_PORT + index,
+            refresh_interval=1.0,
+            status_interval=WORKER_REPORT_SECONDS,
+            metrics_port=METRICS_PORT + index if METRICS_PORT else 0,
+        )
+        self.index = index
+        self.control = control
+        self.reports = reports
+        self._assigned: list[DeviceEndpoint] | None = devices
+        self._loop_lag = 0.0
+        self._last_report = (time.monotonic(), 0)
+
+    async def load_devices(self) -> list[DeviceEndpoint] | None:
+        """Return the newest assignment from the supervisor, or None if it has not changed."""
+        devices, self._assigned = self._assigned, None
+        try:
+            while True:
+                message = self.control.get_nowait()
+                if message is None:
+                    self.running = False
+                else:
+                    devices = message
+        except queue.Empty:
+            pass
+        return devices
+
+    def log_status(self):
+        """Send throughput and lag since the last report to the supervisor."""
+        now = time.monotonic()
+        messages = sum(state.messages for state in self.processor.devices.values())
+        since, before = self._last_report
+        self.reports.put({
+            "worker": self.index,
+            "pid": os.getpid(),
+            "devices": len(self.connections),
+            "connected": sum(1 for c in self.connections.values() if c.connected),
+            "messages": messages,
+            "rate": (messages - before) / max(now - since, 1e-9),
+            "loop_lag": self._loop_lag,
+            "sink_queue": self.sinks.queue_depth,
+            "sink_dropped": sum(sink.dropped for sink in self.sinks.sinks),
+        })
+        self._last_report = (now, messages)
+        self._loop_lag = 0.0
+
+    async def watch_loop_lag(self):
+        """Track how late the event loop runs a timer: a busy worker falls behind its brokers."""
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(_LAG_PROBE_SECONDS)
+            self._loop_lag = max(self._loop_lag, loop.time() - started - _LAG_PROBE_SECONDS)
+
+    async def run(self):
+        probe = asyncio.create_task(self.watch_loop_lag())
+        try:
+            await super().run()
+        finally:
+            probe.cancel()
+
+
+def run_worker(
+    index: int,
+    devices: list[DeviceEndpoint],
+    control: multiprocessing.Queue,
+    reports: multiprocessing.Queue,
+):
+    """Worker process entry point."""
+    # Shutdown is coordinated by the supervisor through the control queue
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    asyncio.run(ShardWorker(index, devices, control, reports).run())
+
+
+class WorkerHandle:
+    """Supervisor-side state for one worker slot."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.devices: list[DeviceEndpoint] = []
+        self.process: multiprocessing.process.BaseProcess | None = None
+        self.control: multiprocessing.Queue | None = None
+        self.reports: multiprocessing.Queue | None = None
+        self.started_at = 0.0
+        self.last_report: dict | None = None
+        self.last_report_at = 0.0
+        self.restarts = 0
+        self.restart_delay = 0.0
+        self.restart_at: float | None = None
+
+
+class Supervisor:
+    """Start, feed and restart the worker processes."""
+
+    def __init__(self, workers: int = COLLECTOR_WORKERS):
+        self.context = multiprocessing.get_context("spawn")
+        self.ring = HashRing(list(range(workers)))
+        self.workers = [WorkerHandle(index) for index in range(workers)]
+        self.running = False
+
+    def assign(self, endpoints: list[DeviceEndpoint]) -> list[list[DeviceEndpoint]]:
+        """Split the fleet across the workers."""
+        assignment: list[list[DeviceEndpoint]] = [[] for _ in self.workers]
+        for endpoint in sorted(endpoints):
+            assignment[self.ring.node_for(endpoint.device_id)].append(endpoint)
+        return assignment
+
+    def refresh(self):
+        """Re-read the fleet and send changed assignments to running workers."""
+        endpoints = read_fleet()
+        if endpoints is None:
+            return
+        for handle, devices in zip(self.workers, self.assign(endpoints)):
+            if devices == handle.devices:
+                continue
+            handle.devices = devices
+            if handle.process is not None and handle.process.is_alive():
+                handle.control.put(devices)
+
+    def start_worker(self, handle: WorkerHandle):
+        # Fresh queues: a killed worker may have left the old ones locked
+        handle.control = self.context.Queue()
+        handle.reports = self.context.Queue()
+        handle.process = self.context.Process(
+            target=run_worker,
+            args=(handle.index, handle.devices, handle.control, handle.reports),
+            name=f"pv3-worker-{handle.index}",
+            daemon=False,
+        )
+        handle.process.start()
+        handle.started_at = time.monotonic()
+        handle.last_report = None
+        handle.last_report_at = handle.started_at
+        handle.restart_at = None
+        logger.info(f"Worker {handle.index} started (pid {handle.process.pid}, {len(handle.devices)} devices)")
+
+    def check_workers(self):
+        """Restart workers that exited or stopped reporting, backing off on crash loops."""
+        now = time.monotonic()
+        for handle in self.workers:
+            if handle.restart_at is not None:
+                if now >= handle.restart_at:
+                    handle.restarts += 1
+                    self.start_worker(handle)
+                continue
+
+            process = handle.process
+            if process.is_alive():
+                if now - handle.last_report_at < WORKER_STALL_SECONDS:
+                    continue
+                logger.error(f"Worker {handle.index} sent no report for {WORKER_STALL_SECONDS:.0f}s, killing it")
+                process.kill()
+                process.join(5)
+
+            logger.error(f"Worker {handle.index} exited with code {process.exitcode}")
+            if now - handle.started_at >= _HEALTHY_RUN_SECONDS:
+                handle.restart_delay = 0.0
+            else:
+                handle.restart_delay = min(max(handle.restart_delay * 2, 1.0), WORKER_RESTART_MAX_SECONDS)
+            handle.restart_at = now + handle.restart_delay
+            logger.info(f"Restarting worker {handle.index} in {handle.restart_delay:.0f}s")
+
+    def collect_reports(self):
+        for handle in self.workers:
+            if handle.reports is None:
+                continue
+            try:
+                while True:
+                    handle.last_report = handle.reports.get_nowait()
+                    handle.last_report_at = time.monotonic()
+            except queue.Empty:
+                pass
+
+    def log_status(self):
+        total_rate = 0.0
+        for handle in self.workers:
+            report = handle.last_report
+            if report is None:
+                logger.info(f"Worker {handle.index}: no report yet ({len(handle.devices)} devices)")
+                continue
+            total_rate += report["rate"]
+            logger.info(
+                f"Worker {handle.index} (pid {report['pid']}): "
+                f"{report['connected']}/{report['devices']} connected, {report['rate']:.1f} msg/s, "
+                f"loop lag {report['loop_lag'] * 1000:.0f}ms, sink queue {report['sink_queue']}, "
+                f"sink drops {report['sink_dropped']}, "
+                f"restarts {handle.restarts}"
+            )
+            if report["loop_lag"] > WORKER_LAG_WARNING_SECONDS:
+                logger.warning(f"Worker {handle.index} is saturated; consider more COLLECTOR_WORKERS")
+        logger.info(f"Fleet total: {total_rate:.1f} msg/s across {len(self.workers)} workers")
+
+    def stop(self):
+        for handle in self.workers:
+            if handle.process is not None and handle.process.is_alive():
+                handle.control.put(None)
+        for handle in self.workers:
+            if handle.process is None:
+                continue
+            handle.process.join(30)
+            if handle.process.is_alive():
+                logger.warning(f"Worker {handle.index} did not stop, terminating it")
+                handle.process.terminate()
+                handle.process.join(5)
+
+    def run(self):
+        """Start the workers and supervise them until interrupted."""
+        logger.info(f"Starting PV3 MQTT Collector Supervisor with {len(self.workers)} workers")
+        logger.info(f"Fleet config: {FLEET_CONFIG or 'none'}; devices from API: {FLEET_FROM_API}")
+        logger.info(f"API URL: {API_URL}")
+        logger.info(f"Spool: {SPOOL_DIR or 'disabled'}")
+
+        self.refresh()
+        for handle in self.workers:
+            self.start_worker(handle)
+
+        self.running = True
+        next_refresh = time.monotonic() + FLEET_REFRESH_SECONDS
+        next_status = time.monotonic() + FLEET_STATUS_SECONDS
+        try:
+            while self.running:
+                time.sleep(1.0)
+                self.collect_reports()
+                self.check_workers()
+                now = time.monotonic()
+                if now >= next_refresh:
+                    self.refresh()
+                    next_refresh = now + FLEET_REFRESH_SECONDS
+                if now >= next_status:
+                    self.log_status()
+                    next_status = now + FLEET_STATUS_SECONDS
+        except KeyboardInterrupt:
+            pass
+        finally:
+            logger.info("Shutting down workers...")
+            self.stop()
+
+
+def _terminate(signum, frame):
+    raise KeyboardInterrupt
+
+
+if __name__ == "__main__":
+    if not FLEET_CONFIG and not FLEET_FROM_API:
+        raise SystemExit("Set FLEET_CONFIG and/or FLEET_FROM_API to define the fleet")
+    signal.signal(signal.SIGTERM, _terminate)
+    Supervisor().run()
@@ -0,0 +1,316 @@
+"""
+Background upload stage for the PV3 MQTT collector.
+
+Handlers hand parsed measurements to a BatchUploader, which coalesces them on its
+own thread and POSTs them to the PV3 Monitor API, so the MQTT network thread never
+waits on HTTP. Batches the API cannot take right now go to an optional on-disk spool.
+"""
+
+import logging
+import queue
+import threading
+import time
+
+import requests
+
+logger = logging.getLogger("pv3_collector.uploader")
+
+_STOP = object()
+
+# Outcomes of a POST to the API
+POST_OK = "ok"
+POST_RETRY = "retry"  # API unreachable, overloaded or erroring; worth trying again later
+POST_REJECTED = "rejected"  # API refused the data itself; retrying will not help
+
+
+class ApiClient:
+    """Minimal client for the PV3 Monitor ingest endpoints. Not thread-safe."""
+
+    def __init__(self, api_url: str, timeout: float = 10.0):
+        self.api_url = api_url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+
+    def post_measurements(self, device_id: str, measurements: list[dict]) -> str:
+        """POST a batch of measurements."""
+        url = f"{self.api_url}/api/devices/{device_id}/measurements/batch"
+        try:
+            # Wait for the commit, so a failed write is retried and spooled rather than lost
+            response = self.session.post(url, json=measurements, params={"wait": "true"}, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.exceptions.HTTPError as e:
+            if e.response.status_code == 422:
+                logger.error(f"Validation error storing batch for {device_id}: {e.response.text}")
+                logger.debug(f"Problematic data: {measurements}")
+            else:
+                logger.error(f"HTTP error storing {len(measurements)} measurements for {device_id}: {e}")
+            return _classify(e.response.status_code)
+        except Exception as e:
+            logger.error(f"Failed to store {len(measurements)} measurements for {device_id}: {e}")
+            return POST_RETRY
+
+        logger.debug(f"Stored {len(measurements)} measurements for {device_id}")
+        return POST_OK
+
+    def post_alarms(self, device_id: str, alarm_states: dict[str, bool]) -> str:
+        """POST the latest alarm states."""
+        url = f"{self.api_url}/api/devices/{device_id}/alarms"
+        try:
+            response = self.session.post(url, json=alarm_states, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.exceptions.HTTPError as e:
+            logger.error(f"HTTP error updating alarm states for {device_id}: {e}")
+            return _classify(e.response.status_code)
+        except Exception as e:
+            logger.error(f"Failed to update alarm states for {device_id}: {e}")
+            return POST_RETRY
+
+        logger.debug(f"Updated {len(alarm_states)} alarm states for {device_id}")
+        return POST_OK
+
+    def post_frequency_event(self, device_id: str, event: dict) -> str:
+        """POST one captured frequency event (see pv3common.burst)."""
+        url = f"{self.api_url}/api/devices/{device_id}/frequency-events"
+        try:
+            response = self.session.post(url, json=event, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.exceptions.HTTPError as e:
+            logger.error(f"HTTP error storing frequency event for {device_id}: {e}")
+            return _classify(e.response.status_code)
+        except Exception as e:
+            logger.error(f"Failed to store frequency event for {device_id}: {e}")
+            return POST_RETRY
+
+        logger.debug(f"Stored frequency event for {device_id} ({event['sample_count']} samples)")
+        return POST_OK
+
+
+def _classify(status_code: int) -> str:
+    if status_code in (408, 429) or status_code >= 500:
+        return POST_RETRY
+    return POST_REJECTED
+
+
+class BatchUploader:
+    """Coalesce measurements and alarm states and flush them to the API in batches.
+
+    A batch is cut when it reaches ``batch_size`` measurements or when its oldest
+    sample is ``max_age`` seconds old. The batch size adapts to the POST latency the
+    uploader observes: a slow API gets fewer, larger requests, a fast one gets small
+    batches so the dashboard stays fresh.
+
+    With a spool attached, batches that fail with a retryable error and submissions
+    that find the queue full are written to disk instead of being dropped. While the
+    spool holds a backlog, alarm updates are spooled too so they replay in order.
+
+    Frequency events from burst capture are posted one by one with the next flush and
+    spooled like alarm updates when the API cannot take them.
+
+    This is the collector's REST sink (see sinks.py).
+    """
+
+    name = "rest"
+    accepts_events = True
+
+    def __init__(
+        self,
+        api_url: str,
+        min_batch: int = 20,
+        max_batch: int = 2000,
+        max_age: float = 1.0,
+        target_latency: float = 0.5,
+        max_queue: int = 10000,
+        timeout: float = 10.0,
+        spool=None,
+        metrics=None,
+    ):
+        self.api_url = api_url
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+        self.max_age = max_age
+        self.target_latency = target_latency
+        self.timeout = timeout
+        self.spool = spool
+        # Optional metrics.CollectorMetrics for batch size and POST latency
+        self.metrics = metrics
+
+        self.client = ApiClient(api_url, timeout=timeout)
+
+        self.batch_size = min_batch
+        self.latency_ewma: float | None = None
+        self.posted = 0
+        self.dropped = 0
+        self.failed = 0
+        self.spooled = 0
+
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name="pv3-uploader", daemon=True)
+        self._pending: dict[str, list[dict]] = {}
+        self._pending_alarms: dict[str, dict[str, bool]] = {}
+        self._pending_events: list[tuple[str, dict]] = []
+        self._pending_count = 0
+        self._oldest: float | None = None
+
+    # Producer side (called from the MQTT thread, never blocks)
+
+    def submit(self, device_id: str, measurements: list[dict]) -> bool:
+        """Queue measurements for upload. Returns False if the queue is full."""
+        if not measurements:
+            return True
+        try:
+            self._queue.put_nowait(("measurements", device_id, measurements))
+            return True
+        except queue.Full:
+            if self._spool("measurements", device_id, measurements):
+                return True
+            self.dropped += len(measurements)
+            logger.warning(f"Upload queue full, dropped {len(measurements)} measurements for {device_id}")
+            return False
+
+    def submit_alarms(self, device_id: str, alarm_states: dict[str, bool]) -> bool:
+        """Queue alarm states for upload. Returns False if the queue is full."""
+        try:
+            self._queue.put_nowait(("alarms", device_id, alarm_states))
+            return True
+        except queue.Full:
+            if self._spool("alarms", device_id, alarm_states):
+                return True
+            logger.warning(f"Upload queue full, dropped alarm update for {device_id}")
+            return False
+
+    def submit_event(self, device_id: str, event: dict) -> bool:
+        """Queue a frequency event for upload. Returns False if the queue is full."""
+        try:
+            self._queue.put_nowait(("frequency_event", device_id, event))
+            return True
+        except queue.Full:
+            if self._spool("frequency_event", device_id, event):
+                return True
+            logger.warning(f"Upload queue full, dropped frequency event for {device_id}")
+            return False
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of submissions waiting to be coalesced."""
+        return self._queue.qsize()
+
+    @property
+    def written(self) -> int:
+        """Measurements accepted by the API, under the name the other sinks use."""
+        return self.posted
+
+    # Lifecycle
+
+    def start(self):
+        """Start the upload thread."""
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Flush everything queued so far and stop the upload thread."""
+        if not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    # Upload thread
+
+    def _run(self):
+        while True:
+            if self._oldest is None:
+                wait = None
+            else:
+                wait = max(0.0, self._oldest + self.max_age - time.monotonic())
+
+            try:
+                item = self._queue.get(timeout=wait)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                self._flush()
+                return
+
+            if item is not None:
+                self._add(item)
+
+            due = self._oldest is not None and time.monotonic() - self._oldest >= self.max_age
+            if self._pending_count >= self.batch_size or due:
+                self._flush()
+
+    def _add(self, item: tuple):
+        kind, device_id, data = item
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+        if kind == "measurements":
+            self._pending.setdefault(device_id, []).extend(data)
+            self._pending_count += len(data)
+        elif kind == "frequency_event":
+            self._pending_events.append((device_id, data))
+        else:
+            # Alarm states are a snapshot, so only the latest value per flag matters
+            self._pending_alarms.setdefault(device_id, {}).update(data)
+
+    def _flush(self):
+        pending, self._pending = self._pending, {}
+        pending_alarms, self._pending_alarms = self._pending_alarms, {}
+        pending_events, self._pending_events = self._pending_events, []
+        self._pending_count = 0
+        self._oldest = None
+
+        for device_id, alarm_states in pending_alarms.items():
+            self._post_alarms(device_id, alarm_states)
+
+        for device_id, event in pending_events:
+            self._post_event(device_id, event)
+
+        for device_id, measurements in pending.items():
+            for start in range(0, len(measurements), self.batch_size):
+                self._post_measurements(device_id, measurements[start:start + self.batch_size])
+
+    def _post_measurements(self, device_id: str, measurements: list[dict]):
+        started = time.monotonic()
+        result = self.client.post_measurements(device_id, measurements)
+        latency = time.monotonic() - started
+        if self.metrics is not None:
+            self.metrics.upload_batch_size.observe(len(measurements))
+            self.metrics.upload_latency.observe(latency, result)
+        if result == POST_OK:
+            self._adapt(latency)
+            self.posted += len(measurements)
+        elif result == POST_RETRY and self._spool("measurements", device_id, measurements):
+            pass
+        else:
+            self.failed += len(measurements)
+
+    def _post_alarms(self, device_id: str, alarm_states: dict[str, bool]):
+        if self.spool is not None and self.spool.backlog_records:
+            # Older alarm states are still waiting in the spool; keep them in order
+            self._spool("alarms", device_id, alarm_states)
+            return
+        result = self.client.post_alarms(device_id, alarm_states)
+        if result == POST_RETRY:
+            self._spool("alarms", device_id, alarm_states)
+
+    def _post_event(self, device_id: str, event: dict):
+        if self.client.post_frequency_event(device_id, event) == POST_RETRY:
+            self._spool("frequency_event", device_id, event)
+
+    def _spool(self, kind: str, device_id: str, data: list[dict] | dict) -> bool:
+        if self.spool is None or not self.spool.append(kind, device_id, data):
+            return False
+        if kind == "measurements":
+            self.spooled += len(data)
+        return True
+
+    def _adapt(self, latency: float):
+        """Grow the batch size while the API is slow, shrink it again when it is fast."""
+        if self.latency_ewma is None:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma = 0.8 * self.latency_ewma + 0.2 * latency
+
+        if self.latency_ewma > self.target_latency:
+            self.batch_size = min(self.max_batch, self.batch_size * 2)
+        elif self.latency_ewma < self.target_latency / 2:
+            self.batch_size = max(self.min_batch, self.batch_size * 3 // 4)
@@ -1,9 +1,9 @@
 export interface WebSocketMessage {
-  type: 'MEASUREMENT_UPDATE' | 'ALARM_UPDATE' | 'SCHEDULE_UPDATE' | 'CONNECTION_STATUS' | 'heartbeat'
+  type: 'MEASUREMENT_UPDATE' | 'ALARMS_UPDATE' | 'SCHEDULE_UPDATE' | 'CONNECTION_STATUS' | 'heartbeat'
   device_id?: string
   timestamp?: string
   data?: Record<string, unknown>
-  alarm_name?: string
-  is_active?: boolean
+  // ALARMS_UPDATE: the flags that changed in one alarm update
+  alarms?: Record<string, boolean>
 }
 
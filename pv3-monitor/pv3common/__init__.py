@@ -0,0 +1,18 @@
+"""Code shared by the PV3 collector and the PV3 Monitor backend."""
+
+from pv3common.aggregate import WindowAggregator
+from pv3common.burst import BurstCapture
+from pv3common.mapping import Decoded, MetricRule, TopicRouter, TopicSpec, load_topic_map
+from pv3common.outlier import OutlierFilter, OutlierRule
+
+__all__ = [
+    "BurstCapture",
+    "Decoded",
+    "MetricRule",
+    "OutlierFilter",
+    "OutlierRule",
+    "TopicRouter",
+    "TopicSpec",
+    "WindowAggregator",
+    "load_topic_map",
+]
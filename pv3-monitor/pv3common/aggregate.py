@@ -0,0 +1,141 @@
+"""
+Fixed-window pre-aggregation of metric samples.
+
+WindowAggregator rolls raw samples up into one record per device, metric and window
+(min, max, mean, last and sample count), aligned to wall-clock window boundaries.
+Categorical metrics, where a mean means nothing, are passed through when they change.
+"""
+
+import math
+from array import array
+from datetime import datetime, timezone
+
+# Metrics whose values are states rather than quantities
+DEFAULT_CATEGORICAL = frozenset({"schedule_event", "eps_mode", "eps_schedule_event"})
+
+
+def _isoformat(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+class WindowAggregator:
+    """Aggregate samples per (device, metric) over fixed windows.
+
+    Every (device, metric) pair gets a slot in parallel numeric arrays the first time
+    it is seen, so adding a sample is one dict lookup plus a few array writes, and
+    closing a window reuses the slots instead of allocating new state.
+
+    Output records are ``(device_id, measurement dict)`` pairs in the batch API's shape.
+    Aggregates are stamped with the window start and carry the mean as metric_value.
+    """
+
+    def __init__(self, window_seconds: float = 60.0, categorical=DEFAULT_CATEGORICAL):
+        if window_seconds <= 0:
+            raise ValueError("window_seconds must be positive")
+        self.window = float(window_seconds)
+        self.categorical = frozenset(categorical)
+
+        self._slots: dict[tuple[str, str], int] = {}
+        self._keys: list[tuple[str, str]] = []
+        self._units: list[str] = []
+        self._topics: list[str | None] = []
+        self._count = array("q")
+        self._min = array("d")
+        self._max = array("d")
+        self._sum = array("d")
+        self._last = array("d")
+
+        self._window_start: float | None = None
+        self._categorical_last: dict[tuple[str, str], float] = {}
+
+        self.samples_in = 0
+        self.records_out = 0
+
+    def add(
+        self,
+        device_id: str,
+        metric: str,
+        value: float,
+        unit: str | None,
+        source_topic: str | None,
+        timestamp: float,
+    ) -> list[tuple[str, dict]]:
+        """Add one sample. Returns any records now due: a closed window, a changed state."""
+        self.samples_in += 1
+        out = self.roll(timestamp)
+
+        key = (device_id, metric)
+        if metric in self.categorical:
+            if self._categorical_last.get(key) != value:
+                self._categorical_last[key] = value
+                out.append((device_id, {
+                    "metric_name": metric,
+                    "metric_value": value,
+                    "unit": unit,
+                    "source_topic": source_topic,
+                    "timestamp": _isoformat(timestamp),
+                }))
+                self.records_out += 1
+            return out
+
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._slots[key] = len(self._keys)
+            self._keys.append(key)
+            self._units.append(unit)
+            self._topics.append(source_topic)
+            self._count.append(0)
+            for values in (self._min, self._max, self._sum, self._last):
+                values.append(0.0)
+
+        if self._count[slot] == 0:
+            self._min[slot] = value
+            self._max[slot] = value
+            self._sum[slot] = value
+        else:
+            if value < self._min[slot]:
+                self._min[slot] = value
+            elif value > self._max[slot]:
+                self._max[slot] = value
+            self._sum[slot] += value
+        self._last[slot] = value
+        self._count[slot] += 1
+        return out
+
+    def roll(self, now: float) -> list[tuple[str, dict]]:
+        """Close the current window if `now` is past its end."""
+        start = self._window_start
+        if start is None:
+            self._window_start = math.floor(now / self.window) * self.window
+            return []
+        if now < start + self.window:
+            return []
+        out = self.flush()
+        self._window_start = math.floor(now / self.window) * self.window
+        return out
+
+    def flush(self) -> list[tuple[str, dict]]:
+        """Emit the current window's aggregates and start an empty window."""
+        if self._window_start is None:
+            return []
+        timestamp = _isoformat(self._window_start)
+        out = []
+        count = self._count
+        for slot, (device_id, metric) in enumerate(self._keys):
+            n = count[slot]
+            if not n:
+                continue
+            out.append((device_id, {
+                "metric_name": metric,
+                "metric_value": self._sum[slot] / n,
+                "unit": self._units[slot],
+                "source_topic": self._topics[slot],
+                "timestamp": timestamp,
+                "value_min": self._min[slot],
+                "value_max": self._max[slot],
+                "value_last": self._last[slot],
+                "sample_count": n,
+            }))
+            count[slot] = 0
+        self.records_out += len(out)
+        return out
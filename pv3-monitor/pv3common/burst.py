@@ -0,0 +1,161 @@
+"""
+Burst capture of full-rate samples around grid frequency events.
+
+BurstCapture keeps the last ``pre_seconds`` of selected raw samples per device in a
+bounded ring buffer. When the trigger metric (grid frequency) leaves its band, the
+buffer is frozen into an event and samples keep being appended until ``post_seconds``
+after the frequency was last out of band (capped at ``max_seconds``). The finished event
+is one record with a parallel-array series per metric, so full-rate data is kept only
+around events.
+"""
+
+from collections import deque
+from datetime import datetime, timezone
+
+# Metrics worth seeing at full rate around a frequency event
+DEFAULT_BURST_METRICS = frozenset({
+    "grid_frequency",
+    "grid_power",
+    "grid_voltage",
+    "house_power",
+    "aux_power",
+    "battery_power",
+    "battery_current",
+})
+
+
+def _isoformat(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+class _Event:
+    __slots__ = ("trigger_time", "trigger_value", "min_value", "max_value", "last_out_of_band", "samples")
+
+    def __init__(self, trigger_time: float, trigger_value: float, samples: list[tuple[float, str, float]]):
+        self.trigger_time = trigger_time
+        self.trigger_value = trigger_value
+        self.min_value = trigger_value
+        self.max_value = trigger_value
+        self.last_out_of_band = trigger_time
+        self.samples = samples
+
+
+class BurstCapture:
+    """Per-device pre-trigger buffers and in-progress events."""
+
+    def __init__(
+        self,
+        low: float = 49.8,
+        high: float = 50.2,
+        pre_seconds: float = 30.0,
+        post_seconds: float = 30.0,
+        max_seconds: float = 300.0,
+        metrics=DEFAULT_BURST_METRICS,
+        trigger_metric: str = "grid_frequency",
+        max_samples: int = 20000,
+    ):
+        if low >= high:
+            raise ValueError("low must be below high")
+        self.low = low
+        self.high = high
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.max_seconds = max_seconds
+        self.metrics = frozenset(metrics) | {trigger_metric}
+        self.trigger_metric = trigger_metric
+        self.max_samples = max_samples
+
+        # device_id -> deque of (timestamp, metric, value)
+        self._buffers: dict[str, deque] = {}
+        self._events: dict[str, _Event] = {}
+
+        self.events_captured = 0
+
+    def add(self, device_id: str, measurements: list[tuple[str, float, str]], now: float) -> list[dict]:
+        """Record the selected metrics of one message; return any events that finished."""
+        finished = self._close_due(device_id, now)
+
+        metrics = self.metrics
+        event = self._events.get(device_id)
+        buffer = self._buffers.get(device_id)
+        for metric, value, _ in measurements:
+            if metric not in metrics:
+                continue
+            sample = (now, metric, value)
+            if event is not None:
+                if len(event.samples) < self.max_samples:
+                    event.samples.append(sample)
+            else:
+                if buffer is None:
+                    buffer = self._buffers[device_id] = deque(maxlen=self.max_samples)
+                buffer.append(sample)
+
+            if metric != self.trigger_metric:
+                continue
+            out_of_band = value < self.low or value > self.high
+            if event is None and out_of_band:
+                event = self._trigger(device_id, buffer, now, value)
+            elif event is not None:
+                event.min_value = min(event.min_value, value)
+                event.max_value = max(event.max_value, value)
+                if out_of_band:
+                    event.last_out_of_band = now
+
+        if buffer is not None and event is None:
+            cutoff = now - self.pre_seconds
+            while buffer and buffer[0][0] < cutoff:
+                buffer.popleft()
+        return finished
+
+    def tick(self, now: float) -> list[dict]:
+        """Finish events whose post-trigger window has passed, even if their device went quiet."""
+        finished = []
+        for device_id in list(self._events):
+            finished += self._close_due(device_id, now)
+        return finished
+
+    def flush(self) -> list[dict]:
+        """Finish every event in progress, e.g. on shutdown."""
+        finished = [self._encode(device_id, event) for device_id, event in self._events.items()]
+        self._events.clear()
+        return finished
+
+    def _trigger(self, device_id: str, buffer: deque, now: float, value: float) -> _Event:
+        cutoff = now - self.pre_seconds
+        event = _Event(now, value, [sample for sample in buffer if sample[0] >= cutoff])
+        buffer.clear()
+        self._events[device_id] = event
+        return event
+
+    def _close_due(self, device_id: str, now: float) -> list[dict]:
+        event = self._events.get(device_id)
+        if event is None:
+            return []
+        if now - event.last_out_of_band < self.post_seconds and now - event.trigger_time < self.max_seconds:
+            return []
+        del self._events[device_id]
+        return [self._encode(device_id, event)]
+
+    def _encode(self, device_id: str, event: _Event) -> dict:
+        """Event record in the API's shape: time offsets in ms from start_time, one array pair per metric."""
+        self.events_captured += 1
+        start = event.samples[0][0] if event.samples else event.trigger_time
+        end = event.samples[-1][0] if event.samples else event.trigger_time
+        series: dict[str, dict[str, list]] = {}
+        for timestamp, metric, value in event.samples:
+            arrays = series.get(metric)
+            if arrays is None:
+                arrays = series[metric] = {"t": [], "v": []}
+            arrays["t"].append(round((timestamp - start) * 1000))
+            arrays["v"].append(value)
+        return {
+            "device_id": device_id,
+            "trigger_time": _isoformat(event.trigger_time),
+            "trigger_frequency": event.trigger_value,
+            "min_frequency": event.min_value,
+            "max_frequency": event.max_value,
+            "start_time": _isoformat(start),
+            "end_time": _isoformat(end),
+            "sample_count": len(event.samples),
+            "series": series,
+        }
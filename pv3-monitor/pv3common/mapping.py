@@ -0,0 +1,274 @@
+"""
+Declarative P3 topic/metric mapping.
+
+The mapping table in topic_map.csv is compiled once at startup into dict-keyed
+dispatch. TopicRouter resolves a topic to its compiled TopicSpec from the topic
+suffix alone, so callers can skip JSON decoding for topics nothing is mapped to.
+"""
+
+import csv
+from pathlib import Path
+from typing import Any, NamedTuple
+
+TOPIC_MAP_PATH = Path(__file__).with_name("topic_map.csv")
+
+WILDCARD = "*"
+
+
+# Compiled transform codes
+_PLAIN, _ABS, _ONOFF = 0, 1, 2
+_TRANSFORM_CODES = {"": _PLAIN, "abs": _ABS, "onoff": _ONOFF}
+
+# How a measurement name narrows down to a rule
+_DIRECT, _BY_TYPE, _BY_CHANNEL, _BY_BOTH = 0, 1, 2, 3
+
+
+class MetricRule(NamedTuple):
+    """How one payload value becomes a metric."""
+
+    metric: str
+    divisor: float
+    unit: str
+    transform: str
+
+    def convert(self, value: Any) -> float:
+        """Convert a raw payload value to the metric's unit. Raises ValueError/TypeError."""
+        return _convert(self.compile(), value)
+
+    def compile(self) -> tuple[str, float, str, int]:
+        """Flatten to the (metric, divisor, unit, transform code) tuple used on the hot path."""
+        return (self.metric, float(self.divisor), self.unit, _TRANSFORM_CODES.get(self.transform, _PLAIN))
+
+
+def _convert(entry: tuple[str, float, str, int], value: Any) -> float:
+    _, divisor, _, code = entry
+    if code == _ONOFF:
+        return 1.0 if value == "on" else 0.0
+    result = float(value)
+    if divisor != 1:
+        result /= divisor
+    if code == _ABS:
+        return abs(result)
+    return result
+
+
+class Decoded(NamedTuple):
+    """Output of decoding one message: (metric, value, unit) tuples and alarm flags."""
+
+    measurements: list[tuple[str, float, str]]
+    alarms: dict[str, bool]
+
+
+class TopicSpec:
+    """Compiled decoding rules for one topic suffix.
+
+    List payload entries are matched on (channel, measurement, type). Rules are
+    compiled into a dict keyed on measurement name, each holding either the rule
+    itself or a second dict keyed on whichever of channel/type the rules for that
+    measurement actually distinguish, so most entries cost one or two dict lookups.
+    Dict payloads walk a precompiled field list.
+    """
+
+    def __init__(self, suffix: str):
+        self.suffix = suffix
+        # (channel, measurement, type) -> rule; None in channel/type means "any"
+        self.items: dict[tuple[str | None, str, str | None], MetricRule] = {}
+        # Which of (channel, type) to key on, most specific first
+        self.masks: list[tuple[bool, bool]] = []
+        # Ordered (field, rule) pairs for dict payloads
+        self.fields: list[tuple[str, MetricRule]] = []
+        self.known_fields: set[str] = set()
+        self.wildcard: MetricRule | None = None
+
+        self._by_measurement: dict[str, tuple[int, Any]] = {}
+        self._field_entries: list[tuple[str, tuple]] = []
+        self._fallback_fields = False
+
+    def add(self, row: dict[str, str]):
+        """Add one mapping table row."""
+        transform = row["transform"]
+        rule = MetricRule(
+            metric=row["metric"],
+            divisor=float(row["divisor"] or 1),
+            unit=row["unit"],
+            transform=transform,
+        )
+        field = row["field"]
+
+        if row["measurement"]:
+            channel = row["channel"] or None
+            value_type = row["type"] or None
+            self.items[(channel, row["measurement"], value_type)] = rule
+            mask = (channel is not None, value_type is not None)
+            if mask not in self.masks:
+                self.masks.append(mask)
+                # Most specific first: (True, True), (True, False), (False, True), (False, False)
+                self.masks.sort(key=lambda m: (not m[0], not m[1]))
+            self._compile_measurement(row["measurement"])
+        elif field == WILDCARD:
+            self.wildcard = rule
+        elif field:
+            self.known_fields.add(field)
+            if transform != "ignore":
+                # Several fields for one metric act as fallbacks: the first present wins
+                if any(existing.metric == rule.metric for _, existing in self.fields):
+                    self._fallback_fields = True
+                self.fields.append((field, rule))
+                self._field_entries.append((field, rule.compile()))
+
+    def _compile_measurement(self, measurement: str):
+        rules = {
+            (channel, value_type): rule.compile()
+            for (channel, name, value_type), rule in self.items.items()
+            if name == measurement
+        }
+        if list(rules) == [(None, None)]:
+            self._by_measurement[measurement] = (_DIRECT, rules[(None, None)])
+        elif all(channel is None for channel, _ in rules):
+            self._by_measurement[measurement] = (_BY_TYPE, {t: e for (_, t), e in rules.items()})
+        elif all(value_type is None for _, value_type in rules):
+            self._by_measurement[measurement] = (_BY_CHANNEL, {c: e for (c, _), e in rules.items()})
+        else:
+            self._by_measurement[measurement] = (_BY_BOTH, rules)
+
+    def lookup(self, channel: str | None, measurement: str | None, value_type: str | None) -> MetricRule | None:
+        """Find the most specific item rule matching a list payload entry."""
+        items = self.items
+        for use_channel, use_type in self.masks:
+            rule = items.get((
+                channel if use_channel else None,
+                measurement,
+                value_type if use_type else None,
+            ))
+            if rule is not None:
+                return rule
+        return None
+
+    def decode(self, payload: Any) -> Decoded:
+        """Decode a parsed JSON payload into measurements and alarm flags."""
+        measurements: list[tuple[str, float, str]] = []
+        alarms: dict[str, bool] = {}
+
+        if isinstance(payload, list) and self.items:
+            self._decode_items(payload, measurements)
+            return Decoded(measurements, alarms)
+
+        if isinstance(payload, list):
+            # Dict topics are sometimes published as a single-element list
+            payload = payload[0] if payload else None
+        if not isinstance(payload, dict):
+            return Decoded(measurements, alarms)
+
+        append = measurements.append
+        seen = set() if self._fallback_fields else None
+        for field, entry in self._field_entries:
+            value = payload.get(field)
+            if value is None:
+                continue
+            metric = entry[0]
+            if seen is not None:
+                if metric in seen:
+                    continue
+                seen.add(metric)
+            try:
+                if entry[3] == _PLAIN and value.__class__ is int:
+                    append((metric, value / entry[1], entry[2]))
+                else:
+                    append((metric, _convert(entry, value), entry[2]))
+            except (ValueError, TypeError):
+                if seen is not None:
+                    seen.discard(metric)
+
+        wildcard = self.wildcard
+        if wildcard is not None:
+            known = self.known_fields
+            if wildcard.transform == "alarm":
+                for key, value in payload.items():
+                    if key not in known:
+                        alarms[key] = value == "1"
+            else:
+                for key, value in payload.items():
+                    if key not in known and isinstance(value, (int, float)):
+                        measurements.append((wildcard.metric.format(field=key), float(value), wildcard.unit))
+
+        return Decoded(measurements, alarms)
+
+    def _decode_items(self, payload: list, measurements: list[tuple[str, float, str]]):
+        by_measurement = self._by_measurement
+        append = measurements.append
+        for item in payload:
+            try:
+                value = item["value"]
+                compiled = by_measurement.get(item["measurement"])
+            except (KeyError, TypeError):
+                continue
+            if compiled is None or value is None:
+                continue
+
+            mode, entry = compiled
+            if mode == _BY_TYPE:
+                entry = entry.get(item.get("type"), entry.get(None))
+            elif mode == _BY_CHANNEL:
+                entry = entry.get(item.get("channel"), entry.get(None))
+            elif mode == _BY_BOTH:
+                channel = item.get("channel")
+                value_type = item.get("type")
+                entry = (
+                    entry.get((channel, value_type))
+                    or entry.get((channel, None))
+                    or entry.get((None, value_type))
+                    or entry.get((None, None))
+                )
+            if entry is None:
+                continue
+
+            try:
+                if entry[3] == _PLAIN:
+                    append((entry[0], value / entry[1], entry[2]))
+                else:
+                    append((entry[0], _convert(entry, value), entry[2]))
+            except TypeError:
+                # Numbers published as strings
+                try:
+                    append((entry[0], _convert(entry, value), entry[2]))
+                except (ValueError, TypeError):
+                    continue
+
+
+def load_topic_map(path: str | Path = TOPIC_MAP_PATH) -> dict[str, TopicSpec]:
+    """Load and compile the mapping table into a dict of topic suffix -> TopicSpec."""
+    with open(path, newline="", encoding="utf-8") as f:
+        lines = [line for line in f if line.strip() and not line.startswith("#")]
+
+    specs: dict[str, TopicSpec] = {}
+    for row in csv.DictReader(lines):
+        suffix = row["topic"]
+        if suffix not in specs:
+            specs[suffix] = TopicSpec(suffix)
+        specs[suffix].add(row)
+    return specs
+
+
+class TopicRouter:
+    """Resolve P3 topics (``pv/PV3/<device_id>/<suffix>``) to their compiled TopicSpec."""
+
+    def __init__(self, specs: dict[str, TopicSpec] | None = None):
+        self.specs = specs if specs is not None else load_topic_map()
+        self.units: dict[str, str] = {}
+        for spec in self.specs.values():
+            for rule in list(spec.items.values()) + [rule for _, rule in spec.fields]:
+                self.units.setdefault(rule.metric, rule.unit)
+
+    def route(self, topic: str) -> tuple[str, TopicSpec] | None:
+        """Return (device_id, spec) for a mapped topic, or None without touching the payload."""
+        parts = topic.split("/", 3)
+        if len(parts) < 4:
+            return None
+        spec = self.specs.get(parts[3])
+        if spec is None:
+            return None
+        return parts[2], spec
+
+    def get(self, suffix: str) -> TopicSpec | None:
+        """Return the spec for a topic suffix such as ``bms/soc``."""
+        return self.specs.get(suffix)
@@ -0,0 +1,161 @@
+"""
+Streaming Hampel outlier filter for metric samples.
+
+Each (device, metric) pair with a rule keeps its last ``window`` raw samples in a fixed
+ring buffer. A sample further from the window median than ``n_sigmas`` robust standard
+deviations (1.4826 * median absolute deviation), and at least ``min_deviation`` away,
+is rejected and replaced by the median. Cost per sample is bounded by the window size.
+
+Rejected samples still enter the window, so a genuine step change is accepted once it
+makes up half the window, and a bad first reading cannot pin the baseline the way a
+comparison with the last accepted value does.
+"""
+
+import json
+import logging
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+# Scale factor from the median absolute deviation to a standard deviation for normal data
+_MAD_SCALE = 1.4826
+
+
+class OutlierRule(NamedTuple):
+    """Reject when |x - median| > max(n_sigmas * 1.4826 * MAD, min_deviation)."""
+
+    window: int = 7
+    n_sigmas: float = 3.0
+    min_deviation: float = 0.0
+    # Samples needed before anything is rejected
+    min_samples: int = 3
+
+
+# Metrics without a rule pass through unfiltered. min_deviation keeps a flat signal
+# (MAD of zero) from rejecting every small real change.
+DEFAULT_RULES: dict[str, OutlierRule] = {
+    "soc": OutlierRule(min_deviation=1.0),
+    "cell_voltage_max": OutlierRule(min_deviation=50.0),
+    "cell_voltage_min": OutlierRule(min_deviation=50.0),
+    "module_voltage_avg": OutlierRule(min_deviation=1.0),
+    "cell_temp_avg": OutlierRule(min_deviation=3.0),
+    "cell_temp_max": OutlierRule(min_deviation=3.0),
+    "cell_temp_min": OutlierRule(min_deviation=3.0),
+    "bms_temp_avg": OutlierRule(min_deviation=3.0),
+    "bms_temp_max": OutlierRule(min_deviation=3.0),
+}
+
+
+def load_rules(path: str | None) -> dict[str, OutlierRule]:
+    """Default rules, overridden per metric by an optional JSON file.
+
+    The file maps metric names to ``{"window": ..., "n_sigmas": ..., "min_deviation": ...,
+    "min_samples": ...}``; ``null`` removes the rule so the metric is not filtered.
+    """
+    rules = dict(DEFAULT_RULES)
+    if not path:
+        return rules
+
+    with open(path, encoding="utf-8") as f:
+        overrides = json.load(f)
+    for metric, spec in overrides.items():
+        if spec is None:
+            rules.pop(metric, None)
+        else:
+            rules[metric] = OutlierRule(**spec)
+    logger.info(f"Loaded {len(overrides)} outlier filter overrides from {path}")
+    return rules
+
+
+class _Window:
+    """Ring buffer of the most recent raw samples of one series."""
+
+    __slots__ = ("values", "pos", "count")
+
+    def __init__(self, size: int):
+        self.values = [0.0] * size
+        self.pos = 0
+        self.count = 0
+
+    def push(self, value: float):
+        self.values[self.pos] = value
+        self.pos = (self.pos + 1) % len(self.values)
+        if self.count < len(self.values):
+            self.count += 1
+
+
+def _median(values: list[float]) -> float:
+    values.sort()
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2
+
+
+class OutlierFilter:
+    """Per device and metric Hampel filter, counting accepted and rejected samples per metric."""
+
+    def __init__(self, rules: dict[str, OutlierRule] | None = None):
+        self.rules = rules if rules is not None else dict(DEFAULT_RULES)
+        self.accepted: dict[str, int] = {}
+        self.rejected: dict[str, int] = {}
+        self._windows: dict[tuple[str, str], _Window] = {}
+
+    def check(self, device_id: str, metric: str, value: float) -> tuple[float, bool]:
+        """Return the filtered value and whether the raw sample was rejected."""
+        rule = self.rules.get(metric)
+        if rule is None:
+            return value, False
+
+        key = (device_id, metric)
+        window = self._windows.get(key)
+        if window is None:
+            window = self._windows[key] = _Window(rule.window)
+        window.push(value)
+
+        if window.count < rule.min_samples:
+            self.accepted[metric] = self.accepted.get(metric, 0) + 1
+            return value, False
+
+        samples = window.values[:window.count]
+        median = _median(samples)
+        deviation = abs(value - median)
+        if deviation > rule.min_deviation:
+            mad = _median([abs(sample - median) for sample in samples])
+            if deviation > rule.n_sigmas * _MAD_SCALE * mad:
+                self.rejected[metric] = self.rejected.get(metric, 0) + 1
+                return median, True
+
+        self.accepted[metric] = self.accepted.get(metric, 0) + 1
+        return value, False
+
+    def filter(self, device_id: str, measurements: list[tuple[str, float, str]]) -> list[tuple[str, float, str]]:
+        """Filter decoded (metric, value, unit) measurements.
+
+        A rejected sample is replaced by the filtered value and kept as ``<metric>_raw``.
+        """
+        out = []
+        for metric, value, unit in measurements:
+            filtered, rejected = self.check(device_id, metric, value)
+            if rejected:
+                logger.warning(
+                    "%s outlier on %s: median=%.2f new=%.2f (Δ=%.2f). Using the median.",
+                    metric,
+                    device_id,
+                    filtered,
+                    value,
+                    abs(value - filtered),
+                )
+                out.append((f"{metric}_raw", value, unit))
+            out.append((metric, filtered, unit))
+        return out
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """Accepted and rejected sample counts per rule."""
+        return {
+            metric: {
+                "accepted": self.accepted.get(metric, 0),
+                "rejected": self.rejected.get(metric, 0),
+            }
+            for metric in self.rules
+        }
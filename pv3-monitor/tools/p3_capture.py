@@ -0,0 +1,515 @@
+#!/usr/bin/env python3
+"""
+Record and replay raw P3 MQTT traffic.
+
+    python tools/p3_capture.py record  capture.p3cap [--host H] [--device-id ID] [--duration S]
+    python tools/p3_capture.py info    capture.p3cap
+    python tools/p3_capture.py replay  capture.p3cap --target mqtt|collector|server|service [--speed N]
+
+`record` stores every message under pv/PV3/<device_id>/# with its arrival time. `replay`
+plays a capture back with the original spacing (--speed 1), N times faster (--speed N) or
+as fast as possible (--speed 0), either to an MQTT broker or straight into one of the
+parsers:
+
+    mqtt       publish to --host/--port (e.g. a local mosquitto)
+    collector  the standalone collector's MessageProcessor and sinks (configured by the
+               usual collector environment variables, e.g. SINKS=ndjson)
+    server     the backend's ServerMQTTCollector, with its window timer and writer
+               (needs DATABASE_URL)
+    service    the backend's MQTTService._on_message and its topic handlers
+
+Capture format: an 8-byte header, then zlib-compressed blocks of records, then an index
+of the blocks and a fixed-size footer. Each block has a small uncompressed header (size,
+record count, first and last timestamp), so `info` and --start/--duration seek without
+decompressing, and a capture cut short by a crash is still readable up to its last
+complete block.
+"""
+
+import argparse
+import asyncio
+import os
+import struct
+import sys
+import time
+import zlib
+from collections import Counter
+from types import SimpleNamespace
+from typing import BinaryIO, Iterator, NamedTuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MAGIC = b"P3CAP"
+VERSION = 1
+HEADER = struct.Struct("<5sBxx")  # magic, version
+BLOCK_HEADER = struct.Struct("<IIdd")  # compressed size, records, first and last timestamp
+RECORD = struct.Struct("<IHI")  # microseconds since block start, topic length, payload length
+INDEX_ENTRY = struct.Struct("<QIdd")  # block offset, records, first and last timestamp
+FOOTER = struct.Struct("<QI8s")  # index offset, blocks, end marker
+END_MARKER = b"P3CAPEND"
+
+# Record offsets are 32-bit microseconds, so a block must not span more than ~71 minutes
+MAX_BLOCK_SECONDS = 3600.0
+
+
+class BlockInfo(NamedTuple):
+    """Location and extent of one block."""
+
+    offset: int
+    records: int
+    first_ts: float
+    last_ts: float
+
+
+class CaptureWriter:
+    """Append (timestamp, topic, payload) records to a capture file.
+
+    Records are buffered and written as one compressed block once the buffer reaches
+    block_bytes or its first record is flush_seconds old, so an interrupted recording
+    loses at most that much.
+    """
+
+    def __init__(self, path: str, block_bytes: int = 256 * 1024, flush_seconds: float = 5.0, level: int = 6):
+        self.path = path
+        self.block_bytes = block_bytes
+        self.flush_seconds = min(flush_seconds, MAX_BLOCK_SECONDS)
+        self.level = level
+        self.records = 0
+        self.raw_bytes = 0
+        self.blocks: list[BlockInfo] = []
+
+        self._file = open(path, "wb")
+        self._file.write(HEADER.pack(MAGIC, VERSION))
+        self._buffer = bytearray()
+        self._count = 0
+        self._first_ts = 0.0
+        self._last_ts = 0.0
+
+    def write(self, timestamp: float, topic: str, payload: bytes):
+        if self._count == 0:
+            self._first_ts = timestamp
+        elif timestamp - self._first_ts >= self.flush_seconds:
+            self.flush()
+            self._first_ts = timestamp
+        encoded = topic.encode()
+        offset_us = max(0, round((timestamp - self._first_ts) * 1_000_000))
+        self._buffer += RECORD.pack(offset_us, len(encoded), len(payload))
+        self._buffer += encoded
+        self._buffer += payload
+        self._count += 1
+        self._last_ts = max(self._last_ts, timestamp)
+        self.records += 1
+        self.raw_bytes += len(encoded) + len(payload)
+        if len(self._buffer) >= self.block_bytes:
+            self.flush()
+
+    def flush_if_due(self, now: float):
+        """Write the buffered records if the oldest has waited flush_seconds, even when traffic stops."""
+        if self._count and now - self._first_ts >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered records as one block."""
+        if not self._count:
+            return
+        data = zlib.compress(bytes(self._buffer), self.level)
+        offset = self._file.tell()
+        self._file.write(BLOCK_HEADER.pack(len(data), self._count, self._first_ts, self._last_ts))
+        self._file.write(data)
+        self._file.flush()
+        self.blocks.append(BlockInfo(offset, self._count, self._first_ts, self._last_ts))
+        self._buffer.clear()
+        self._count = 0
+        self._last_ts = 0.0
+
+    def close(self):
+        """Write the last block, the index and the footer."""
+        self.flush()
+        index_offset = self._file.tell()
+        for block in self.blocks:
+            self._file.write(INDEX_ENTRY.pack(*block))
+        self._file.write(FOOTER.pack(index_offset, len(self.blocks), END_MARKER))
+        self._file.close()
+
+    @property
+    def size(self) -> int:
+        return self._file.tell() if not self._file.closed else os.path.getsize(self.path)
+
+
+class CaptureReader:
+    """Read a capture file, using its index when present."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file: BinaryIO = open(path, "rb")
+        magic, version = HEADER.unpack(self._file.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a P3 capture file")
+        if version != VERSION:
+            raise ValueError(f"{path} has unsupported capture version {version}")
+        self.indexed = True
+        self.blocks = self._read_index()
+        if self.blocks is None:
+            self.indexed = False
+            self.blocks = self._scan_blocks()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def records(self) -> int:
+        return sum(block.records for block in self.blocks)
+
+    @property
+    def start(self) -> float:
+        return self.blocks[0].first_ts if self.blocks else 0.0
+
+    @property
+    def end(self) -> float:
+        return max((block.last_ts for block in self.blocks), default=0.0)
+
+    def _read_index(self) -> list[BlockInfo] | None:
+        size = os.fstat(self._file.fileno()).st_size
+        if size < HEADER.size + FOOTER.size:
+            return None
+        self._file.seek(size - FOOTER.size)
+        index_offset, count, marker = FOOTER.unpack(self._file.read(FOOTER.size))
+        if marker != END_MARKER or index_offset + count * INDEX_ENTRY.size != size - FOOTER.size:
+            return None
+        self._file.seek(index_offset)
+        data = self._file.read(count * INDEX_ENTRY.size)
+        return [BlockInfo(*entry) for entry in INDEX_ENTRY.iter_unpack(data)]
+
+    def _scan_blocks(self) -> list[BlockInfo]:
+        """Rebuild the index of a capture that was not closed, stopping at the first incomplete block."""
+        size = os.fstat(self._file.fileno()).st_size
+        blocks = []
+        offset = HEADER.size
+        while offset + BLOCK_HEADER.size <= size:
+            self._file.seek(offset)
+            length, count, first_ts, last_ts = BLOCK_HEADER.unpack(self._file.read(BLOCK_HEADER.size))
+            if offset + BLOCK_HEADER.size + length > size:
+                break
+            blocks.append(BlockInfo(offset, count, first_ts, last_ts))
+            offset += BLOCK_HEADER.size + length
+        return blocks
+
+    def read_block(self, block: BlockInfo) -> Iterator[tuple[float, str, bytes]]:
+        self._file.seek(block.offset)
+        length, _, first_ts, _ = BLOCK_HEADER.unpack(self._file.read(BLOCK_HEADER.size))
+        data = memoryview(zlib.decompress(self._file.read(length)))
+        pos = 0
+        while pos < len(data):
+            offset_us, topic_len, payload_len = RECORD.unpack_from(data, pos)
+            pos += RECORD.size
+            topic = str(data[pos:pos + topic_len], "utf-8")
+            pos += topic_len
+            payload = bytes(data[pos:pos + payload_len])
+            pos += payload_len
+            yield first_ts + offset_us / 1_000_000, topic, payload
+
+    def messages(self, start: float = 0.0, duration: float | None = None) -> Iterator[tuple[float, str, bytes]]:
+        """Yield (timestamp, topic, payload) from `start` seconds into the capture, for `duration` seconds."""
+        begin = self.start + start
+        end = begin + duration if duration is not None else float("inf")
+        for block in self.blocks:
+            if block.last_ts < begin:
+                continue
+            if block.first_ts > end:
+                break
+            for timestamp, topic, payload in self.read_block(block):
+                if begin <= timestamp <= end:
+                    yield timestamp, topic, payload
+
+
+def rewrite_topic(topic: str, device_id: str | None) -> str:
+    """Replace the device ID in pv/PV3/<device_id>/..., e.g. to replay one battery as another."""
+    if not device_id:
+        return topic
+    parts = topic.split("/", 3)
+    if len(parts) >= 3:
+        parts[2] = device_id
+    return "/".join(parts)
+
+
+# Record
+
+
+def record(args):
+    import paho.mqtt.client as mqtt
+
+    writer = CaptureWriter(args.capture, flush_seconds=args.flush_seconds, level=args.level)
+    topic = f"pv/PV3/{args.device_id}/#"
+    deadline = time.monotonic() + args.duration if args.duration else None
+
+    def on_connect(client, userdata, flags, rc, properties):
+        if rc == 0:
+            client.subscribe(topic)
+            print(f"Recording {topic} from {args.host}:{args.port} to {args.capture}")
+        else:
+            print(f"Failed to connect to MQTT broker: {rc}", file=sys.stderr)
+
+    def on_message(client, userdata, msg):
+        writer.write(time.time(), msg.topic, msg.payload)
+
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(args.host, args.port, keepalive=60)
+    last_report = time.monotonic()
+    try:
+        while deadline is None or time.monotonic() < deadline:
+            client.loop(timeout=1.0)
+            writer.flush_if_due(time.time())
+            if time.monotonic() - last_report >= 10:
+                print(f"{writer.records} messages, {writer.size / 1024:.0f} KiB")
+                last_report = time.monotonic()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.disconnect()
+        writer.close()
+    ratio = writer.raw_bytes / writer.size if writer.size else 0.0
+    print(
+        f"Recorded {writer.records} messages in {len(writer.blocks)} blocks, "
+        f"{writer.size / 1024:.0f} KiB ({ratio:.1f}x smaller than the raw payloads)"
+    )
+
+
+# Info
+
+
+def info(args):
+    with CaptureReader(args.capture) as reader:
+        size = os.path.getsize(args.capture)
+        span = reader.end - reader.start
+        print(f"file:      {args.capture} ({size / 1024:.0f} KiB, {'indexed' if reader.indexed else 'no index, recovered by scan'})")
+        print(f"blocks:    {len(reader.blocks)}")
+        print(f"messages:  {reader.records}")
+        if reader.blocks:
+            print(f"start:     {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(reader.start))}")
+            print(f"duration:  {span:.1f}s ({reader.records / span if span else 0:.1f} msg/s)")
+        if args.topics:
+            counts = Counter()
+            sizes = Counter()
+            for _, topic, payload in reader.messages():
+                counts[topic] += 1
+                sizes[topic] += len(payload)
+            print(f"\n{'topic':<50} {'messages':>10} {'avg bytes':>10}")
+            for topic, count in counts.most_common():
+                print(f"{topic:<50} {count:>10} {sizes[topic] / count:>10.0f}")
+
+
+# Replay
+
+
+class Pacer:
+    """Hold messages back to their capture time divided by speed (speed 0: no waiting)."""
+
+    def __init__(self, speed: float):
+        self.speed = speed
+        self.max_lag = 0.0
+        self._origin: tuple[float, float] | None = None
+
+    def delay(self, timestamp: float) -> float:
+        """Seconds to wait before sending a message captured at `timestamp`."""
+        if self.speed <= 0:
+            return 0.0
+        now = time.monotonic()
+        if self._origin is None:
+            self._origin = (now, timestamp)
+        wall, capture = self._origin
+        due = wall + (timestamp - capture) / self.speed
+        if due < now:
+            self.max_lag = max(self.max_lag, now - due)
+        return max(0.0, due - now)
+
+
+def _replay_messages(reader: CaptureReader, args) -> Iterator[tuple[float, str, bytes]]:
+    # Each loop is scheduled after the previous one, as if the capture continued
+    span = args.duration if args.duration is not None else reader.end - reader.start - args.start
+    for loop in range(args.loops):
+        shift = loop * span
+        for timestamp, topic, payload in reader.messages(args.start, args.duration):
+            yield timestamp + shift, rewrite_topic(topic, args.device_id), payload
+
+
+def replay_mqtt(reader: CaptureReader, args, pacer: Pacer) -> int:
+    import paho.mqtt.client as mqtt
+
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    client.connect(args.host, args.port, keepalive=60)
+    client.loop_start()
+    sent = 0
+    try:
+        for timestamp, topic, payload in _replay_messages(reader, args):
+            wait = pacer.delay(timestamp)
+            if wait:
+                time.sleep(wait)
+            client.publish(topic, payload, qos=args.qos).wait_for_publish()
+            sent += 1
+    finally:
+        client.loop_stop()
+        client.disconnect()
+    return sent
+
+
+def replay_collector(reader: CaptureReader, args, pacer: Pacer) -> int:
+    sys.path.insert(0, os.path.join(ROOT, "collector"))
+    from mqtt_collector import build_processor, build_sinks
+
+    sinks, spool, replayer = build_sinks()
+    processor = build_processor(sinks)
+    sinks.start()
+    sent = 0
+    next_tick = time.monotonic() + 1.0
+    try:
+        for timestamp, topic, payload in _replay_messages(reader, args):
+            wait = pacer.delay(timestamp)
+            if wait:
+                time.sleep(wait)
+            processor.handle(topic, payload)
+            sent += 1
+            if time.monotonic() >= next_tick:
+                processor.tick()
+                next_tick = time.monotonic() + 1.0
+    finally:
+        processor.flush()
+        sinks.stop()
+        if spool:
+            spool.close()
+    print(f"Sinks: {', '.join(sinks.stats())}")
+    return sent
+
+
+def _backend_path():
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, os.path.join(ROOT, "backend"))
+
+
+async def replay_server(reader: CaptureReader, args, pacer: Pacer) -> int:
+    _backend_path()
+    from app.services.ingest_queue import ingest_queue
+    from app.services.server_collector import ServerMQTTCollector
+
+    collector = ServerMQTTCollector("replay", args.device_id or "replay", interval=args.interval)
+    # Windows are closed and written by the collector's own timer and writer tasks, through
+    # the group-commit queue as in the application
+    ingest_queue.start()
+    collector.start_tasks()
+    sent = 0
+    try:
+        for timestamp, topic, payload in _replay_messages(reader, args):
+            wait = pacer.delay(timestamp)
+            # Yield even at full speed so the timer and writer keep up
+            await asyncio.sleep(wait)
+            collector.handle_message(SimpleNamespace(topic=topic, payload=payload))
+            sent += 1
+    finally:
+        await collector.stop_tasks()
+        await ingest_queue.stop()
+    stats = collector.stats()
+    print(f"Snapshots: {stats['snapshots_written']} written, {stats['snapshots_dropped']} dropped, {stats['write_errors']} failed")
+    return sent
+
+
+async def replay_service(reader: CaptureReader, args, pacer: Pacer) -> int:
+    _backend_path()
+    from app.services.ingest_queue import ingest_queue
+    from app.services.mqtt_client import mqtt_service, setup_mqtt_handlers
+
+    setup_mqtt_handlers()
+    mqtt_service.set_event_loop(asyncio.get_running_loop())
+    ingest_queue.start()
+    mqtt_service.start_consumer()
+    sent = 0
+    try:
+        for timestamp, topic, payload in _replay_messages(reader, args):
+            wait = pacer.delay(timestamp)
+            # Handlers run on this loop's consumer task; yield so it keeps up with the replay
+            await asyncio.sleep(wait)
+            # Unlike a live broker, the replay can wait for room rather than overflow the handoff queue
+            while len(mqtt_service._inbox) >= mqtt_service.capacity:
+                await asyncio.sleep(0.001)
+            mqtt_service._on_message(None, None, SimpleNamespace(topic=topic, payload=payload))
+            sent += 1
+    finally:
+        # Handle and commit everything still queued before the loop closes
+        await mqtt_service.close()
+        await ingest_queue.stop()
+    stats = mqtt_service.stats()
+    print(f"Handoff queue: {stats['handled']} handled in {stats['batches']} batches, {stats['dropped']} dropped")
+    return sent
+
+
+def replay(args):
+    with CaptureReader(args.capture) as reader:
+        if not reader.indexed:
+            print("Capture has no index (recording was interrupted); replaying the complete blocks")
+        pacer = Pacer(args.speed)
+        speed = f"{args.speed:g}x" if args.speed > 0 else "maximum speed"
+        print(f"Replaying {args.capture} to {args.target} at {speed}")
+
+        started = time.monotonic()
+        cpu_started = time.process_time()
+        if args.target == "mqtt":
+            sent = replay_mqtt(reader, args, pacer)
+        elif args.target == "collector":
+            sent = replay_collector(reader, args, pacer)
+        elif args.target == "server":
+            sent = asyncio.run(replay_server(reader, args, pacer))
+        else:
+            sent = asyncio.run(replay_service(reader, args, pacer))
+        elapsed = time.monotonic() - started
+        cpu = time.process_time() - cpu_started
+
+    print(
+        f"Replayed {sent} messages in {elapsed:.2f}s ({sent / elapsed if elapsed else 0:,.0f} msg/s, "
+        f"{cpu:.2f}s CPU, max lag behind schedule {pacer.max_lag * 1000:.0f}ms)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rec = commands.add_parser("record", help="capture raw P3 MQTT traffic")
+    rec.add_argument("capture")
+    rec.add_argument("--host", default=os.getenv("MQTT_HOST", "192.168.1.215"))
+    rec.add_argument("--port", type=int, default=int(os.getenv("MQTT_PORT", "1883")))
+    rec.add_argument("--device-id", default=os.getenv("P3_DEVICE_ID", "+"), help="device to record (default: all)")
+    rec.add_argument("--duration", type=float, help="stop after this many seconds")
+    rec.add_argument("--flush-seconds", type=float, default=5.0, help="write a block at least this often")
+    rec.add_argument("--level", type=int, default=6, help="zlib compression level")
+    rec.set_defaults(func=record)
+
+    inf = commands.add_parser("info", help="summarise a capture")
+    inf.add_argument("capture")
+    inf.add_argument("--topics", action="store_true", help="count messages per topic")
+    inf.set_defaults(func=info)
+
+    rep = commands.add_parser("replay", help="play a capture back")
+    rep.add_argument("capture")
+    rep.add_argument("--target", choices=["mqtt", "collector", "server", "service"], default="mqtt")
+    rep.add_argument("--speed", type=float, default=1.0, help="1 = real time, N = N times faster, 0 = maximum")
+    rep.add_argument("--start", type=float, default=0.0, help="seconds into the capture to start at")
+    rep.add_argument("--duration", type=float, help="seconds of the capture to replay")
+    rep.add_argument("--loops", type=int, default=1, help="replay the selection this many times")
+    rep.add_argument("--device-id", help="rewrite the device ID in every topic")
+    rep.add_argument("--host", default="localhost", help="broker for --target mqtt")
+    rep.add_argument("--port", type=int, default=1883, help="broker port for --target mqtt")
+    rep.add_argument("--qos", type=int, default=0, choices=[0, 1, 2], help="QoS for --target mqtt")
+    rep.add_argument("--interval", type=int, default=5, help="store interval for --target server")
+    rep.set_defaults(func=replay)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()